@@ -52,13 +52,61 @@ OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
 THE SOFTWARE.
 """
 
-import csv
+import functools
+import itertools
 import json
+import math
+import multiprocessing
 import os
 
+import numpy as np
+
+from Bio import SeqIO
 from Bio.Blast.Applications import NcbiblastnCommandline
 
 from . import eprimer3
+from .primersearch import NT_CODES, reverse_complement
+
+
+# Query identifiers for individual oligo sequences screened with
+# build_oligo_commands()
+OLIGO_PREFIX = 'pdpoligo%08d'
+
+# Query identifiers in batched BLAST screens are prefixed with the index of
+# the originating genome in the collection; BLAST+ may interpret arbitrary
+# characters in genome names, so these are not used
+BATCH_PREFIX = 'pdp%06d_'
+
+# Longest primer oligo expected in a screen (Primer3's upper limit on
+# PRIMER_MAX_SIZE); used to choose the native screen seeds
+SCREEN_MAXOLIGO = 36
+
+# Spaced seeds of the native screen: each seed code is made from the
+# symbols at the '1' positions. Between them, these seeds hit every
+# ungapped alignment of 16-36 bases with at least 90% identity (see
+# screen_seeds()), and are long enough to be specific in large databases
+SCREEN_SEEDS = ('111111011111', '111011010110111', '111100111001111')
+
+# Seeds occurring more often than this in the screening database are not
+# extended (as low-complexity sequence is masked by BLAST+)
+SCREEN_MAXHITS = 10000
+
+# Number of primer oligos searched at once by the native screen
+SCREEN_BATCHSIZE = 4096
+
+# Maximum number of candidate diagonals extended at once by the native
+# screen; this bounds memory use when seeds have many hits
+SCREEN_MAXCANDIDATES = 2 ** 15
+
+# Ungapped alignment scores, and Karlin-Altschul parameters for these
+# scores, as used by BLASTN+ -task blastn-short
+SCREEN_REWARD = 1
+SCREEN_PENALTY = -3
+SCREEN_LAMBDA = 1.374
+SCREEN_K = 0.711
+
+# Maximum E-value of hits reported by the native screen (BLASTN+ default)
+SCREEN_EVALUE = 10
 
 
 def build_commands(collection, blastexe, blastdb, outdir=None):
@@ -92,6 +140,83 @@ def build_commands(collection, blastexe, blastdb, outdir=None):
     return clines
 
 
+def build_batch_commands(collection, blastexe, blastdb, outdir, nchunks=1,
+                         threads=1):
+    """Builds and returns a list of batched BLASTN screening command lines
+
+    - collection    PDPCollection describing analysis inputs
+    - blastexe      Path to BLASTN executable
+    - blastdb       Path to screening BLAST database
+    - outdir        Path to output directory
+    - nchunks       Number of query files (and so BLASTN jobs) to write
+    - threads       Number of threads for each BLASTN job
+
+    Every BLASTN job loads the screening database, which can be large (e.g.
+    nt). Rather than one job per genome, as in build_commands(), the primers
+    from all genomes are written to nchunks query files, each holding as
+    near as possible the same number of sequences. Query identifiers are
+    prefixed with the genome's index in the collection (see BATCH_PREFIX),
+    so that the output can be split by genome with demultiplex().
+    """
+    os.makedirs(outdir, exist_ok=True)
+
+    # Collect the primer sequences for each genome, in collection order
+    records = []
+    for idx, g in enumerate(collection.data):
+        stem = os.path.join(outdir, os.path.split(
+            os.path.splitext(g.seqfile)[0])[-1])
+        fastafname = '_'.join([stem, 'primers.fasta'])
+        g.write_primers(fastafname)
+        for record in SeqIO.parse(fastafname, 'fasta'):
+            record.id = BATCH_PREFIX % idx + record.id
+            records.append(record)
+
+    # Split into contiguous, balanced chunks
+    nchunks = max(1, min(nchunks, len(records)))
+    bounds = [len(records) * _ // nchunks for _ in range(nchunks + 1)]
+    clines = []
+    for idx in range(nchunks):
+        fastafname = os.path.join(outdir,
+                                  'batch_%03d_primers.fasta' % (idx + 1))
+        SeqIO.write(records[bounds[idx]:bounds[idx + 1]], fastafname,
+                    'fasta')
+        cline = build_blastscreen_cmd(fastafname, blastexe, blastdb, outdir)
+        if threads > 1:
+            cline.num_threads = threads
+        clines.append(cline)
+    return clines
+
+
+def demultiplex(blastfiles, collection, outdir):
+    """Split batched BLASTN output into one output file per genome
+
+    - blastfiles    Paths to BLASTN output from build_batch_commands() jobs
+    - collection    PDPCollection used to build the batched jobs
+    - outdir        Path to output directory
+
+    The genome prefix is removed from each query identifier, and each
+    genome's hits are written to the file that build_commands() would have
+    produced for that genome, in query order. Returns the list of per-genome
+    output paths, in collection order, for use with apply_screen().
+    """
+    rows = [[] for _ in collection.data]
+    prefixlen = len(BATCH_PREFIX % 0)
+    for blastfile in blastfiles:
+        with open(blastfile, 'r') as bfh:
+            for line in bfh:
+                idx = int(line[len('pdp'):prefixlen - 1])
+                rows[idx].append(line[prefixlen:])
+    outfiles = []
+    for g, lines in zip(collection.data, rows):
+        stem = os.path.join(outdir, os.path.split(
+            os.path.splitext(g.seqfile)[0])[-1])
+        outfname = '_'.join([stem, 'primers.blasttab'])
+        with open(outfname, 'w') as ofh:
+            ofh.writelines(lines)
+        outfiles.append(outfname)
+    return outfiles
+
+
 def build_blastscreen_cmd(queryfile, blastexe, blastdb, outdir=None):
     """Build and return a BLASTN command-line.
 
@@ -151,27 +276,688 @@ def apply_screen(blastfile, primerjson, maxaln=15):
     than maxaln are removed from the set loaded in the JSON file
     """
     # Parse BLASTN output and identify noncompliant primers
+    excluded = excluded_primers(blastfile, maxaln)
+    return write_screened(primerjson, excluded)
+
+
+def apply_alignments(primerjson, alignments, maxaln=15):
+    """Apply longest oligo alignments from a screen to a primer JSON file.
+
+    primerjson    - path to JSON file describing primers
+    alignments    - dictionary of longest alignment length, keyed by oligo
+                    sequence, for every oligo in the primer file
+    maxaln        - the maximum allowed alignment length
+
+    Primer pairs where one or more oligos has alignment length greater
+    than maxaln are removed, and the screened primers are written and the
+    new file path returned as for apply_screen().
+    """
+    primerdata = eprimer3.load_primer_table(primerjson)
     excluded = set()
-    with open(blastfile, 'r') as bfh:
-        reader = csv.reader(bfh, delimiter='\t')
-        for row in reader:
-            if int(row[3]) > maxaln:
-                excluded.add(row[0][:-4])
+    for primer in primerdata:
+        oligos = (primer.forward_seq, primer.reverse_seq, primer.internal_seq)
+        if any(alignments[_] > maxaln for _ in oligos if _):
+            excluded.add(primer.name)
+    return write_screened(primerjson, excluded)
 
-    # Parse primer JSON and remove primer pairs found in excluded
-    primerdata = eprimer3.load_primers(primerjson, 'json')
-    primerdata = [prm for prm in primerdata if prm.name not in excluded]
 
-    # Generate new JSON filename and write primers
-    newstem = os.path.splitext(primerjson)[0] + '_screened'
-    jsonpath = newstem + '.json'
-    eprimer3.write_primers(primerdata, jsonpath, 'json')
+def write_screened(primerjson, excluded):
+    """Write primers from a JSON file, less the excluded primer sets.
+
+    primerjson    - path to JSON (or .npz) file describing primers
+    excluded      - set of names of primer sets to remove
+
+    The string '_screened' is appended to the JSON filestem, and the
+    remaining primer sets are written to new JSON (or .npz, matching the
+    input) and FASTA files. The new JSON file path is returned.
+    """
+    # Parse primer JSON and remove primer pairs found in excluded
+    primerdata = eprimer3.load_primer_table(primerjson)
+    primerdata = primerdata.select([name not in excluded for
+                                    name in primerdata.names])
+
+    # Generate new JSON (or binary, matching the input) filename and write
+    # primers
+    newstem, ext = os.path.splitext(primerjson)
+    newstem += '_screened'
+    jsonpath = newstem + ext
+    eprimer3.write_primers(primerdata, jsonpath,
+                           'npz' if ext.lower() == '.npz' else 'json')
     eprimer3.write_primers(primerdata, newstem + '.fasta', 'fasta')
 
     # Return new JSON filename
     return jsonpath
 
 
+def screen_seedlen(maxaln=15, perc_identity=90, maxlen=SCREEN_MAXOLIGO):
+    """Returns the contiguous seed length needed to find all hits
+
+    - maxaln          the maximum allowed alignment length (see apply_screen())
+    - perc_identity   minimum percentage identity of reported hits
+    - maxlen          length of the longest oligo to be screened
+
+    An ungapped alignment of length L with at least perc_identity identity
+    has at most m = L * (100 - perc_identity) / 100 mismatches, so it
+    contains an exact match of at least (L - m) // (m + 1) bases. The seed
+    length returned is the smallest such match over all alignment lengths
+    that would exclude a primer set (maxaln + 1 to maxlen), so that a
+    ScreenIndex with a contiguous seed of this length finds every such
+    alignment. Spaced seeds (see screen_seeds()) find the same alignments
+    with longer, more specific seeds.
+    """
+    seedlen = 16     # longest contiguous seed a ScreenIndex can hold
+    for alnlen, mismatches in _screen_alignments(maxaln, perc_identity,
+                                                 maxlen):
+        seedlen = min(seedlen, (alnlen - mismatches) // (mismatches + 1))
+    return max(seedlen, 1)
+
+
+@functools.lru_cache()
+def screen_seeds(maxaln=15, perc_identity=90, maxlen=SCREEN_MAXOLIGO):
+    """Returns the native screen seeds needed to find all hits
+
+    - maxaln          the maximum allowed alignment length (see apply_screen())
+    - perc_identity   minimum percentage identity of reported hits
+    - maxlen          length of the longest oligo to be screened
+
+    These are the spaced seeds in SCREEN_SEEDS if, for every alignment
+    that would exclude a primer set (maxaln + 1 to maxlen bases, with at
+    least perc_identity identity), some seed lies wholly within matching
+    bases. Otherwise, a single contiguous seed of length screen_seedlen()
+    is returned.
+    """
+    alignments = _screen_alignments(maxaln, perc_identity, maxlen)
+    # Mismatch patterns are only enumerated for a few mismatches
+    if max(_[1] for _ in alignments) <= 3:
+        masks = [(len(seed), int(seed[::-1], 2)) for seed in SCREEN_SEEDS]
+        if all(any(not (mask << offset) & sum(1 << _ for _ in mismatched)
+                   for span, mask in masks
+                   for offset in range(alnlen - span + 1))
+               for alnlen, mismatches in alignments
+               for mismatched in itertools.combinations(range(alnlen),
+                                                        mismatches)):
+            return SCREEN_SEEDS
+    return ('1' * screen_seedlen(maxaln, perc_identity, maxlen),)
+
+
+def _screen_alignments(maxaln, perc_identity, maxlen):
+    """Returns (length, mismatches) of the shortest alignments to screen
+
+    An ungapped alignment of length L with at least perc_identity identity
+    has at most L * (100 - perc_identity) / 100 mismatches. Any longer
+    alignment contains one of the (length, mismatches) pairs returned, for
+    the shortest alignment to exclude a primer set with each mismatch
+    count.
+    """
+    alignments = {}
+    for alnlen in range(maxaln + 1, max(maxaln + 1, maxlen) + 1):
+        alignments.setdefault(int(alnlen * (100 - perc_identity) // 100),
+                              alnlen)
+    return sorted((alnlen, mismatches) for mismatches, alnlen in
+                  alignments.items())
+
+
+def screen_settings(engine='blastn', seeds=None):
+    """Returns the settings that determine the alignments a screen finds
+
+    - engine    'blastn' for BLASTN+ screens (see build_blastscreen_cmd()),
+                or 'native' for ScreenIndex screens
+    - seeds     seeds of native screens (default from screen_seeds())
+
+    These identify screen results in a primer screen cache (see
+    cache.PDPScreenCache).
+    """
+    if engine == 'native':
+        return {'engine': engine, 'seeds': list(seeds or screen_seeds()),
+                'perc_identity': 90, 'evalue': SCREEN_EVALUE,
+                'maxhits': SCREEN_MAXHITS}
+    return {'engine': engine, 'task': 'blastn-short', 'perc_identity': 90,
+            'ungapped': True, 'max_target_seqs': 1}
+
+
+def primer_oligos(primerfiles):
+    """Returns the set of oligo sequences in the passed primer files."""
+    oligos = set()
+    for primerfile in primerfiles:
+        primers = eprimer3.load_primer_table(primerfile)
+        for field in ('forward_seq', 'reverse_seq', 'internal_seq'):
+            oligos.update(primers.column(field))
+    oligos.discard('')
+    return oligos
+
+
+def build_oligo_commands(oligos, blastexe, blastdb, outdir, nchunks=1,
+                         threads=1):
+    """Builds and returns BLASTN command lines screening oligo sequences
+
+    - oligos        list of oligo sequences
+    - blastexe      Path to BLASTN executable
+    - blastdb       Path to screening BLAST database
+    - outdir        Path to output directory
+    - nchunks       Number of query files (and so BLASTN jobs) to write
+    - threads       Number of threads for each BLASTN job
+
+    Each oligo is screened once, whichever primer sets it belongs to, with
+    the query identifier OLIGO_PREFIX % (index in oligos). The longest
+    alignment for each oligo can be read from the output with
+    oligo_alignments().
+    """
+    os.makedirs(outdir, exist_ok=True)
+    nchunks = max(1, min(nchunks, len(oligos)))
+    bounds = [len(oligos) * _ // nchunks for _ in range(nchunks + 1)]
+    clines = []
+    for idx in range(nchunks):
+        fastafname = os.path.join(outdir, 'oligos_%03d.fasta' % (idx + 1))
+        with open(fastafname, 'w') as ofh:
+            for oidx in range(bounds[idx], bounds[idx + 1]):
+                ofh.write('>%s\n%s\n' % (OLIGO_PREFIX % oidx, oligos[oidx]))
+        cline = build_blastscreen_cmd(fastafname, blastexe, blastdb, outdir)
+        if threads > 1:
+            cline.num_threads = threads
+        clines.append(cline)
+    return clines
+
+
+def oligo_alignments(blastfiles, oligos):
+    """Returns dictionary of longest alignment length for each oligo
+
+    - blastfiles    Paths to BLASTN output from build_oligo_commands() jobs,
+                    or from ScreenIndex.search() with OLIGO_PREFIX query IDs
+    - oligos        list of oligo sequences used to build the jobs
+
+    Oligos with no alignments have length zero.
+    """
+    lengths = [0] * len(oligos)
+    prefixlen = len(OLIGO_PREFIX % 0)
+    for blastfile in blastfiles:
+        with open(blastfile, 'r') as bfh:
+            for line in bfh:
+                qseqid, _, _, length = line.split('\t', 4)[:4]
+                idx = int(qseqid[prefixlen - 8:prefixlen])
+                lengths[idx] = max(lengths[idx], int(length))
+    return dict(zip(oligos, lengths))
+
+
+def excluded_primers(blastfile, maxaln=15):
+    """Return the set of primer set names excluded by a BLASTN screen.
+
+    blastfile     - path to BLASTN output .blasttab file
+    maxaln        - the maximum allowed alignment length
+
+    The file is read a line at a time. BLASTN reports all hits for a query
+    together, so once a query's primer set is excluded, the remaining hits
+    for that query are skipped without being split into columns.
+    """
+    excluded = set()
+    skip = None
+    with open(blastfile, 'r') as bfh:
+        for line in bfh:
+            if skip is not None and line.startswith(skip):
+                continue
+            qseqid, _, _, length = line.split('\t', 4)[:4]
+            # Query IDs are primer set names with an _fwd/_rev/_int suffix
+            if qseqid[:-4] in excluded or int(length) > maxaln:
+                excluded.add(qseqid[:-4])
+                skip = qseqid + '\t'
+    return excluded
+
+
+class ScreenIndex(object):
+
+    """Persistent spaced seed index of a screening FASTA file
+
+    This is a BLAST+-free alternative to screening primers with BLASTN+.
+    The screening sequences are held as an array of nucleotide codes (see
+    primersearch.NT_CODES), with records separated by an invalid symbol,
+    and every position that starts a window of valid symbols as long as a
+    seed is indexed by the integer code of that seed (see seed_codes()).
+    The sorted codes of all seeds, and their positions, are written to
+    NumPy files alongside a JSON description of the source file, and
+    memory-mapped when the index is loaded, so an index is built once and
+    reused, and is shared between processes by the OS page cache.
+
+    Primers are screened by search(): every seed in each oligo (on both
+    strands) is looked up in the index at once, and each hit diagonal is
+    extended without gaps to the best-scoring alignment, as for BLASTN+
+    -task blastn-short -ungapped.
+    """
+
+    def __init__(self, stem):
+        """Load the index with the passed path stem
+
+        - stem      path stem for the index files (see build())
+        """
+        self._stem = stem
+        with open(stem + '.json', 'r') as ifh:
+            self._meta = json.load(ifh)
+        self._seeds = tuple(self._meta['seeds'])
+        self._ids = self._meta['ids']
+        self._starts = np.array(self._meta['starts'], dtype=np.int64)
+        self._seq = np.load(stem + '_seq.npy', mmap_mode='r')
+        self._codes = np.load(stem + '_kmers.npy', mmap_mode='r')
+        self._positions = np.load(stem + '_pos.npy', mmap_mode='r')
+
+    @staticmethod
+    def index_stem(fastafile, indexdir=None, seeds=None):
+        """Return the index path stem for a screening FASTA file
+
+        - fastafile     path to screening sequences
+        - indexdir      directory for the index files; if None, the index
+                        is placed alongside the FASTA file
+        - seeds         seeds of the index (default from screen_seeds())
+
+        Each seed pattern is written in the stem as a hexadecimal number.
+        """
+        seeds = seeds or screen_seeds()
+        if indexdir is None:
+            indexdir = os.path.split(fastafile)[0]
+        return os.path.join(indexdir, '%s.pdpk_%s' % (
+            os.path.split(fastafile)[-1],
+            '_'.join(['%x' % int(seed, 2) for seed in seeds])))
+
+    @classmethod
+    def build(cls, fastafile, stem, seeds=None):
+        """Build, write and return the index of a screening FASTA file
+
+        - fastafile     path to screening sequences
+        - stem          path stem for the index files: stem.json,
+                        stem_seq.npy, stem_kmers.npy and stem_pos.npy
+        - seeds         seed patterns of '1' (symbols in the seed code)
+                        and '0' (any symbol), each starting and ending
+                        with '1' and with at most 16 '1's (default from
+                        screen_seeds())
+        """
+        seeds = tuple(seeds or screen_seeds())
+        for seed in seeds:
+            if seed.strip('01') or not seed.startswith('1') or \
+                    not seed.endswith('1') or not seed.count('1') <= 16:
+                raise ValueError("Seeds must be patterns of 0 and 1, " +
+                                 "starting and ending with 1 and with " +
+                                 "at most 16 1s, got %s" % seed)
+        os.makedirs(os.path.split(stem)[0] or '.', exist_ok=True)
+        ids, starts, seqs, offset = [], [], [], 0
+        for record in SeqIO.parse(fastafile, 'fasta'):
+            ids.append(record.id)
+            starts.append(offset)
+            seqs.append(NT_CODES[np.frombuffer(
+                str(record.seq).encode('ascii'), dtype=np.uint8)])
+            seqs.append(np.full(1, 4, dtype=np.uint8))   # record separator
+            offset += len(record) + 1
+        seq = np.concatenate(seqs) if seqs else np.zeros(0, dtype=np.uint8)
+
+        # Code of each seed at every position whose window is all valid
+        codes, positions = [], []
+        for seedidx in range(len(seeds)):
+            seedcodes, valid = seed_codes(seq, seeds, seedidx)
+            keep = np.flatnonzero(valid)
+            codes.append(seedcodes[keep])
+            positions.append(keep)
+        codes = np.concatenate(codes)
+        positions = np.concatenate(positions)
+        order = np.argsort(codes, kind='stable')
+        postype = np.uint32 if len(seq) < 2 ** 32 else np.int64
+        np.save(stem + '_seq.npy', seq)
+        np.save(stem + '_kmers.npy', codes[order])
+        np.save(stem + '_pos.npy', positions[order].astype(postype))
+
+        stat = os.stat(fastafile)
+        with open(stem + '.json', 'w') as ofh:
+            json.dump({'source': os.path.abspath(fastafile),
+                       'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns,
+                       'seeds': list(seeds), 'ids': ids, 'starts': starts},
+                      ofh)
+        return cls(stem)
+
+    @classmethod
+    def open(cls, fastafile, indexdir=None, seeds=None):
+        """Return the index of a screening FASTA file, building it if needed
+
+        - fastafile     path to screening sequences
+        - indexdir      directory for the index files (see index_stem())
+        - seeds         seeds of the index (default from screen_seeds())
+
+        An existing index is reused if it was built from a file with the
+        same path, size and modification time, and the same seeds.
+        """
+        seeds = tuple(seeds or screen_seeds())
+        stem = cls.index_stem(fastafile, indexdir, seeds)
+        stat = os.stat(fastafile)
+        try:
+            with open(stem + '.json', 'r') as ifh:
+                meta = json.load(ifh)
+            if (meta['source'], meta['size'], meta['mtime_ns'],
+                    tuple(meta['seeds'])) == (os.path.abspath(fastafile),
+                                              stat.st_size,
+                                              stat.st_mtime_ns, seeds):
+                return cls(stem)
+        except (OSError, ValueError, KeyError):
+            pass
+        return cls.build(fastafile, stem, seeds)
+
+    def search(self, queries, perc_identity=90, evalue=SCREEN_EVALUE,
+               maxhits=SCREEN_MAXHITS, logger=None):
+        """Return BLASTN tabular output rows for the passed query sequences
+
+        - queries           iterable of (query ID, sequence) tuples
+        - perc_identity     minimum percentage identity of reported hits
+        - evalue            maximum E-value of reported hits
+        - maxhits           seeds with more hits than this are ignored
+        - logger            a logger module logger (optional)
+
+        One row (as for BLASTN+ -outfmt 6) is returned for each diagonal on
+        which a query seed hits the index, with the best-scoring ungapped
+        alignment on that diagonal, if it meets perc_identity and evalue.
+        Rows are ordered by query, then by decreasing bit score. E-values
+        are calculated from the query and database lengths and the
+        Karlin-Altschul parameters for the alignment scores, without edge
+        corrections, so they are approximate.
+
+        Alignments are only found if they contain a hit for one of the
+        index seeds (see screen_seeds()), and the seed is not ignored
+        for having more than maxhits hits; a warning is logged if any
+        seeds are ignored. All qualifying hits are reported, not only
+        those for the best-matching target sequence.
+        """
+        rows, skipped = self._search(queries, perc_identity, evalue,
+                                     maxhits)
+        if skipped and logger:
+            logger.warning("%d query seeds have more than %d hits in %s " +
+                           "and were not extended; alignments " +
+                           "containing only these seeds are not reported",
+                           skipped, maxhits, self._meta['source'])
+        return rows
+
+    def _search(self, queries, perc_identity, evalue, maxhits):
+        """Return search() output rows, and the number of ignored seeds."""
+        queries = list(queries)
+        rows, skipped = [], 0
+        for start in range(0, len(queries), SCREEN_BATCHSIZE):
+            batchrows, batchskipped = self.__search_batch(
+                queries[start:start + SCREEN_BATCHSIZE], perc_identity,
+                evalue, maxhits)
+            rows.extend(batchrows)
+            skipped += batchskipped
+        return rows, skipped
+
+    def __search_batch(self, queries, perc_identity, evalue, maxhits):
+        """Return output rows, and ignored seeds, for a batch of queries."""
+        if not queries:
+            return [], 0
+        # Encode each query on both strands; padding (5) matches nothing
+        strands = [_[1].upper() for _ in queries] + \
+            [reverse_complement(_[1].upper()) for _ in queries]
+        lengths = np.array([len(_) for _ in strands], dtype=np.int64)
+        width = int(lengths.max()) + 1
+        qcodes = np.full((len(strands), width), 5, dtype=np.int16)
+        for idx, seq in enumerate(strands):
+            qcodes[idx, :len(seq)] = NT_CODES[np.frombuffer(
+                seq.encode('ascii'), dtype=np.uint8)]
+
+        # Codes of each seed at query positions with a valid window
+        qrows, qpos, seedcodes = [], [], []
+        for seedidx in range(len(self._seeds)):
+            codes, valid = seed_codes(qcodes, self._seeds, seedidx)
+            rows, positions = np.nonzero(valid)
+            qrows.append(rows)
+            qpos.append(positions)
+            seedcodes.append(codes[rows, positions])
+        qrows = np.concatenate(qrows)
+        qpos = np.concatenate(qpos)
+        seedcodes = np.concatenate(seedcodes).astype(self._codes.dtype)
+        # Sorted seeds are looked up with better memory locality
+        order = np.argsort(seedcodes, kind='stable')
+        lower = np.empty(len(order), dtype=np.int64)
+        upper = np.empty(len(order), dtype=np.int64)
+        lower[order] = np.searchsorted(self._codes, seedcodes[order], 'left')
+        upper[order] = np.searchsorted(self._codes, seedcodes[order],
+                                       'right')
+        counts = upper - lower
+        skipped = int((counts > maxhits).sum())
+        counts[counts > maxhits] = 0
+
+        # Seeds are ordered by query strand, so that candidate diagonals
+        # are gathered and extended in chunks of whole query strands
+        order = np.argsort(qrows, kind='stable')
+        qrows, qpos = qrows[order], qpos[order]
+        lower, counts = lower[order], counts[order]
+        totals = np.cumsum(counts)
+        # Diagonals start at least one query width before the sequence
+        span = len(self._seq) + width
+        found, start = [], 0
+        while start < len(counts):
+            stop = int(np.searchsorted(
+                totals, totals[start] - counts[start] + SCREEN_MAXCANDIDATES,
+                'right'))
+            stop = min(max(stop, start + 1), len(counts))
+            # End the chunk on a query strand boundary
+            rowstart = int(np.searchsorted(qrows, qrows[stop - 1], 'left'))
+            if stop < len(counts) and qrows[stop] == qrows[stop - 1]:
+                stop = rowstart if rowstart > start else int(
+                    np.searchsorted(qrows, qrows[stop - 1], 'right'))
+            # Index hits for each seed give candidate diagonals
+            seedidx = np.repeat(np.arange(start, stop), counts[start:stop])
+            hitidx = lower[seedidx] + np.arange(len(seedidx)) - \
+                (totals[seedidx] - counts[seedidx]) + \
+                (totals[start] - counts[start])
+            diagonals = self._positions[hitidx].astype(np.int64) - \
+                qpos[seedidx]
+            candidates = np.unique(qrows[seedidx] * span + diagonals + width)
+            for cstart in range(0, len(candidates), SCREEN_MAXCANDIDATES):
+                chunk = candidates[cstart:cstart + SCREEN_MAXCANDIDATES]
+                found.append(self.__extend(
+                    qcodes, lengths, chunk // span, chunk % span - width,
+                    perc_identity, evalue))
+            start = stop
+        if not found:
+            return [], skipped
+        cqrows, cdiags, starts, ends, nmatches, bits, evalues = [
+            np.concatenate(_) for _ in zip(*found)]
+
+        # Convert to BLAST tabular output coordinates: hits to the reverse
+        # complement of a query are reported on the minus strand
+        qlen, alnlen = lengths[cqrows], ends - starts
+        qidx, minus = cqrows % len(queries), cqrows >= len(queries)
+        tstarts = cdiags + starts
+        records = np.searchsorted(self._starts, tstarts, 'right') - 1
+        sstarts = tstarts - self._starts[records] + 1
+        sends = sstarts + alnlen - 1
+        qstarts, qends = starts + 1, ends
+        qstarts, qends = (np.where(minus, qlen - qends + 1, qstarts),
+                          np.where(minus, qlen - qstarts + 1, qends))
+        sstarts, sends = (np.where(minus, sends, sstarts),
+                          np.where(minus, sstarts, sends))
+        order = np.lexsort((-bits, qidx))
+        return list(zip(
+            [queries[_][0] for _ in qidx[order].tolist()],
+            [self._ids[_] for _ in records[order].tolist()],
+            (100. * nmatches / alnlen)[order].tolist(),
+            alnlen[order].tolist(), (alnlen - nmatches)[order].tolist(),
+            [0] * len(order), qstarts[order].tolist(),
+            qends[order].tolist(), sstarts[order].tolist(),
+            sends[order].tolist(), evalues[order].tolist(),
+            bits[order].tolist())), skipped
+
+    def __extend(self, qcodes, lengths, cqrows, cdiags, perc_identity,
+                 evalue):
+        """Return the passing alignments on candidate diagonals
+
+        - qcodes            query strand nucleotide codes
+        - lengths           query strand lengths
+        - cqrows            query strand of each candidate
+        - cdiags            target position of each candidate's query start
+        - perc_identity     minimum percentage identity of alignments
+        - evalue            maximum E-value of alignments
+
+        Returns arrays of query strand, diagonal, query start and end
+        (zero-indexed, end-exclusive), matches, bit score and E-value, for
+        each candidate whose best alignment passes.
+        """
+        width = qcodes.shape[1]
+        # Score each candidate diagonal over the whole query; symbols
+        # outside the query or target, and non-ACGT symbols, end alignments
+        tidx = cdiags[:, None] + np.arange(width)[None, :]
+        inrange = (tidx >= 0) & (tidx < len(self._seq))
+        tcodes = np.where(inrange, self._seq[np.clip(tidx, 0,
+                                                      len(self._seq) - 1)], 4)
+        query = qcodes[cqrows]
+        valid = (tcodes < 4) & (query < 4)
+        matches = valid & (tcodes == query)
+        scores = np.where(matches, SCREEN_REWARD,
+                          np.where(valid, SCREEN_PENALTY,
+                                   -SCREEN_REWARD * width - 1))
+        scores = scores.astype(np.int32)
+
+        # Best-scoring segment: greatest rise in the cumulative score, to
+        # the last such end, from the earliest preceding minimum (so ties
+        # give the longest alignment)
+        total = np.zeros((len(scores), width + 1), dtype=np.int32)
+        np.cumsum(scores, axis=1, out=total[:, 1:])
+        keys = np.minimum.accumulate(
+            total * (width + 1) + np.arange(width + 1)[None, :], axis=1)
+        lows = keys % (width + 1)
+        rises = total - (keys - lows) // (width + 1)
+        ends = width - rises[:, ::-1].argmax(axis=1)
+        rows = np.arange(len(scores))
+        starts = lows[rows, ends]
+        best = rises[rows, ends]
+        alnlen = ends - starts
+        matchsum = np.zeros((len(scores), width + 1), dtype=np.int32)
+        np.cumsum(matches, axis=1, out=matchsum[:, 1:])
+        nmatches = matchsum[rows, ends] - matchsum[rows, starts]
+        bits = (SCREEN_LAMBDA * best - math.log(SCREEN_K)) / math.log(2)
+        evalues = lengths[cqrows] * len(self) * 2 ** -bits
+        passed = np.flatnonzero((best > 0) & (evalues <= evalue) &
+                                (100 * nmatches >= perc_identity * alnlen))
+        return (cqrows[passed], cdiags[passed], starts[passed],
+                ends[passed], nmatches[passed], bits[passed],
+                evalues[passed])
+
+    @property
+    def seeds(self):
+        """Seeds of the index."""
+        return self._seeds
+
+    @property
+    def ids(self):
+        """Identifiers of the indexed sequences."""
+        return self._ids[:]
+
+    def __len__(self):
+        """Return total length of the indexed sequences."""
+        return len(self._seq) - len(self._ids)
+
+
+def seed_codes(codes, seeds, seedidx):
+    """Return the code of a spaced seed at each position in codes
+
+    - codes     array of nucleotide codes (see primersearch.NT_CODES);
+                seeds are read along the last axis
+    - seeds     all seed patterns of an index (see ScreenIndex.build())
+    - seedidx   index of the seed to read in seeds
+
+    Each seed code packs the 2-bit codes of the symbols at the seed's '1'
+    positions, above which is the index of the seed, so the codes of all
+    seeds can be held in a single sorted array. Codes are 32-bit integers
+    if they fit, and 64-bit otherwise. A boolean array marking positions
+    at which every symbol in the seed's span is valid (ACGT) is also
+    returned, so that seeds never match across N runs (e.g. the spacers
+    in stitched sequences) or record boundaries.
+    """
+    seed = seeds[seedidx]
+    codebits = 2 * max(_.count('1') for _ in seeds)
+    dtype = np.uint32 if codebits + (len(seeds) - 1).bit_length() <= 32 \
+        else np.uint64
+    npos = max(codes.shape[-1] - len(seed) + 1, 0)
+    shape = codes.shape[:-1] + (npos,)
+    seedcodes = np.zeros(shape, dtype=dtype)
+    valid = np.ones(shape, dtype=bool)
+    for offset, symbol in enumerate(seed):
+        column = codes[..., offset:offset + npos]
+        valid &= column < 4
+        if symbol == '1':
+            seedcodes = (seedcodes << dtype(2)) | np.where(
+                column < 4, column, 0).astype(dtype)
+    if seedidx:
+        seedcodes |= dtype(seedidx) << dtype(codebits)
+    return seedcodes, valid
+
+
+def write_blasttab(rows, outfname):
+    """Write BLASTN tabular output rows, as from ScreenIndex.search()."""
+    with open(outfname, 'w') as ofh:
+        for row in rows:
+            ofh.write('\t'.join(["%s", "%s", "%.3f"] + ["%d"] * 7 +
+                                ["%.2g", "%.1f"]) % row + '\n')
+
+
+def screen_collection(collection, dbfasta, outdir, workers=None,
+                      indexdir=None, seeds=None, perc_identity=90,
+                      logger=None):
+    """Screen primers for each PDPData in the collection with a ScreenIndex
+
+    - collection        PDPCollection describing analysis inputs
+    - dbfasta           path to screening sequences, in FASTA format
+    - outdir            path to output directory
+    - workers           number of worker processes (None uses all cores)
+    - indexdir          directory for the seed index (see ScreenIndex)
+    - seeds             seeds of the index (default from screen_seeds())
+    - perc_identity     minimum percentage identity of reported hits
+    - logger            a logger module logger (optional)
+
+    This is an in-process alternative to running the command-lines from
+    build_commands(). The screening sequences are indexed once (or an
+    existing index is reused), and each input's primers are searched in a
+    worker process that memory-maps the index. Output is written to the
+    .blasttab files that build_commands() would have produced, for use with
+    apply_screen(). Returns the list of output files, in collection order.
+    """
+    os.makedirs(outdir, exist_ok=True)
+    index = ScreenIndex.open(dbfasta, indexdir,
+                             seeds or screen_seeds(
+                                 perc_identity=perc_identity))
+    jobs = []
+    for g in collection.data:
+        stem = os.path.join(outdir, os.path.split(
+            os.path.splitext(g.seqfile)[0])[-1])
+        g.write_primers('_'.join([stem, 'primers.fasta']))
+        jobs.append((index._stem, g.primers,
+                     '_'.join([stem, 'primers.blasttab']), perc_identity))
+    pool = multiprocessing.Pool(processes=workers)
+    results = pool.map(_screen_job, jobs)
+    pool.close()
+    pool.join()
+    for (_, primerfile, _, _), (_, skipped) in zip(jobs, results):
+        if skipped and logger:
+            logger.warning("%d seeds of primers in %s have more than %d " +
+                           "hits in %s and were not extended; " +
+                           "alignments containing only these seeds are " +
+                           "not reported", skipped, primerfile,
+                           SCREEN_MAXHITS, dbfasta)
+    return [_[0] for _ in results]
+
+
+def _screen_job(job):
+    """Screen a single primer file against a ScreenIndex.
+
+    - job       tuple of (index path stem, primer file, output file,
+                perc_identity)
+
+    Returns the path to the output file, and the number of query seeds
+    ignored for having too many hits (see ScreenIndex.search()).
+    """
+    stem, primerfile, outfname, perc_identity = job
+    queries = []
+    for primer in eprimer3.load_primer_table(primerfile):
+        queries.append((primer.name + '_fwd', primer.forward_seq))
+        queries.append((primer.name + '_rev', primer.reverse_seq))
+        if len(primer.internal_seq):
+            queries.append((primer.name + '_int', primer.internal_seq))
+    rows, skipped = ScreenIndex(stem)._search(queries, perc_identity,
+                                              SCREEN_EVALUE, SCREEN_MAXHITS)
+    write_blasttab(rows, outfname)
+    return outfname, skipped
+
+
 def parse_blasttab(fhandle):
     """Return the passed BLAST tab output file as a list of lists.
 
@@ -0,0 +1,392 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""cache.py
+
+Code to cache the output of external tool invocations
+
+(c) The James Hutton Institute 2018
+
+Author: Leighton Pritchard
+Contact: leighton.pritchard@hutton.ac.uk
+
+Leighton Pritchard,
+Information and Computing Sciences,
+James Hutton Institute,
+Errol Road,
+Invergowrie,
+Dundee,
+DD6 9LH,
+Scotland,
+UK
+
+The MIT License
+
+Copyright (c) 2018 The James Hutton Institute
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+
+import glob
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+
+from Bio.Application import AbstractCommandline, _Option
+
+
+# Command-line options whose values name an output file of the tool
+OUTPUT_OPTIONS = ('-outfile', '-out', '-o', '-a')
+
+# Command-line options whose values name a BLAST database
+DATABASE_OPTIONS = ('-db', )
+
+# Size of blocks read when calculating file digests
+BLOCKSIZE = 1 << 20
+
+# Default maximum number of entries held in a primer screen cache
+SCREEN_CACHE_SIZE = 1000000
+
+# Number of sequences looked up in each primer screen cache query (SQLite
+# limits the number of parameters in a statement)
+SCREEN_CACHE_CHUNK = 500
+
+
+class PDPCacheError(Exception):
+    """Exception raised when working with the result cache"""
+
+    def __init__(self, msg="Error in result cache"):
+        Exception.__init__(self, msg)
+
+
+class PDPToolCache(object):
+
+    """Content-addressed cache of external tool output files.
+
+    Each job (command-line) is keyed by a SHA256 digest of the executable
+    that runs it, its arguments, and the contents of its input files. Paths
+    to input and output files are not part of the key, so a job whose
+    inputs are unchanged, but which writes to a different location, will
+    still be found in the cache.
+
+    Output files for each key are held in their own directory under the
+    cache root, with a manifest recording their size and digest.
+    """
+
+    def __init__(self, cachedir):
+        self._root = str(cachedir)
+        os.makedirs(self._root, exist_ok=True)
+        self._digests = {}    # (path, size, mtime): file digest
+        self._jobs = {}       # command line: (key, output files)
+
+    def key(self, cline):
+        """Returns the cache key for the passed command-line
+
+        - cline     command-line as string or Biopython AbstractCommandline
+        """
+        return self.__job(cline)[0]
+
+    def outputs(self, cline):
+        """Returns list of output file paths for the passed command-line"""
+        return self.__job(cline)[1]
+
+    def restore(self, cline):
+        """Restore cached output for the passed command-line
+
+        - cline     command-line as string or Biopython AbstractCommandline
+
+        Output files are copied from the cache, so that tools which later
+        rewrite them in place can't alter the cached copy. Cached files are
+        checked against the size and digest recorded in the manifest before
+        any are restored. Returns True if the outputs were restored, and
+        False if there is no valid cache entry for the job.
+        """
+        key, outputs = self.__job(cline)
+        manifest = self.__read_manifest(key)
+        if manifest is None or len(manifest['outputs']) != len(outputs):
+            return False
+        entrydir = self.__entrydir(key)
+        for entry in manifest['outputs']:
+            if len(entry) != 3:     # entry written without a digest
+                return False
+            fname, size, digest = entry
+            cachefile = os.path.join(entrydir, fname)
+            if not os.path.isfile(cachefile) or \
+               os.path.getsize(cachefile) != size or \
+               self.__file_digest(cachefile) != digest:
+                return False
+        for idx, outfile in enumerate(outputs):
+            cachefile = os.path.join(entrydir, manifest['outputs'][idx][0])
+            os.makedirs(os.path.dirname(outfile) or os.curdir, exist_ok=True)
+            if os.path.lexists(outfile):
+                os.remove(outfile)
+            shutil.copyfile(cachefile, outfile)
+        return True
+
+    def store(self, cline):
+        """Copy the output of the passed command-line into the cache
+
+        - cline     command-line as string or Biopython AbstractCommandline
+
+        The cache entry is written to a temporary directory and moved into
+        place, so that an interrupted run never leaves a partial entry.
+        """
+        key, outputs = self.__job(cline)
+        missing = [_ for _ in outputs if not os.path.isfile(_)]
+        if missing:
+            raise PDPCacheError("Cannot cache %s: missing output %s" %
+                                (cline, ', '.join(missing)))
+        entrydir = self.__entrydir(key)
+        os.makedirs(os.path.dirname(entrydir), exist_ok=True)
+        tmpdir = tempfile.mkdtemp(dir=os.path.dirname(entrydir))
+        manifest = {'command': str(cline), 'outputs': []}
+        for idx, outfile in enumerate(outputs):
+            fname = "output_%d" % idx
+            shutil.copyfile(outfile, os.path.join(tmpdir, fname))
+            manifest['outputs'].append((fname, os.path.getsize(outfile),
+                                        self.__file_digest(outfile)))
+        with open(os.path.join(tmpdir, 'manifest.json'), 'w') as ofh:
+            json.dump(manifest, ofh)
+        if os.path.isdir(entrydir):
+            shutil.rmtree(entrydir)
+        os.rename(tmpdir, entrydir)
+
+    def __job(self, cline):
+        """Returns (key, outputs) for the passed command-line"""
+        if str(cline) not in self._jobs:
+            if isinstance(cline, AbstractCommandline):
+                exe, args, outputs = self.__parse_abstract(cline)
+            else:
+                exe, args, outputs = self.__parse_string(str(cline))
+            keydata = {'executable': self.__executable_digest(exe),
+                       'arguments': args}
+            key = hashlib.sha256(json.dumps(keydata,
+                                            sort_keys=True).encode())
+            self._jobs[str(cline)] = (key.hexdigest(), outputs)
+        return self._jobs[str(cline)]
+
+    def __parse_abstract(self, cline):
+        """Returns executable, normalised arguments and outputs for cline
+
+        - cline     Biopython AbstractCommandline
+        """
+        args, outputs = [], []
+        for param in cline.parameters:
+            if not param.is_set:
+                continue
+            name = param.names[0]
+            if not isinstance(param, _Option):
+                args.append((name, True))
+            elif name in OUTPUT_OPTIONS:
+                args.append((name, "output_%d" % len(outputs)))
+                outputs.append(str(param.value))
+            else:
+                args.append((name, self.__argument(name, param.value)))
+        return cline.program_name, args, outputs
+
+    def __parse_string(self, cline):
+        """Returns executable, normalised arguments and outputs for cline
+
+        - cline     command-line string, with whitespace-separated tokens
+        """
+        tokens = cline.replace('\\\n', ' ').split()
+        args, outputs = [], []
+        for idx, token in enumerate(tokens[1:], 1):
+            if tokens[idx - 1] in OUTPUT_OPTIONS:
+                args.append("output_%d" % len(outputs))
+                outputs.append(token)
+            else:
+                args.append(self.__argument(tokens[idx - 1], token))
+        return tokens[0], args, outputs
+
+    def __argument(self, name, value):
+        """Returns normalised argument value for use in a cache key
+
+        Paths to existing files are replaced by a digest of their contents;
+        BLAST databases by the size and modification time of their files.
+        """
+        value = str(value)
+        if name in DATABASE_OPTIONS:
+            dbfiles = sorted(glob.glob(value + '.*'))
+            if dbfiles:
+                return ['database'] + \
+                    [(os.path.basename(_), os.path.getsize(_),
+                      os.path.getmtime(_)) for _ in dbfiles]
+        if os.path.isfile(value):
+            return "file:%s" % self.__file_digest(value)
+        return value
+
+    def __executable_digest(self, exe):
+        """Returns digest of the passed executable, identifying its version
+
+        Where the executable can't be found on the path, its name is used.
+        """
+        path = shutil.which(exe)
+        if path is None:
+            return exe
+        return self.__file_digest(path)
+
+    def __file_digest(self, path):
+        """Returns SHA256 digest of the contents of the passed file
+
+        Digests are remembered for the life of the cache object, keyed by
+        path, size, and modification time.
+        """
+        stat = os.stat(path)
+        sig = (os.path.abspath(path), stat.st_size, stat.st_mtime)
+        if sig not in self._digests:
+            digest = hashlib.sha256()
+            with open(path, 'rb') as ifh:
+                for block in iter(lambda: ifh.read(BLOCKSIZE), b''):
+                    digest.update(block)
+            self._digests[sig] = digest.hexdigest()
+        return self._digests[sig]
+
+    def __entrydir(self, key):
+        """Returns path to the cache directory for the passed key"""
+        return os.path.join(self._root, key[:2], key)
+
+    def __read_manifest(self, key):
+        """Returns the manifest for the passed key, or None if absent"""
+        try:
+            with open(os.path.join(self.__entrydir(key),
+                                   'manifest.json'), 'r') as ifh:
+                return json.load(ifh)
+        except (IOError, ValueError):
+            return None
+
+
+class PDPScreenCache(object):
+
+    """Persistent cache of primer screen results, held in an SQLite file.
+
+    Each entry maps a primer oligo sequence, and a fingerprint of the screen
+    that was run (see fingerprint()), to the length of the longest
+    alignment found for that oligo (zero if there were none). Primer sets
+    can then be screened with any maximum alignment length, and only oligos
+    that have not been seen before with the same screen need be searched.
+
+    Each entry records when it was last looked up or stored. When the cache
+    holds more than maxsize entries, the least recently used entries are
+    removed.
+    """
+
+    def __init__(self, path, maxsize=SCREEN_CACHE_SIZE):
+        """Open the screen cache at the passed path, creating it if needed
+
+        - path      path to the SQLite cache file
+        - maxsize   maximum number of entries held in the cache
+        """
+        self._path = str(path)
+        self._maxsize = int(maxsize)
+        os.makedirs(os.path.dirname(self._path) or os.curdir, exist_ok=True)
+        self._conn = sqlite3.connect(self._path)
+        with self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS screen (seq TEXT, screen TEXT, " +
+                "maxaln INTEGER, used INTEGER, PRIMARY KEY (seq, screen)) " +
+                "WITHOUT ROWID")
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS screen_used ON screen (used)")
+        self._clock = self._conn.execute(
+            "SELECT MAX(used) FROM screen").fetchone()[0] or 0
+
+    @staticmethod
+    def fingerprint(database, **settings):
+        """Returns a fingerprint identifying a primer screen
+
+        - database  path to the screening BLAST database or FASTA file
+        - settings  screen settings that change the alignments found
+                    (e.g. engine, perc_identity)
+
+        BLAST databases are identified by the names, sizes and modification
+        times of their files; FASTA files by a digest of their contents.
+        """
+        dbfiles = sorted(glob.glob(database + '.*'))
+        if os.path.isfile(database):
+            digest = hashlib.sha256()
+            with open(database, 'rb') as ifh:
+                for block in iter(lambda: ifh.read(BLOCKSIZE), b''):
+                    digest.update(block)
+            dbdata = "file:%s" % digest.hexdigest()
+        elif dbfiles:
+            dbdata = [(os.path.basename(_), os.path.getsize(_),
+                       os.path.getmtime(_)) for _ in dbfiles]
+        else:
+            raise PDPCacheError("Cannot fingerprint screen database %s" %
+                                database)
+        keydata = {'database': dbdata, 'settings': settings}
+        return hashlib.sha256(json.dumps(keydata,
+                                         sort_keys=True).encode()).hexdigest()
+
+    def lookup(self, seqs, fingerprint):
+        """Returns dictionary of cached longest alignments for the sequences
+
+        - seqs          iterable of oligo sequences
+        - fingerprint   screen fingerprint (see fingerprint())
+
+        Sequences without a cache entry are absent from the returned
+        dictionary. Entries that are found are marked as recently used.
+        """
+        seqs = sorted(set(seqs))
+        found = {}
+        self._clock += 1
+        with self._conn:
+            for start in range(0, len(seqs), SCREEN_CACHE_CHUNK):
+                chunk = seqs[start:start + SCREEN_CACHE_CHUNK]
+                marks = ', '.join('?' * len(chunk))
+                found.update(self._conn.execute(
+                    "SELECT seq, maxaln FROM screen WHERE screen = ? AND " +
+                    "seq IN (%s)" % marks, [fingerprint] + chunk))
+                self._conn.execute(
+                    "UPDATE screen SET used = ? WHERE screen = ? AND " +
+                    "seq IN (%s)" % marks, [self._clock, fingerprint] + chunk)
+        return found
+
+    def store(self, alignments, fingerprint):
+        """Add longest alignments for oligo sequences to the cache
+
+        - alignments    dictionary of longest alignment length, keyed by
+                        oligo sequence
+        - fingerprint   screen fingerprint (see fingerprint())
+
+        Least recently used entries are removed if the cache then holds
+        more than its maximum number of entries.
+        """
+        self._clock += 1
+        with self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO screen VALUES (?, ?, ?, ?)",
+                ((seq, fingerprint, int(maxaln), self._clock) for
+                 seq, maxaln in alignments.items()))
+            excess = len(self) - self._maxsize
+            if excess > 0:
+                self._conn.execute(
+                    "DELETE FROM screen WHERE (seq, screen) IN (SELECT " +
+                    "seq, screen FROM screen ORDER BY used LIMIT ?)",
+                    (excess, ))
+
+    def close(self):
+        """Close the cache file"""
+        self._conn.close()
+
+    def __len__(self):
+        """Return the number of entries in the cache."""
+        return self._conn.execute("SELECT COUNT(*) FROM screen").fetchone()[0]
@@ -49,8 +49,16 @@ from collections import defaultdict
 from Bio.Emboss import PrimerSearch
 from Bio.Emboss.Primer3 import Primers
 
-from .eprimer3 import load_primers, PrimersEncoder, write_primers
-from .primersearch import parse_output
+from .eprimer3 import (load_primer_table, PrimerRecord, PrimersEncoder,
+                       write_primers)
+from .primersearch import parse_results
+
+
+class PDPClassifyError(Exception):
+    """Exception raised when primers cannot be classified"""
+
+    def __init__(self, msg="Error classifying primers"):
+        Exception.__init__(self, msg)
 
 
 class PDPDiagnosticPrimersEncoder(json.JSONEncoder):
@@ -58,7 +66,7 @@ class PDPDiagnosticPrimersEncoder(json.JSONEncoder):
     """JSON encoder for PDPDiagnosticPrimers objects"""
 
     def default(self, obj):
-        if isinstance(obj, Primers):
+        if isinstance(obj, (Primers, PrimerRecord)):
             encoder = PrimersEncoder()
             return encoder.default(obj)
         if not isinstance(obj, PDPDiagnosticPrimers):
@@ -120,36 +128,32 @@ def classify_primers(coll, min_amplicon=50, max_amplicon=300):
     of genomes where an amplicon is theoretically produced (filtered for
     amplicon length).
 
-    Using set logic, each primer's set of potential amplified genomes is
-    compared against the sets of specific groups to determine if there is
-    an exact match.
+    Each genome is assigned a bit position, so that group membership and
+    primer amplification targets are both held as integer bitmasks. Groups
+    are matched to primers by a dictionary lookup of the group bitmask,
+    rather than by comparing every primer's target set against every group.
 
     The primers that amplify exactly those genomes which are members of one
     of the defined classes are returned as a PDPDiagnosticPrimers object that
-    is a collection of Primer3.Primers objects.
+    is a collection of PrimerRecord objects (views of the primer sets in a
+    PrimerTable).
     """
-    # Parse passed collection and generate dictionary keyed by all groups,
-    # with values a set of names of members of those groups
-    names = set()                  # set of all genome names
-    groups = defaultdict(set)      # group name: set of genome names
-    for genome in coll.data:
-        for group in genome.groups:
-            groups[group].add(genome.name)
-            names.add(genome.name)
-    groupdata = [(members, name) for (name, members) in
-                 groups.items()]
+    # Assign each genome a bit, and generate a dictionary keyed by group
+    # name, with values the bitmask of the group's members
+    genomebits = genome_bits(coll)
+    groupmasks = group_bitmasks(coll, genomebits)
 
     # Create dictionary to hold primer cross-hybridisation targets keyed by
-    # primer name with value a set of all genome targets
-    crosshyb = defaultdict(set)
+    # primer name with value a bitmask of all genome targets
+    crosshyb = defaultdict(int)
 
     # Parse the collection and follow the linked primersearch JSON file
     primers = {}
     for genome in coll.data:
         # All primers amplify their own source genome. Load the list
         # of primers and populate the crosshyb dictionary
-        for primer in load_primers(genome.primers, fmt="json"):
-            crosshyb[primer.name].add(genome.name)
+        for primer in load_primer_table(genome.primers):
+            crosshyb[primer.name] |= genomebits[genome.name]
             primers[primer.name] = primer
 
         # Load the data for primersearch cross-hybridisation, and populate
@@ -163,27 +167,58 @@ def classify_primers(coll, min_amplicon=50, max_amplicon=300):
             crosshybnames = [_ for _ in psdata.keys() if _ not in
                              ('primers', 'query')]
             for name in crosshybnames:
-                data = parse_output(psdata[name])
-                for primer in data:
-                    lentest = [max_amplicon > len(amplimer) > min_amplicon for
-                               amplimer in primer.amplimers]
-                    if sum(lentest):
-                        crosshyb[primer.name].add(name)
-    crosshybdata = [(targets, primer) for (primer, targets) in
-                    crosshyb.items()]
-
-    # To determine group-specific primer sets, we loop through the group
-    # data, and compare their members to each of the targets. As we find
-    # specific primer sets, we remove them from the pool.
+                if name not in genomebits:
+                    raise PDPClassifyError("PrimerSearch output %s names "
+                                           "target %s, which is not in the "
+                                           "collection" %
+                                           (genome.primersearch, name))
+                targetbit = genomebits[name]
+                data = parse_results(psdata[name])
+                for primer in data.amplified(min_amplicon, max_amplicon):
+                    crosshyb[primer] |= targetbit
+
+    # Index primers by their target bitmask. Primers are specific to a
+    # group when their target bitmask is exactly the group's membership
+    # bitmask. Groups are visited in collection order, and primers in the
+    # order they were loaded.
+    masktargets = defaultdict(list)    # target bitmask: list of primer names
+    for primer, targets in crosshyb.items():
+        masktargets[targets].append(primer)
     results = PDPDiagnosticPrimers(coll.name)
-    for members, group in groupdata:
-        for targets, primer in crosshybdata:
-            if members == targets:  # Primers are specific
-                results.add_diagnostic_primer(primers[primer], group)
+    for group, mask in groupmasks.items():
+        for primer in masktargets.get(mask, []):
+            results.add_diagnostic_primer(primers[primer], group)
 
     return results
 
 
+def genome_bits(coll):
+    """Returns dictionary of single-bit integer masks, keyed by genome name
+
+    - coll      PDPCollection describing the genomes in the run
+
+    Genomes are assigned bit positions in order of sorted genome name.
+    """
+    names = sorted(set(genome.name for genome in coll.data))
+    return {name: 1 << idx for idx, name in enumerate(names)}
+
+
+def group_bitmasks(coll, genomebits=None):
+    """Returns dictionary of group membership bitmasks, keyed by group name
+
+    - coll          PDPCollection describing the genomes in the run
+    - genomebits    dictionary of genome bitmasks, keyed by genome name (as
+                    returned by genome_bits()); generated if not provided
+    """
+    if genomebits is None:
+        genomebits = genome_bits(coll)
+    masks = defaultdict(int)
+    for genome in coll.data:
+        for group in genome.groups:
+            masks[group] |= genomebits[genome.name]
+    return dict(masks)
+
+
 def write_results(results, outfilename, fmt='json'):
     """Writes files describing PDPDiagnosticPrimers object data to outdir
 
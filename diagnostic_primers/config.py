@@ -42,14 +42,30 @@ THE SOFTWARE.
 """
 
 import csv
+import hashlib
 import json
 import os
 import re
 
+from collections import namedtuple
+
 from Bio import SeqIO
 from Bio.Seq import Seq
 from Bio.SeqRecord import SeqRecord
 
+from .contigs import ContigIndex
+from .eprimer3 import load_primer_table
+
+
+# Non-N IUPAC ambiguity symbols
+AMBIGUITIES = re.compile('[BDHKMRSVWY]')
+
+# Runs of N in a sequence line
+NRUN = re.compile('[Nn]+')
+
+# Maximum number of characters read at once when rewriting sequence files
+FASTA_CHUNKSIZE = 1 << 20
+
 
 class ConfigSyntaxError(Exception):
 
@@ -75,10 +91,208 @@ class PDPEncoder(json.JSONEncoder):
                    'primers': obj.primers,
                    'primersearch': obj.primersearch,
                    'filestem': obj.filestem}
+        # Only stitched sequences have a contig offset index
+        if obj.offsets is not None:
+            objdict['offsets'] = obj.offsets
 
         return objdict
 
 
+# Per-record summary of a sequence file, from a single pass over the file
+class SequenceProfile(namedtuple('SequenceProfile',
+                                 'names lengths ambiguities nruns gc digest')):
+
+    """Summary of the records in a FASTA sequence file.
+
+    - names         record IDs, in file order
+    - lengths       record sequence lengths
+    - ambiguities   count of non-N ambiguity symbols in each record
+    - nruns         (start, end) of each run of Ns in each record, as
+                    zero-indexed, end-exclusive sequence coordinates
+    - gc            count of G and C symbols in each record
+    - digest        SHA256 hexdigest of record IDs and sequences (independent
+                    of line length)
+    """
+
+    __slots__ = ()
+
+    @property
+    def total_length(self):
+        """Total length of all sequences in the file."""
+        return sum(self.lengths)
+
+    @property
+    def gc_content(self):
+        """GC content of all sequences in the file, as a fraction."""
+        if not self.total_length:
+            return 0.
+        return sum(self.gc) / self.total_length
+
+    @property
+    def has_ambiguities(self):
+        """True if any record contains non-N ambiguity symbols."""
+        return any(self.ambiguities)
+
+
+# Profile a FASTA sequence file in a single pass
+def profile_sequences(filename, ambiguities=AMBIGUITIES):
+    """Return a SequenceProfile for the passed FASTA file
+
+    - filename      path to FASTA sequence file
+    - ambiguities   compiled regex matching ambiguity symbols to count
+
+    The file is read line by line, once, so that only a single line of
+    sequence is held in memory. Record names are the first word of each
+    header line, as for the IDs assigned by Bio.SeqIO.
+    """
+    names, lengths, ambigs, nruns, gcs = [], [], [], [], []
+    digest = hashlib.sha256()
+    runs, current = None, None  # N runs for record; N run being extended
+    with open(filename, 'r') as ifh:
+        for line in ifh:
+            if line.startswith('>'):
+                if current is not None:
+                    runs.append(tuple(current))
+                runs, current = [], None
+                names.append(line[1:].split(None, 1)[0] if
+                             line[1:].strip() else '')
+                lengths.append(0)
+                ambigs.append(0)
+                nruns.append(runs)
+                gcs.append(0)
+                digest.update(('>%s\n' % names[-1]).encode())
+                continue
+            line = line.strip()
+            if not line or runs is None:
+                continue
+            offset = lengths[-1]
+            for match in NRUN.finditer(line):
+                start, end = offset + match.start(), offset + match.end()
+                if current is not None and current[1] == start:
+                    current[1] = end  # run continues from previous line
+                    continue
+                if current is not None:
+                    runs.append(tuple(current))
+                current = [start, end]
+            lengths[-1] += len(line)
+            ambigs[-1] += len(ambiguities.findall(line))
+            gcs[-1] += (line.count('G') + line.count('C') +
+                        line.count('g') + line.count('c'))
+            digest.update(line.upper().encode())
+    if current is not None:
+        runs.append(tuple(current))
+    return SequenceProfile(names, lengths, ambigs,
+                           [tuple(_) for _ in nruns], gcs, digest.hexdigest())
+
+
+# Write stitched and/or ambiguity-replaced sequences, in a single pass
+def write_fixed_sequences(infilename, outfilename, name=None, spacer=None,
+                          ambiguities=None, linelen=60,
+                          chunksize=FASTA_CHUNKSIZE):
+    """Write a stitched and/or ambiguity-replaced copy of a FASTA file
+
+    - infilename    path to input FASTA file
+    - outfilename   path to output FASTA file
+    - name          if not None, stitch the input sequences together with
+                    the spacer, into a single sequence with this name
+    - spacer        sequence placed between stitched sequences
+    - ambiguities   if not None, compiled regex matching symbols to replace
+                    with N
+    - linelen       length of output sequence lines
+    - chunksize     maximum number of characters read from the input at once
+
+    The input is read, and output written, in chunks, so only a single chunk
+    of sequence is held in memory. Output is identical to that written by
+    Bio.SeqIO: stitched sequences are given the ID <name>_concatenated, and
+    IDs of ambiguity-replaced sequences are given the suffix _noambig.
+
+    Returns a list of (seqid, start, end) tuples giving the location of each
+    input sequence in the output sequence, as zero-indexed, end-exclusive
+    coordinates.
+    """
+    offsets = []
+    buffer = ''  # output sequence not yet written as a complete line
+    position = 0  # length of current output sequence
+
+    def write_sequence(seq):
+        """Write seq to the output, keeping any incomplete line."""
+        nonlocal buffer, position
+        position += len(seq)
+        seq = buffer + seq
+        end = len(seq) - len(seq) % linelen
+        ofh.write(''.join([seq[idx:idx + linelen] + '\n' for idx in
+                           range(0, end, linelen)]))
+        buffer = seq[end:]
+
+    def start_sequence(title):
+        """Begin output for the input sequence with the passed title."""
+        nonlocal position
+        seqid = title.split(None, 1)[0] if title else ''
+        if name is None:
+            end_sequence()
+            position = 0
+            ofh.write('>%s_noambig %s\n' % (seqid, title))
+        elif offsets:
+            write_sequence(spacer)
+        offsets.append([seqid, position, position])
+
+    def add_sequence(text):
+        """Write sequence symbols from the passed text."""
+        seq = text.replace('\n', '')
+        if ' ' in seq or '\r' in seq or '\t' in seq:
+            seq = ''.join(seq.split())
+        if ambiguities is not None:
+            seq = ambiguities.sub('N', seq)
+        write_sequence(seq)
+        offsets[-1][2] = position
+
+    def end_sequence():
+        """Write any incomplete line of the current output sequence."""
+        nonlocal buffer
+        if buffer:
+            ofh.write(buffer + '\n')
+        buffer = ''
+
+    with open(infilename, 'r') as ifh:
+        with open(outfilename, 'w') as ofh:
+            if name is not None:
+                title = '%s_concatenated %s, concatenated with spacers' % \
+                    (name, name)
+                if ambiguities is not None:
+                    title = '%s_concatenated_noambig %s' % (name, title)
+                ofh.write('>%s\n' % title)
+            header, linestart = None, True  # incomplete header line
+            for chunk in iter(lambda: ifh.read(chunksize), ''):
+                pos = 0
+                while pos < len(chunk):
+                    if header is not None:  # complete the header line
+                        end = chunk.find('\n', pos)
+                        if end == -1:
+                            header += chunk[pos:]
+                            break
+                        header += chunk[pos:end]
+                        start_sequence(header[1:].rstrip())
+                        header, pos = None, end + 1
+                        continue
+                    # Sequence runs to the next header line, if there is one
+                    if chunk[pos] == '>' and \
+                            (chunk[pos - 1] == '\n' if pos else linestart):
+                        end = pos
+                    else:
+                        end = chunk.find('\n>', pos)
+                        end = len(chunk) if end == -1 else end + 1
+                    if offsets:  # text before the first header is ignored
+                        add_sequence(chunk[pos:end])
+                    if end < len(chunk):
+                        header = ''
+                    pos = end
+                linestart = chunk.endswith('\n')
+            if header is not None:
+                start_sequence(header[1:].rstrip())
+            end_sequence()
+    return [tuple(_) for _ in offsets]
+
+
 # Class that contains PDPData objects and interfaces with config files
 class PDPCollection(object):
 
@@ -119,6 +333,8 @@ class PDPCollection(object):
 
         'name', 'groups', 'seqfile', 'features', 'primers'
 
+        and optionally 'primersearch' and 'offsets'.
+
         These are used directly to populate the collection's PDPData objects.
         """
         with open(filename, 'r') as ifh:
@@ -132,21 +348,22 @@ class PDPCollection(object):
                 primersearch_val = None
             self.add_data(input['name'], input['groups'], input['seqfile'],
                           input['features'], input['primers'],
-                          primersearch_val)
+                          primersearch_val, input.get('offsets'))
 
     def add_data(self, name=None, groups=None, seqfile=None, features=None,
-                 primers=None, primersearch=None):
+                 primers=None, primersearch=None, offsets=None):
         """Create a new PDPData object from passed info and add to collection.
 
         name         -    unique identifier for object
         groups       -    list of groups to which the object belongs
         seqfile      -    path to sequence file
         features     -    path to regions for inclusion/exclusion
-        primers      -    path to primers in JSON format
+        primers      -    path to primers in JSON (or binary .npz) format
         primersearch -    path to primersearch results in JSON format
+        offsets      -    path to contig offset index, for stitched sequences
         """
         self._data[name] = PDPData(name, groups, seqfile, features,
-                                   primers, primersearch)
+                                   primers, primersearch, offsets)
 
     def write_json(self, outfilename):
         """Write the Collection data contents to JSON format config file.
@@ -215,13 +432,15 @@ class PDPData(object):
     """Container for input sequence data and operations on that data."""
 
     def __init__(self, name, groups, seqfile, features,
-                 primers, primersearch):
+                 primers, primersearch, offsets=None):
         self._name = ""         # Set up private attributes
         self._groups = set()
         self._seqfile = None
         self._features = None
         self._primers = None
         self._primersearch = None
+        self._offsets = None
+        self._contig_index = None
         self._filestem = None
         self.cmds = {}           # command-lines used to generate this object
         self.name = name         # Populate attributes
@@ -230,9 +449,12 @@ class PDPData(object):
         self.features = features
         self.primers = primers
         self.primersearch = primersearch
+        self.offsets = offsets
         # Useful values
         self.spacer = "NNNNNCATCCATTCATTAATTAATTAATGAATGAATGNNNNN"
-        self.ambiguities = re.compile('[BDHKMRSVWY]')
+        self.ambiguities = AMBIGUITIES
+        self._profile = None     # cached SequenceProfile for self.seqfile
+        self._profile_key = None
 
     def stitch(self):
         """Stitch sequences in the sequence file, if necessary
@@ -240,25 +462,16 @@ class PDPData(object):
         The following actions are applied:
         - stitch sequences together into new single sequence
         - write this sequence to a new file
-        - replace self.seqfile with new filename, and delete self.seqnames
+        - replace self.seqfile with new filename (self.profile, and the
+          properties derived from it, then describe the new file)
+        - write the location of each input sequence in the stitched
+          sequence to a contig offset index file, and place its path in
+          self.offsets
         - replace feature and primer files in this object with None, as they
           no longer relate to the input sequence
         """
         if self.needs_stitch:
-            seqdata = list(SeqIO.parse(self.seqfile, 'fasta'))
-            catseq = self.spacer.join([str(s.seq) for s in seqdata])
-            newseq = SeqRecord(Seq(catseq),
-                               id='_'.join([self.name, 'concatenated']),
-                               description="%s, concatenated with spacers" %
-                               self.name)
-            outfilename = ''.join([os.path.splitext(self.seqfile)[0],
-                                   '_concat', '.fas'])
-            SeqIO.write([newseq], outfilename, 'fasta')
-            self.seqfile = outfilename
-            if hasattr(self, '_seqnames'):
-                delattr(self, '_seqnames')
-            self.features = None
-            self.primers = None
+            self.__write_fixed(stitch=True, replace=False)
 
     def replace_ambiguities(self):
         """Replace non-N ambiguity symbols in self.seqfile with N, if needed.
@@ -266,24 +479,42 @@ class PDPData(object):
         The following actions are applied:
         - replace ambiguity symbols with Ns
         - write new sequence(s) to file
-        - replace self.seqfile with new filename; delete self.seqnames
+        - replace self.seqfile with new filename (self.profile, and the
+          properties derived from it, then describe the new file)
         - replace feature and primer files with None, as they no longer relate
           to the input sequence
         """
         if self.has_ambiguities:
-            seqdata = list(SeqIO.parse(self.seqfile, 'fasta'))
-            for s in seqdata:
-                s.seq = Seq(re.sub(self.ambiguities, 'N', str(s.seq)),
-                            s.seq.alphabet)
-                s.id = '_'.join([s.id, 'noambig'])
-            outfilename = ''.join([os.path.splitext(self.seqfile)[0],
-                                   '_noambig', '.fas'])
-            SeqIO.write(seqdata, outfilename, 'fasta')
-            self.seqfile = outfilename
-            if hasattr(self, '_seqnames'):
-                delattr(self, '_seqnames')
-            self.features = None
-            self.primers = None
+            self.__write_fixed(stitch=False, replace=True)
+
+    def fix_sequences(self):
+        """Stitch sequences and replace ambiguity symbols, as necessary.
+
+        The result is the same as calling self.stitch(), then
+        self.replace_ambiguities(), but the sequence file is read and written
+        only once.
+        """
+        stitch, replace = self.needs_stitch, self.has_ambiguities
+        if stitch or replace:
+            self.__write_fixed(stitch=stitch, replace=replace)
+
+    def __write_fixed(self, stitch, replace):
+        """Write stitched and/or ambiguity-replaced copy of self.seqfile."""
+        outfilename = ''.join([os.path.splitext(self.seqfile)[0],
+                               '_concat' if stitch else '',
+                               '_noambig' if replace else '', '.fas'])
+        offsets = write_fixed_sequences(
+            self.seqfile, outfilename,
+            name=self.name if stitch else None,
+            spacer=self.spacer,
+            ambiguities=self.ambiguities if replace else None)
+        self.seqfile = outfilename
+        if stitch:
+            offsetfilename = os.path.splitext(outfilename)[0] + '.offsets'
+            ContigIndex(offsets).write(offsetfilename)
+            self.offsets = offsetfilename
+        self.features = None
+        self.primers = None
 
     def write_primers(self, outfilename, format='fasta'):
         """Write the primers for this object to file.
@@ -296,21 +527,18 @@ class PDPData(object):
         if self.primers is None:
             raise ValueError("No primer file is defined for this object")
 
-        with open(self.primers, 'r') as infh:
-            primers = json.load(infh)
-
         seqrecords = []
 
-        for primer in primers:
-            seqrecords.append(SeqRecord(Seq(primer['forward_seq']),
-                                        id=primer['name'] + '_fwd',
+        for primer in load_primer_table(self.primers):
+            seqrecords.append(SeqRecord(Seq(primer.forward_seq),
+                                        id=primer.name + '_fwd',
                                         description=''))
-            seqrecords.append(SeqRecord(Seq(primer['reverse_seq']),
-                                        id=primer['name'] + '_rev',
+            seqrecords.append(SeqRecord(Seq(primer.reverse_seq),
+                                        id=primer.name + '_rev',
                                         description=''))
-            if len(primer['internal_seq']):  # This is '' id no oligo
-                seqrecords.append(SeqRecord(Seq(primer['internal_seq']),
-                                            id=primer['name'] + '_int',
+            if len(primer.internal_seq):  # This is '' id no oligo
+                seqrecords.append(SeqRecord(Seq(primer.internal_seq),
+                                            id=primer.name + '_int',
                                             description=''))
 
         return SeqIO.write(seqrecords, outfilename, format)
@@ -398,12 +626,47 @@ class PDPData(object):
                 raise OSError("%s is not a valid file path" % value)
         self._primersearch = value
 
+    @property
+    def profile(self):
+        """Lazily returns SequenceProfile of self.seqfile.
+
+        The profile is computed in a single pass over the sequence file, and
+        recomputed only if the file path, modification time or size change.
+        """
+        stat = os.stat(self.seqfile)
+        key = (self.seqfile, stat.st_mtime_ns, stat.st_size)
+        if self._profile is None or self._profile_key != key:
+            self._profile = profile_sequences(self.seqfile, self.ambiguities)
+            self._profile_key = key
+        return self._profile
+
+    @property
+    def offsets(self):
+        """Path to contig offset index file, for stitched sequences."""
+        return self._offsets
+
+    @offsets.setter
+    def offsets(self, value):
+        if value is not None:
+            if not os.path.isfile(value):
+                raise OSError("%s is not a valid file path" % value)
+        self._offsets = value
+        self._contig_index = None
+
+    @property
+    def contig_index(self):
+        """Lazily returns ContigIndex for a stitched sequence, or None.
+
+        None is returned if the sequence was not stitched.
+        """
+        if self._contig_index is None and self.offsets is not None:
+            self._contig_index = ContigIndex.from_file(self.offsets)
+        return self._contig_index
+
     @property
     def seqnames(self):
         """Lazily returns list of names of sequences in self.seqfile."""
-        if not hasattr(self, "_seqnames"):
-            self._seqnames = [s.id for s in SeqIO.parse(self.seqfile, 'fasta')]
-        return self._seqnames
+        return self.profile.names
 
     @property
     def needs_stitch(self):
@@ -413,6 +676,4 @@ class PDPData(object):
     @property
     def has_ambiguities(self):
         """Returns True if the sequence(s) have non-N ambiguity symbols."""
-        for s in SeqIO.parse(self.seqfile, 'fasta'):
-            if re.search(self.ambiguities, str(s.seq)):
-                return True
+        return self.profile.has_ambiguities
@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""contigs.py
+
+Code for locating contigs in stitched sequences
+
+(c) The James Hutton Institute 2018
+
+Author: Leighton Pritchard
+Contact: leighton.pritchard@hutton.ac.uk
+
+Leighton Pritchard,
+Information and Computing Sciences,
+James Hutton Institute,
+Errol Road,
+Invergowrie,
+Dundee,
+DD6 9LH,
+Scotland,
+UK
+
+The MIT License
+
+Copyright (c) 2018 The James Hutton Institute
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+
+import bisect
+import csv
+
+import numpy as np
+
+
+# Contig locations in a stitched sequence
+class ContigIndex(object):
+
+    """Sorted index of contig locations in a stitched sequence.
+
+    When PDPData.stitch() joins contigs with a spacer, coordinates in the
+    stitched sequence lose the identity of the original contig. A ContigIndex
+    holds the (start, end) location of each contig in the stitched sequence,
+    as zero-indexed, end-exclusive coordinates, and maps stitched sequence
+    coordinates back to contigs by binary search.
+    """
+
+    def __init__(self, offsets=None):
+        """Create index from iterable of (seqid, start, end) tuples."""
+        offsets = sorted([(str(seqid), int(start), int(end)) for
+                          seqid, start, end in offsets or []],
+                         key=lambda _: _[1])
+        self.seqids = [_[0] for _ in offsets]
+        self.starts = [_[1] for _ in offsets]
+        self.ends = [_[2] for _ in offsets]
+        for idx in range(1, len(self)):
+            if self.starts[idx] < self.ends[idx - 1]:
+                raise ValueError("Contigs %s and %s overlap" %
+                                 (self.seqids[idx - 1], self.seqids[idx]))
+
+    @classmethod
+    def from_file(cls, filename):
+        """Load index from a tab-separated (seqid, start, end) file."""
+        with open(filename, 'r', newline='') as ifh:
+            return cls([row for row in csv.reader(ifh, delimiter='\t')
+                        if row and not row[0].startswith('#')])
+
+    def write(self, filename):
+        """Write index to a tab-separated (seqid, start, end) file."""
+        with open(filename, 'w', newline='') as ofh:
+            writer = csv.writer(ofh, delimiter='\t', lineterminator='\n')
+            writer.writerow(['# seqid', 'start', 'end'])
+            writer.writerows(self)
+
+    def find(self, position):
+        """Return index of the contig containing position, or None.
+
+        None is returned if position lies in a spacer, or outside the
+        stitched sequence.
+        """
+        idx = bisect.bisect_right(self.starts, position) - 1
+        if idx >= 0 and position < self.ends[idx]:
+            return idx
+        return None
+
+    def locate(self, position):
+        """Return (seqid, position in contig) for position, or None."""
+        idx = self.find(position)
+        if idx is None:
+            return None
+        return self.seqids[idx], position - self.starts[idx]
+
+    def spans_junction(self, start, end):
+        """Returns True if [start, end) does not lie within a single contig.
+
+        - start     zero-indexed start of the region
+        - end       end of the region (exclusive)
+
+        Regions that overlap a spacer, or that lie outside the stitched
+        sequence, span a junction.
+        """
+        idx = self.find(start)
+        return idx is None or end > self.ends[idx]
+
+    def spans_junctions(self, starts, ends):
+        """Returns boolean array: True where [start, end) spans a junction.
+
+        - starts    sequence of zero-indexed region starts
+        - ends      sequence of (exclusive) region ends
+
+        Vectorised form of spans_junction(), for many regions at once.
+        """
+        starts, ends = np.asarray(starts), np.asarray(ends)
+        idx = np.searchsorted(self.starts, starts, side='right') - 1
+        contig_ends = np.asarray(self.ends + [0])[idx]  # idx -1 -> end 0
+        return (idx < 0) | (starts >= contig_ends) | (ends > contig_ends)
+
+    def __iter__(self):
+        return zip(self.seqids, self.starts, self.ends)
+
+    def __len__(self):
+        return len(self.seqids)
+
+    def __eq__(self, other):
+        return list(self) == list(other)
@@ -45,6 +45,8 @@
 import json
 import os
 
+import numpy as np
+
 from Bio import SeqIO
 from Bio.Emboss.Applications import Primer3Commandline
 from Bio.Emboss import Primer3
@@ -53,9 +55,13 @@ from Bio.SeqRecord import SeqRecord
 
 
 class PrimersEncoder(json.JSONEncoder):
-    """JSON encoder for Primer3.Primers objects."""
+    """JSON encoder for Primer3.Primers objects, and PrimerTable data."""
 
     def default(self, obj):
+        if isinstance(obj, PrimerTable):
+            return obj.to_dicts()
+        if isinstance(obj, PrimerRecord):
+            return obj.to_dict()
         if not isinstance(obj, Primer3.Primers):
             return super(PrimersEncoder, self).default(obj)
 
@@ -64,16 +70,273 @@ class PrimersEncoder(json.JSONEncoder):
         return obj.__dict__
 
 
-def build_commands(collection, eprimer3_exe, eprimer3_dir, argdict=None):
+# Fields describing a primer set, in the order they are written to JSON,
+# with the NumPy type used to hold each field as a PrimerTable column, and
+# the value used when a field is missing. Sequences and names are ASCII,
+# and held as bytestrings.
+PRIMER_FIELDS = (('size', np.int64, 0),
+                 ('forward_seq', np.bytes_, ''),
+                 ('forward_start', np.int64, 0),
+                 ('forward_length', np.int64, 0),
+                 ('forward_tm', np.float64, 0.0),
+                 ('forward_gc', np.float64, 0.0),
+                 ('reverse_seq', np.bytes_, ''),
+                 ('reverse_start', np.int64, 0),
+                 ('reverse_length', np.int64, 0),
+                 ('reverse_tm', np.float64, 0.0),
+                 ('reverse_gc', np.float64, 0.0),
+                 ('internal_seq', np.bytes_, ''),
+                 ('internal_start', np.int64, 0),
+                 ('internal_length', np.int64, 0),
+                 ('internal_tm', np.float64, 0.0),
+                 ('internal_gc', np.float64, 0.0),
+                 ('name', np.bytes_, ''))
+PRIMER_FIELDNAMES = tuple(_[0] for _ in PRIMER_FIELDS)
+PRIMER_DTYPES = {_[0]: _[1] for _ in PRIMER_FIELDS}
+
+
+class PrimerTable(object):
+
+    """Compact collection of primer sets, held column-wise
+
+    Each field of the primer sets (see PRIMER_FIELDS) is held as a single
+    NumPy array, so a table uses a small fraction of the memory needed for
+    the same number of Primer3.Primers objects.
+
+    Iterating over, or indexing, the table gives PrimerRecord objects,
+    which provide the same attributes as Primer3.Primers, so a table can
+    be passed to code (such as write_primers()) expecting an iterable of
+    primers.
+
+    A table read from a binary .npz primer file (see from_npz()) loads
+    each column only when it is first used.
+    """
+
+    def __init__(self, columns=None):
+        """Create a table from a dictionary of columns, keyed by field
+
+        - columns   dictionary of sequences of values, one per field; all
+                    sequences must be the same length. Missing fields are
+                    filled with default values.
+        """
+        columns = columns or {}
+        nrows = len(next(iter(columns.values()))) if columns else 0
+        self._columns = {}
+        for field, dtype, default in PRIMER_FIELDS:
+            values = columns.get(field, [default] * nrows)
+            self._columns[field] = np.asarray(values, dtype=dtype)
+            if len(self._columns[field]) != nrows:
+                raise ValueError("PrimerTable column %s has %d values " %
+                                 (field, len(self._columns[field])) +
+                                 "(expected %d)" % nrows)
+        self._rows = None     # primer name: row number, built on request
+
+    @classmethod
+    def from_dicts(cls, primers):
+        """Return a PrimerTable from an iterable of primer dictionaries"""
+        primers = list(primers)
+        return cls({field: [_.get(field, default) for _ in primers] for
+                    field, _dtype, default in PRIMER_FIELDS})
+
+    @classmethod
+    def from_primers(cls, primers):
+        """Return a PrimerTable from an iterable of Primer3.Primers"""
+        return cls.from_dicts(vars(_) if isinstance(_, Primer3.Primers) else
+                              _.to_dict() for _ in primers)
+
+    @classmethod
+    def from_json(cls, infname):
+        """Return a PrimerTable from a JSON file describing primers"""
+        with open(infname, 'r') as primerfh:
+            return cls.from_dicts(json.load(primerfh))
+
+    @classmethod
+    def from_npz(cls, infname):
+        """Return a PrimerTable from a binary .npz file describing primers
+
+        Columns are read from the file only when first used, so (for
+        example) iterating over primer names reads only the name column.
+        The file is opened only while a column is read, so that many tables
+        can be held without keeping their files open.
+        """
+        table = cls.__new__(cls)
+        table._columns = _NpzColumns(infname)
+        table._rows = None
+        return table
+
+    def write_npz(self, outfname):
+        """Write the table columns to a binary .npz file"""
+        with open(outfname, 'wb') as ofh:
+            np.savez(ofh, **{_: self._columns[_] for _ in PRIMER_FIELDNAMES})
+
+    def to_dicts(self):
+        """Return the primer sets as a list of dictionaries"""
+        columns = [self.column(_) for _ in PRIMER_FIELDNAMES]
+        return [dict(zip(PRIMER_FIELDNAMES, row)) for row in zip(*columns)]
+
+    def to_primers(self):
+        """Return the primer sets as a list of Primer3.Primers objects"""
+        primers = []
+        for pdata in self.to_dicts():
+            primer = Primer3.Primers()
+            primer.__dict__.update(pdata)
+            primers.append(primer)
+        return primers
+
+    def column(self, field):
+        """Return list of the values of the passed field for each primer"""
+        values = self._columns[field]
+        if values.dtype.kind == 'S':
+            return [_.decode() for _ in values.tolist()]
+        return values.tolist()
+
+    def array(self, field):
+        """Return the NumPy array holding the passed field for each primer
+
+        Sequence and name fields are bytestring arrays. The array is shared
+        with the table, and should not be modified.
+        """
+        return self._columns[field]
+
+    def replace(self, **columns):
+        """Return a new PrimerTable with the passed columns replaced
+
+        - columns   sequences of values, keyed by field; one value per primer
+        """
+        newcolumns = {_: self._columns[_] for _ in PRIMER_FIELDNAMES}
+        for field, values in columns.items():
+            if field not in newcolumns:
+                raise KeyError("%s is not a primer field" % field)
+            newcolumns[field] = values
+        return PrimerTable(newcolumns)
+
+    def value(self, row, field):
+        """Return the value of the passed field for the primer in row"""
+        value = self._columns[field][row].item()
+        return value.decode() if isinstance(value, bytes) else value
+
+    def row(self, name):
+        """Return the row number of the named primer set"""
+        if self._rows is None:
+            self._rows = {name: idx for idx, name in
+                          enumerate(self.column('name'))}
+        return self._rows[name]
+
+    def select(self, rows):
+        """Return a new PrimerTable holding the passed rows
+
+        - rows      boolean mask, or sequence of row numbers
+        """
+        rows = np.asarray(rows)
+        if rows.dtype != bool:
+            rows = rows.astype(np.int64)
+        return PrimerTable({field: self._columns[field][rows] for
+                            field in PRIMER_FIELDNAMES})
+
+    def sorted(self):
+        """Return a new PrimerTable with rows ordered by primer name"""
+        return self.select(np.argsort(self._columns['name'], kind='stable'))
+
+    @property
+    def names(self):
+        """Names of the primer sets, in table order"""
+        return self.column('name')
+
+    @property
+    def nbytes(self):
+        """Total size in bytes of the table columns"""
+        return sum(self._columns[_].nbytes for _ in PRIMER_FIELDNAMES)
+
+    def __getitem__(self, row):
+        if not -len(self) <= row < len(self):
+            raise IndexError("PrimerTable row %d out of range" % row)
+        return PrimerRecord(self, row % len(self))
+
+    def __iter__(self):
+        return (PrimerRecord(self, row) for row in range(len(self)))
+
+    def __len__(self):
+        return len(self._columns['name'])
+
+    def __getstate__(self):
+        # Tables read from .npz files are fully loaded before pickling
+        return {'_columns': {_: self._columns[_] for _ in PRIMER_FIELDNAMES},
+                '_rows': None}
+
+
+class _NpzColumns(dict):
+
+    """PrimerTable columns, each read from a .npz file when first used"""
+
+    def __init__(self, infname):
+        super(_NpzColumns, self).__init__()
+        self._infname = infname
+
+    def __missing__(self, field):
+        with np.load(self._infname, allow_pickle=False) as npzfile:
+            self[field] = npzfile[field].astype(PRIMER_DTYPES[field],
+                                                copy=False)
+        return self[field]
+
+
+class PrimerRecord(object):
+
+    """Read-only view of a single primer set in a PrimerTable
+
+    Fields of the primer set (see PRIMER_FIELDS) are available as
+    attributes, as for Primer3.Primers objects.
+    """
+
+    __slots__ = ('_table', '_row')
+
+    def __init__(self, table, row):
+        self._table = table
+        self._row = row
+
+    def __getattr__(self, field):
+        if field not in PRIMER_FIELDNAMES:
+            raise AttributeError("PrimerRecord has no attribute %s" % field)
+        return self._table.value(self._row, field)
+
+    def to_dict(self):
+        """Return the primer set as a dictionary"""
+        return {field: self._table.value(self._row, field) for
+                field in PRIMER_FIELDNAMES}
+
+    def __eq__(self, other):
+        return isinstance(other, PrimerRecord) and \
+            self._table is other._table and self._row == other._row
+
+    def __hash__(self):
+        return hash((id(self._table), self._row))
+
+    def __repr__(self):
+        return "PrimerRecord(%s)" % self.name
+
+
+def build_commands(collection, eprimer3_exe, eprimer3_dir, argdict=None,
+                   window=None, overlap=None):
     """Builds and returns a list of command-lines to run ePrimer3
 
     The commands will run on each sequence in the passed GenomeCollection.
+
+    If window is set, each sequence is split into windows of this length,
+    overlapping by overlap bases, and one command is built for each window.
+    Unless given, the overlap is the maximum product size, so that every
+    product lies within at least one window. The window commands, and the
+    position of each window in the sequence, are recorded as a list of
+    (command, offset) tuples in the PDPData object's cmds['ePrimer3_windows'],
+    for merge_window_primers(). In either case, cmds['ePrimer3'] holds the
+    command for the whole sequence, giving the output file stem.
     """
     clines = []  # Holds command-lines
 
     # Ensure output directory exists
     os.makedirs(eprimer3_dir, exist_ok=True)
 
+    if window is not None and overlap is None:
+        overlap = (argdict or {}).get('ep_psizemax', 200)
+
     for g in collection.data:
         if eprimer3_dir is None:
             stem = os.path.splitext(g.seqfile)[0]
@@ -82,10 +345,104 @@ def build_commands(collection, eprimer3_exe, eprimer3_dir, argdict=None):
             stem = os.path.join(eprimer3_dir, stempath[-1])
         cline = build_command(eprimer3_exe, g.seqfile, stem, argdict)
         g.cmds['ePrimer3'] = cline
-        clines.append(cline)
+        if window is None:
+            clines.append(cline)
+            continue
+        g.cmds['ePrimer3_windows'] = []
+        for seqfile, offset in write_windows(g.seqfile, stem, window,
+                                             overlap):
+            wcline = build_command(eprimer3_exe, seqfile,
+                                   os.path.splitext(seqfile)[0], argdict)
+            g.cmds['ePrimer3_windows'].append((wcline, offset))
+            clines.append(wcline)
     return clines
 
 
+def write_windows(seqfile, filestem, window, overlap):
+    """Write overlapping windows of a sequence to FASTA files
+
+    - seqfile     path to FASTA file with a single (stitched) sequence
+    - filestem    path stem for window FASTA files
+    - window      length of each window
+    - overlap     length of overlap between consecutive windows
+
+    Returns a list of (path, offset) tuples, where offset is the zero-indexed
+    position of the start of the window in the sequence.
+    """
+    try:
+        record = SeqIO.read(seqfile, 'fasta')
+    except ValueError:
+        raise ValueError("Cannot split %s into windows: sequences must be " %
+                         seqfile + "stitched (see pdp.py config)")
+    windows = []
+    for offset in window_offsets(len(record), window, overlap):
+        subrecord = record[offset:offset + window]
+        subrecord.id = '%s_%d-%d' % (record.id, offset + 1,
+                                     offset + len(subrecord))
+        subrecord.description = ''
+        outfname = '%s_window%05d.fasta' % (filestem, len(windows) + 1)
+        SeqIO.write([subrecord], outfname, 'fasta')
+        windows.append((outfname, offset))
+    return windows
+
+
+def window_offsets(length, window, overlap):
+    """Return start positions of overlapping windows covering a sequence
+
+    - length      length of the sequence
+    - window      length of each window
+    - overlap     length of overlap between consecutive windows
+    """
+    if not 0 <= overlap < window:
+        raise ValueError("Window overlap must be smaller than the window " +
+                         "(got window %d, overlap %d)" % (window, overlap))
+    return list(range(0, max(length - overlap, 1), window - overlap))
+
+
+def merge_window_primers(windows, outfname):
+    """Returns primers designed to sequence windows, in sequence coordinates
+
+    - windows     list of (ePrimer3 output path, offset) tuples, where
+                  offset is the position of the window in the sequence
+    - outfname    path to the ePrimer3 output file for the whole sequence
+
+    Primer positions are translated from window to sequence coordinates.
+    Primer sets found in more than one overlapping window are kept once, in
+    the order of the first window in which they were found. Primer sets are
+    named as load_primers() would name the primers in outfname.
+    """
+    return merge_primers(((load_primers(ep3file, fmt='eprimer3', noname=True),
+                           offset) for ep3file, offset in windows), outfname)
+
+
+def merge_primers(windows, outfname):
+    """Returns merged primers from sequence windows, in sequence coordinates
+
+    - windows     iterable of (primers, offset) tuples, where primers is a
+                  list of Primer3.Primers designed to a window, and offset
+                  is the position of the window in the sequence
+    - outfname    path to ePrimer3 output (or file stem) for the sequence
+
+    As for merge_window_primers(), but with primers already loaded.
+    """
+    merged, seen = [], set()
+    for primers, offset in windows:
+        for primer in primers:
+            primer.forward_start += offset
+            primer.reverse_start += offset
+            if primer.internal_seq:
+                primer.internal_start += offset
+            key = (primer.forward_start, primer.forward_seq,
+                   primer.reverse_start, primer.reverse_seq)
+            if key not in seen:
+                seen.add(key)
+                merged.append(primer)
+    stem = os.path.splitext(os.path.split(outfname)[-1])[0]
+    for idx, primer in enumerate(merged, 1):
+        primer.name = "%s_primer_%05d" % (stem, idx)
+    return merged
+
+
 def build_command(eprimer3_exe, seqfile, filestem, argdict=None):
     """Builds and returns ePrimer3 command line.
 
@@ -112,12 +469,46 @@ def build_command(eprimer3_exe, seqfile, filestem, argdict=None):
 def load_primers(infname, fmt='eprimer3', noname=False):
     """Load primers from a file.
 
-    The function can load JSON or ePrimer3 files - ePrimer3 by default.
+    The function can load JSON, binary (npz) or ePrimer3 files - ePrimer3
+    by default. To load a JSON or npz file as a PrimerTable, use
+    load_primer_table().
     """
     if fmt in ('ep3', 'eprimer3'):
         return __load_primers_eprimer3(infname, noname)
     elif fmt in ('json', ):
         return __load_primers_json(infname)
+    elif fmt in ('npz', ):
+        return PrimerTable.from_npz(infname).to_primers()
+
+
+def load_primer_table(infname):
+    """Load primers from a JSON or binary (.npz) file as a PrimerTable
+
+    The file format is determined by the file extension.
+    """
+    if os.path.splitext(infname)[-1].lower() == '.npz':
+        return PrimerTable.from_npz(infname)
+    return PrimerTable.from_json(infname)
+
+
+def filter_junction_primers(primers, contigs):
+    """Return PrimerTable of primer sets whose products lie within a contig
+
+    - primers     PrimerTable, or iterable of Primer3.Primers
+    - contigs     ContigIndex describing the location of contigs in the
+                  stitched sequence the primers were designed against
+
+    Primer sets whose product overlaps a spacer between stitched contigs are
+    artefacts of stitching, and are removed. ePrimer3 start positions are
+    1-based, and the product runs from the start of the forward primer to
+    the end of the reverse primer.
+    """
+    if not isinstance(primers, PrimerTable):
+        primers = PrimerTable.from_primers(primers)
+    starts = np.asarray(primers.column('forward_start')) - 1
+    ends = (np.asarray(primers.column('reverse_start')) - 1 +
+            np.asarray(primers.column('reverse_length')))
+    return primers.select(~contigs.spans_junctions(starts, ends))
 
 
 def __load_primers_eprimer3(infname, noname=False):
@@ -157,18 +548,24 @@ def __load_primers_json(infname):
 def write_primers(primers, outfilename, fmt='fasta'):
     """Write Primer3.Primers to file.
 
-    primers      - collection of Biopython primer objects
+    primers      - collection of Biopython primer objects, or PrimerTable
     outfilename  - path to output file
     format       - sequence format to write
 
     TODO: distribution dictionary
     """
     # Order primers before writing
-    primers = [
-        _[1] for _ in sorted([(primer.name, primer) for primer in primers])
-    ]
+    if isinstance(primers, PrimerTable):
+        primers = primers.sorted()
+    else:
+        primers = [
+            _[1] for _ in sorted([(primer.name, primer) for primer in primers],
+                                 key=lambda _: _[0])
+        ]
     if fmt in ('json', ):
         __write_primers_json(primers, outfilename)
+    elif fmt in ('npz', ):
+        __write_primers_npz(primers, outfilename)
     elif fmt in ('ep3', 'eprimer3'):
         __write_primers_eprimer3(primers, outfilename)
     elif fmt in ('tsv'):
@@ -252,6 +649,17 @@ def __write_primers_eprimer3(primers, outfname):
 
 
 def __write_primers_json(primers, outfname):
-    """Write Primer3 primer objects in JSON format."""
+    """Write Primer3 primer objects, or a PrimerTable, in JSON format."""
     with open(outfname, 'w') as ofh:
         json.dump(primers, ofh, cls=PrimersEncoder)
+
+
+def __write_primers_npz(primers, outfname):
+    """Write Primer3 primer objects, or a PrimerTable, in binary format.
+
+    Each primer field is written as a NumPy array in an .npz file, which
+    can be read one column at a time by PrimerTable.from_npz()
+    """
+    if not isinstance(primers, PrimerTable):
+        primers = PrimerTable.from_primers(primers)
+    primers.write_npz(outfname)
@@ -48,9 +48,10 @@ from collections import (defaultdict, namedtuple)
 
 from Bio import SeqIO
 from Bio.Phylo.TreeConstruction import DistanceCalculator
+from Bio.Seq import Seq
+from Bio.SeqRecord import SeqRecord
 
-from .eprimer3 import load_primers
-from .primersearch import (parse_output, PrimerSearchAmplimer)
+from .primersearch import (parse_results, PrimerSearchAmplimer)
 
 
 class PDPAmpliconError(Exception):
@@ -72,19 +73,22 @@ class PDPAmplicon(object):
                  primer=None,
                  primersearch=None,
                  amplimer=None,
-                 seq=None):
+                 seq=None,
+                 target=None):
         """Initialise object.
 
         - name       name for the amplicon
         - primer     primer object
         - psresult   primersearch result object (self-amplifiers don't have this)
         - amplimer   amplified region of genome (Biopython Seq)
+        - target     name of the genome the amplicon is amplified from
         """
         self._name = str(name)
         self.primer = primer
         self.psresult = primersearch
         self.amplimer = amplimer
         self.seq = seq
+        self.target = target
 
     @property
     def name(self):
@@ -117,6 +121,15 @@ class PDPAmplicon(object):
         """PrimerSearchAmplimer describing the amplimer used"""
         self._amplimer = val
 
+    @property
+    def target(self):
+        return self._target
+
+    @target.setter
+    def target(self, val):
+        """Name of the genome the amplicon is amplified from"""
+        self._target = val
+
     @property
     def seq(self):
         return self._seq
@@ -147,8 +160,13 @@ class PDPAmpliconCollection(object):
         self._name = str(name)
         self._amplicons = {}  # Amplicons stored, keyed by name
         self._primers = set()
+        # Amplicons indexed by primer name and by target genome name. These
+        # are maintained as amplicons are added.
+        self._primer_indexed = defaultdict(set)
+        self._target_indexed = defaultdict(set)
 
-    def new_amplicon(self, name, primer, primersearch, amplimer, seq):
+    def new_amplicon(self, name, primer, primersearch, amplimer, seq,
+                     target=None):
         """Create and return a new PDPAmplicon object
 
         - name            Identifier for the amplicon (unique)
@@ -156,21 +174,59 @@ class PDPAmpliconCollection(object):
         - primersearch    PrimerSearchRecord
         - amplimer        PrimerSearchAmplimer
         - seq             Biopython Seq
+        - target          Name of the amplified genome
         """
         if name in self._amplicons:  # Name must be unique
             raise PDPAmpliconError("New amplicon name must be unique")
-        self._amplicons[name] = PDPAmplicon(name, primer, primersearch,
-                                            amplimer, seq)
-        self.__index_by_primer()  # Build primer-indexed dict of amplicons
-        self._primers.add(primer)
-        return self._amplicons[name]
+        amplicon = PDPAmplicon(name, primer, primersearch, amplimer, seq,
+                               target)
+        self.__add(amplicon)
+        return amplicon
+
+    def add_many(self, amplicons):
+        """Create new PDPAmplicon objects in bulk, and return them as a list
+
+        - amplicons       iterable of tuples of arguments to new_amplicon()
+
+        If any amplicon name is not unique, an error is raised and no
+        amplicons from the passed iterable are added to the collection.
+        """
+        new = [PDPAmplicon(*_) for _ in amplicons]
+        names = {_.name for _ in new}
+        if len(names) != len(new) or not names.isdisjoint(self._amplicons):
+            raise PDPAmpliconError("New amplicon name must be unique")
+        for amplicon in new:
+            self.__add(amplicon)
+        return new
+
+    def __add(self, amplicon):
+        """Add a PDPAmplicon to the collection and its indexes"""
+        self._amplicons[amplicon.name] = amplicon
+        self._primers.add(amplicon.primer)
+        self._primer_indexed[amplicon.primer.name].add(amplicon)
+        if amplicon.target is not None:
+            self._target_indexed[amplicon.target].add(amplicon)
+
+    def get_primer_amplicons(self, primer_name):
+        """Returns a list of amplicons for named primer
+
+        - primer_name       Name of the primer we want amplicons for
+        """
+        return list(self._primer_indexed.get(primer_name, []))
+
+    def get_target_amplicons(self, target):
+        """Returns a list of amplicons from the named target genome
+
+        - target            Name of the genome we want amplicons for
+        """
+        return list(self._target_indexed.get(target, []))
 
     def get_primer_amplicon_sequences(self, primer_name):
         """Returns a list of amplicon sequences for named primer
 
         - primer_name       Name of the primer we want sequences for
         """
-        return [_.seq for _ in self._primer_indexed[primer_name]]
+        return [_.seq for _ in self.get_primer_amplicons(primer_name)]
 
     def __iter__(self):
         """Iterate over amplicons in the collection"""
@@ -185,12 +241,6 @@ class PDPAmpliconCollection(object):
         """Return number of amplicons in the collection"""
         return len(self._amplicons)
 
-    def __index_by_primer(self):
-        """Create internal index of amplicons keyed by primer name"""
-        self._primer_indexed = defaultdict(set)
-        for _ in self._amplicons.values():
-            self._primer_indexed[_.primer.name].add(_)
-
     @property
     def names(self):
         """List of names of amplicons"""
@@ -206,121 +256,237 @@ class PDPAmpliconCollection(object):
         """List of primer names in the collection"""
         return [_.name for _ in self._primers]
 
+    @property
+    def targets(self):
+        """List of names of genomes with amplicons in the collection"""
+        return list(self._target_indexed.keys())
+
     @property
     def primer_amplicons(self):
         """set of amplicons for a named primer"""
         return self._primer_indexed
 
+    @property
+    def target_amplicons(self):
+        """set of amplicons for a named target genome"""
+        return self._target_indexed
 
-def extract_amplicons(name,
-                      primers,
-                      pdpcoll,
-                      min_amplicon=50,
-                      max_amplicon=300):
-    """Return PDPAmpliconCollection corresponding to primers in the passed file
 
-    - name        identifier for this action
-    - primers     path to JSON format primer file
+class PDPGenomeStore(object):
+    """Random access to subsequences of the genomes in a PDPCollection
+
+    Each genome's FASTA file is scanned once, on first use, to build an
+    index of its sequence layout (in the manner of samtools faidx: the byte
+    offset of the sequence, and the number of bases and bytes per line).
+    Subsequences are then read directly from disk, so extracting an
+    amplicon costs time proportional to the amplicon length, not the
+    genome length, and genomes are never held in memory in full.
+
+    Files with irregular line lengths can't be indexed this way, and are
+    loaded in full with SeqIO and cached instead.
+    """
+
+    def __init__(self, pdpcoll):
+        """Initialise store from the passed PDPCollection."""
+        self._seqfiles = {_.name: _.seqfile for _ in pdpcoll.data}
+        self._index = {}  # Genome layout, keyed by genome name
+        self._handles = {}  # Open file handles, keyed by genome name
+        self._records = {}  # Fallback in-memory SeqRecords
+
+    def fetch(self, name, start, end):
+        """Return SeqRecord for bases start:end (Python slice) of genome.
+
+        - name      name of genome in the PDPCollection
+        - start     zero-based start of region
+        - end       zero-based, exclusive end of region
+        """
+        layout = self.__layout(name)
+        if layout is None:
+            return self._records[name][start:end]
+        offset, length, linebases, linebytes = layout
+        start, end = max(0, min(start, length)), max(0, min(end, length))
+        if end <= start:
+            return SeqRecord(Seq(''), id=name)
+        first = offset + (start // linebases) * linebytes + start % linebases
+        last = offset + (end // linebases) * linebytes + end % linebases
+        fh = self._handles[name]
+        fh.seek(first)
+        seq = fh.read(last - first).translate(None, b'\r\n').decode()
+        return SeqRecord(Seq(seq), id=name)
+
+    def length(self, name):
+        """Return length of the named genome sequence."""
+        layout = self.__layout(name)
+        if layout is None:
+            return len(self._records[name])
+        return layout[1]
+
+    def close(self):
+        """Close open sequence files."""
+        for fh in self._handles.values():
+            fh.close()
+        self._handles = {}
+
+    def __layout(self, name):
+        """Return (offset, length, linebases, linebytes) for named genome.
+
+        Returns None if the genome is held in memory instead.
+        """
+        if name not in self._index:
+            self._index[name] = self.__index_fasta(name)
+            if self._index[name] is None:
+                self._records[name] = SeqIO.read(self._seqfiles[name],
+                                                 'fasta')
+            else:
+                self._handles[name] = open(self._seqfiles[name], 'rb')
+        return self._index[name]
+
+    def __index_fasta(self, name):
+        """Scan single-sequence FASTA file for named genome.
+
+        Returns (offset, length, linebases, linebytes), or None if the file
+        layout is irregular.
+        """
+        offset, length, linebases, linebytes = None, 0, None, None
+        lastline = False  # True once a short line has been seen
+        records = 0
+        with open(self._seqfiles[name], 'rb') as ifh:
+            position = 0
+            for line in ifh:
+                if line.startswith(b'>'):
+                    records += 1
+                    offset = position + len(line)
+                elif line.strip():
+                    bases = len(line.rstrip(b'\r\n'))
+                    if linebases is None:
+                        linebases, linebytes = bases, len(line)
+                    elif lastline or bases > linebases:
+                        return None
+                    if bases < linebases:
+                        lastline = True
+                    length += bases
+                elif length:
+                    lastline = True
+                position += len(line)
+        if records != 1 or linebases is None:
+            return None
+        return (offset, length, linebases, linebytes)
+
+
+def index_primersearch(pdpcoll, sources):
+    """Return primer name-keyed index of PrimerSearch results
+
+    - pdpcoll     PDPCollection containing links to primersearch output
+    - sources     names of the genomes whose primers we want results for
+
+    Each primersearch JSON file, and each primersearch output file it
+    refers to, is read exactly once. The returned dictionary is keyed
+    by primer name, with values a list of (target genome name,
+    PrimerSearchRecord) tuples, one for each target in which the primer
+    produces at least one amplimer.
+    """
+    namedict = {_.name: _ for _ in pdpcoll.data}
+    index = defaultdict(list)
+    for source in sources:
+        with open(namedict[source].primersearch) as ifh:
+            psdata = json.load(ifh)
+        targets = [_ for _ in psdata.keys() if _ not in ('primers', 'query')]
+        for target in targets:
+            psresults = parse_results(psdata[target])
+            for primername in psresults.amplified():
+                index[primername].append((target, psresults[primername]))
+    return index
+
+
+def iter_amplicons(primers,
+                   pdpcoll,
+                   min_amplicon=50,
+                   max_amplicon=300,
+                   genomes=None):
+    """Generate data for each amplicon of the passed primers
+
+    - primers     iterable of Primer3.Primers or PrimerRecord objects (e.g.
+                  a PrimerTable)
     - pdpcoll     PDPCollection containing information about the primer
                   and target genome sources (primersearch, seqfile,
                   filestem)
+    - genomes     PDPGenomeStore for the collection (optional)
+
+    Yields (name, primer, primersearch, amplimer, seq, target) tuples
+    suitable for PDPAmpliconCollection.new_amplicon(). Primersearch output is read and
+    indexed by primer name once before any amplicons are extracted, and
+    the amplicon sequences are read directly from the genome files, so
+    total time is linear in the number of amplicons.
     """
-    # Make dictionaries of each config entry by filestem and name
+    primers = list(primers)
     colldict = {_.filestem: _ for _ in pdpcoll.data}
-    namedict = {_.name: _ for _ in pdpcoll.data}
-
-    # For each primer, we identify the corresponding config file entry
-    # We're going to extract each primer amplicon individually. We know
-    # at this point that the primer is predicted specific only for
-    # targets of a particular class, so we can scrape all the relevant
-    # primersearch files. We cache those files as we see them, to save on
-    # file IO, in a dictionary keyed by primersearch output filename.
-    # We also cache genome data, and the complete primer list for each
-    # source genome
-    # We store amplicons in a list
-    psoutput_cache = {}
-    seq_cache = {}
-    sourceprimer_cache = {}
-    amplicons = PDPAmpliconCollection(name)
-
-    # Process each primer
-    for idx, primer in enumerate(primers):
-        stem = primer.name.split("_primer_")[0]
-        source_data = colldict[stem]
-        seq_cache[source_data.name] = SeqIO.read(source_data.seqfile, "fasta")
-
-        # Cache the source genome primer information
-        if stem not in sourceprimer_cache:
-            sourceprimer_cache[stem] = {
-                _.name: _
-                for _ in load_primers(source_data.primers, fmt='json')
-            }
-
-        # Get primersearch output for each primer as we encounter it
-        with open(source_data.primersearch) as ifh:
-            psdata = json.load(ifh)
-            targets = [
-                _ for _ in psdata.keys() if _ not in ('primers', 'query')
-            ]
-
-            # Examine each target for the primer
-            for target in targets:
-
-                # Cache primersearch output for the target
-                if psdata[target] not in psoutput_cache:
-                    psoutput_cache[psdata[target]] = {
-                        _.name: _
-                        for _ in parse_output(psdata[target])
-                    }
-                # TODO: turn output from parse_output into an indexable object,
-                #       so we can use primer names to get results, rather than
-                #       hacking that, as we do above.
-
-                # Cache genome data for the target
-                if target not in seq_cache:
-                    seq_cache[target] = SeqIO.read(namedict[target].seqfile,
-                                                   "fasta")
-                target_genome = seq_cache[target]
-
-                # psresult holds the primersearch result - we create an amplicon
-                # for each amplimer in the psresult
-                # If this primer isn't in the set that amplifies the target,
-                # continue to the next target
-                if primer.name not in psoutput_cache[psdata[target]]:
+    if genomes is None:
+        genomes = PDPGenomeStore(pdpcoll)
+
+    # Find the source genome for each primer, and build the index of
+    # primersearch results for those sources
+    sources = [colldict[primer.name.split("_primer_")[0]] for
+               primer in primers]
+    hits = index_primersearch(pdpcoll, {_.name for _ in sources})
+
+    for primer, source_data in zip(primers, sources):
+        # psresult holds the primersearch result - we create an amplicon
+        # for each amplimer in the psresult
+        for target, psresult in hits.get(primer.name, []):
+            target_len = genomes.length(target)
+            for idx, amplimer in enumerate(psresult.amplimers):
+                coords = (amplimer.start - 1,
+                          target_len - (amplimer.revstart - 1))
+                # Extract the genome sequence
+                # We have to account here for forward/reverse primer
+                # amplification wrt target genome sequence. We want
+                # all the amplimer sequences to be identically-stranded
+                # for downstream alignments so, if the forward/reverse
+                # primer sequences don't match between the primer sets and
+                # the PrimerSearch results, we flip the sequence here.
+                # We check the amplicon length before reading sequence.
+                if not max_amplicon > abs(coords[1] - coords[0]) > \
+                        min_amplicon:
                     continue
-                psresult = psoutput_cache[psdata[target]][primer.name]
-                for idx, amplimer in enumerate(psresult.amplimers):
-                    coords = (amplimer.start - 1,
-                              len(target_genome) - (amplimer.revstart - 1))
-                    # Extract the genome sequence
-                    # We have to account here for forward/reverse primer
-                    # amplification wrt target genome sequence. We want
-                    # all the amplimer sequences to be identically-stranded
-                    # for downstream alignments so, if the forward/reverse
-                    # primer sequences don't match between the primer sets and
-                    # the PrimerSearch results, we flip the sequence here.
-                    seq = target_genome[min(coords):max(coords)]
-                    if primer.forward_seq != amplimer.forward_seq:
-                        seq = seq.reverse_complement()
-                    if max_amplicon > len(seq) > min_amplicon:
-                        amplicon = amplicons.new_amplicon(
-                            '_'.join([primer.name, target,
-                                      str(idx + 1)]), primer, psresult,
-                            amplimer, seq)
+                seq = genomes.fetch(target, min(coords), max(coords))
+                if primer.forward_seq != amplimer.forward_seq:
+                    seq = seq.reverse_complement()
+                if max_amplicon > len(seq) > min_amplicon:
+                    yield ('_'.join([primer.name, target, str(idx + 1)]),
+                           primer, psresult, amplimer, seq, target)
 
         # Get the self-amplification amplicon for this primer
-        selfprimer = sourceprimer_cache[stem][primer.name]
         amplimer = PrimerSearchAmplimer("Amplimer 1")
         amplimer.sequence = source_data.name
         amplimer.length = primer.size
         amplimer.start = primer.forward_start
         amplimer.end = primer.reverse_start + primer.reverse_length
-        seq = seq_cache[
-            source_data.name][primer.forward_start - 1:
-                              primer.reverse_start + primer.reverse_length - 1]
-        amplicon = amplicons.new_amplicon('_'.join(
-            [primer.name, source_data.name, "1"]), primer, None, amplimer, seq)
+        seq = genomes.fetch(source_data.name, primer.forward_start - 1,
+                            primer.reverse_start + primer.reverse_length - 1)
+        yield ('_'.join([primer.name, source_data.name, "1"]), primer, None,
+               amplimer, seq, source_data.name)
 
+
+def extract_amplicons(name,
+                      primers,
+                      pdpcoll,
+                      min_amplicon=50,
+                      max_amplicon=300):
+    """Return PDPAmpliconCollection corresponding to primers in the passed file
+
+    - name        identifier for this action
+    - primers     path to JSON format primer file
+    - pdpcoll     PDPCollection containing information about the primer
+                  and target genome sources (primersearch, seqfile,
+                  filestem)
+    """
+    amplicons = PDPAmpliconCollection(name)
+    genomes = PDPGenomeStore(pdpcoll)
+    try:
+        amplicons.add_many(iter_amplicons(primers, pdpcoll, min_amplicon,
+                                          max_amplicon, genomes))
+    finally:
+        genomes.close()
     return amplicons
 
 
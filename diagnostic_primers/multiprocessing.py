@@ -49,33 +49,149 @@ Python's multiprocessing module to distribute command-line jobs.
 """
 
 import multiprocessing
+import os
+import signal
 import subprocess
 import sys
+import threading
+
+from multiprocessing.pool import ThreadPool
+
+
+# Return code reported for jobs killed on timeout or cancellation
+KILLED = -signal.SIGKILL if hasattr(signal, 'SIGKILL') else -1
 
 
 # Run a set of command lines using multiprocessing
-def run(cmdlines, workers=None, verbose=False):
+def run(cmdlines, workers=None, verbose=False, timeout=None, failfast=False,
+        callback=None):
     """Distributes passed command-line jobs using multiprocessing.
 
     - cmdlines - an iterable of command line strings
+    - workers - number of jobs to run concurrently (default: number of cores)
+    - timeout - time in seconds after which a job is killed
+    - failfast - if True, stop all jobs once any job fails
+    - callback - function called with each CompletedProcess as it finishes
 
-    Returns CompletedProcess objects for each command. These provide access
-    to the return code, stdout and stderr, along with the arguments that
-    launched the process (in this case the full command-line).
+    Returns CompletedProcess objects for each command, in the order the
+    commands were passed. These provide access to the return code, stdout
+    and stderr, along with the arguments that launched the process (in this
+    case the full command-line). If failfast is set, only the jobs that
+    completed or were killed before the run stopped are returned.
     """
-    # Run jobs
-    # If workers is None or greater than the number of cores available,
-    # it will be set to the maximum number of cores
-    # stderr is piped to DEVNULL because piping to PIPE could block other
-    # threads (seen on the JHI development machine as a result of an old
-    # Prodigal version). We may want to revisit this to capture the output
-    # of processes in a Manager.
-    pool = multiprocessing.Pool(processes=workers)
-    results = [pool.apply_async(subprocess.run, (str(cline), ),
-                                {'shell': sys.platform != "win32",
-                                 'stdout': subprocess.PIPE,
-                                 'stderr': subprocess.PIPE})
-               for cline in cmdlines]
-    pool.close()        # Run jobs
-    pool.join()         # Collect output
-    return [r.get() for r in results]
+    results = {}
+    for idx, result in run_iter(cmdlines, workers, timeout, failfast,
+                                indexed=True):
+        if callback is not None:
+            callback(result)
+        results[idx] = result
+    return [results[idx] for idx in sorted(results)]
+
+
+def run_iter(cmdlines, workers=None, timeout=None, failfast=False,
+             indexed=False):
+    """Generator yielding CompletedProcess objects as each job finishes.
+
+    - cmdlines - an iterable of command line strings
+    - workers - number of jobs to run concurrently (default: number of cores)
+    - timeout - time in seconds after which a job is killed
+    - failfast - if True, stop all jobs once any job fails
+    - indexed - if True, yield (index, CompletedProcess) tuples, where index
+                is the position of the command in cmdlines
+
+    Results are yielded in order of completion, so the caller can process
+    the output of one job while the others are still running. Each job is
+    run as a subprocess, waited on by a thread in a pool of workers.
+    Jobs that exceed the timeout are killed, and report a return code of
+    KILLED, with a message in stderr.
+
+    cmdlines is consumed lazily, in a separate thread, so it may be a
+    generator that waits for new jobs (e.g. from a queue) while the results
+    of earlier jobs are yielded.
+
+    If failfast is True, the first job to return a nonzero exit code is
+    yielded, jobs that have not yet started are skipped, and running jobs
+    are killed. Jobs are also cancelled if the generator is closed early.
+    """
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+    runner = _JobRunner(timeout)
+    jobs = enumerate(str(cline) for cline in cmdlines)
+    pool = ThreadPool(processes=workers)
+    try:
+        for idx, result in pool.imap_unordered(runner.run, jobs):
+            if result is None:      # skipped after cancellation
+                continue
+            yield (idx, result) if indexed else result
+            if failfast and result.returncode != 0:
+                break
+    finally:
+        runner.cancel()
+        pool.terminate()
+        pool.join()
+
+
+class _JobRunner(object):
+
+    """Runs command lines as subprocesses, tracking those still running."""
+
+    def __init__(self, timeout=None):
+        self._timeout = timeout
+        self._cancelled = threading.Event()
+        self._lock = threading.Lock()
+        self._procs = set()
+
+    def run(self, job):
+        """Run a single (index, command line) job, returning (index, result)
+
+        Returns (index, None) if the runner was cancelled before the job
+        started.
+        """
+        idx, cline = job
+        with self._lock:
+            if self._cancelled.is_set():
+                return idx, None
+            # The subprocess runs in its own session so that any children
+            # of the shell can be killed along with it
+            proc = subprocess.Popen(cline,
+                                    shell=sys.platform != "win32",
+                                    stdout=subprocess.PIPE,
+                                    stderr=subprocess.PIPE,
+                                    universal_newlines=False,
+                                    start_new_session=os.name == "posix")
+            self._procs.add(proc)
+        try:
+            stdout, stderr = proc.communicate(timeout=self._timeout)
+            returncode = proc.returncode
+        except subprocess.TimeoutExpired:
+            self._kill(proc)
+            stdout, stderr = proc.communicate()
+            stderr += ("Job killed after %s seconds\n" %
+                       self._timeout).encode()
+            returncode = KILLED
+        finally:
+            with self._lock:
+                self._procs.discard(proc)
+        if self._cancelled.is_set() and returncode == KILLED:
+            stderr += b"Job cancelled\n"
+        return idx, subprocess.CompletedProcess(cline, returncode,
+                                                stdout, stderr)
+
+    def cancel(self):
+        """Skip jobs not yet started, and kill those still running."""
+        with self._lock:
+            self._cancelled.set()
+            procs = list(self._procs)
+        for proc in procs:
+            self._kill(proc)
+
+    @staticmethod
+    def _kill(proc):
+        """Kill the passed process and, where possible, its process group."""
+        try:
+            if os.name == "posix":
+                os.killpg(proc.pid, signal.SIGKILL)
+            else:
+                proc.kill()
+        except (ProcessLookupError, PermissionError):
+            pass
@@ -0,0 +1,354 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""pipeline.py
+
+Code to run a dependency graph of tasks, with resumable state
+
+(c) The James Hutton Institute 2018
+
+Author: Leighton Pritchard
+Contact: leighton.pritchard@hutton.ac.uk
+
+Leighton Pritchard,
+Information and Computing Sciences,
+James Hutton Institute,
+Errol Road,
+Invergowrie,
+Dundee,
+DD6 9LH,
+Scotland,
+UK
+
+The MIT License
+
+Copyright (c) 2018 The James Hutton Institute
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+
+import json
+import os
+import queue
+import traceback
+
+from collections import defaultdict, deque
+
+from . import cache, multiprocessing, sge, sge_jobs
+
+
+# Prefix for names of pipeline jobs submitted to SGE
+JOBPREFIX = 'pdp_run'
+
+
+class PDPTask(object):
+
+    """A single task in a pipeline, and the tasks it depends on.
+
+    - name       unique name for the task
+    - command    function returning the command line to run for the task,
+                 or None if the task has no external command. It is called
+                 only once the task's dependencies are complete, so may use
+                 their output.
+    - action     function called in the pipeline process with the command
+                 line, once the command has completed (or as soon as the
+                 dependencies are complete, if there is no command). It
+                 returns a JSON-serialisable dictionary of results (or None)
+    - update     function called with the task's results, both when the
+                 task is run and when its saved results are reused
+    - depends    names of the tasks that must complete first
+    """
+
+    def __init__(self, name, command=None, action=None, update=None,
+                 depends=()):
+        self.name = name
+        self.command = command
+        self.action = action
+        self.update = update
+        self.depends = list(depends)
+
+    def finish(self, cline):
+        """Run the task's action and update, returning its results"""
+        results = None
+        if self.action is not None:
+            results = self.action(cline)
+        if self.update is not None:
+            self.update(results)
+        return results
+
+
+class PDPPipelineError(Exception):
+    """Exception raised when a pipeline cannot be run"""
+
+    def __init__(self, msg="Error in pipeline"):
+        Exception.__init__(self, msg)
+
+
+def load_state(statefile):
+    """Returns dictionary of saved task state from a pipeline state file
+
+    - statefile     path to JSON state file (which need not exist)
+
+    Each entry is keyed by task name, and holds the command line the task
+    ran ('command') and the results of its action ('results').
+    """
+    if not os.path.isfile(statefile):
+        return {}
+    with open(statefile, 'r') as ifh:
+        return json.load(ifh)
+
+
+def save_state(state, statefile):
+    """Write pipeline task state to file, replacing any earlier state
+
+    - state         dictionary of task state (see load_state())
+    - statefile     path to JSON state file
+
+    The state is written to a temporary file which then replaces the state
+    file, so that an interrupted run never leaves a partial state file.
+    """
+    tmpfile = statefile + '.tmp'
+    with open(tmpfile, 'w') as ofh:
+        json.dump(state, ofh, sort_keys=True, indent=1)
+    os.replace(tmpfile, statefile)
+
+
+def run_tasks(tasks, statefile, scheduler='multiprocessing', workers=None,
+              timeout=None, failfast=False, cachedir=None, logger=None,
+              sgedir=os.curdir, qsub=sge.QSUB_DEFAULT,
+              qstat=sge.QSTAT_DEFAULT):
+    """Run a dependency graph of PDPTasks, returning names of failed tasks
+
+    - tasks         iterable of PDPTask objects; each task must follow the
+                    tasks it depends on
+    - statefile     path to JSON file recording completed tasks
+    - scheduler     'multiprocessing' or 'SGE'
+    - workers       number of concurrent jobs (multiprocessing only)
+    - timeout       kill jobs running longer than this many seconds
+                    (multiprocessing only)
+    - failfast      if True, stop all jobs as soon as one fails
+    - cachedir      path to tool output cache (see cache.PDPToolCache)
+    - logger        a logger module logger (optional)
+    - sgedir        root directory for SGE scripts and output (SGE only)
+    - qsub          command used to submit SGE jobs
+    - qstat         command used to query SGE job status
+
+    Each task starts as soon as the tasks it depends on are complete, so
+    that later tasks for one input can run while earlier tasks for other
+    inputs are still running. Task commands are run by the scheduler;
+    actions run in this process, as each command completes.
+
+    With SGE, the commands of all tasks that become ready together are
+    submitted as array jobs, one for each executable (see
+    sge.compile_jobgroups()), and each array's tasks complete together.
+    For a graph with the same tasks for every input, each stage of the
+    pipeline is then a single qsub call, however many inputs there are.
+
+    The state file is updated as each task completes. When the graph is
+    run again, a task is not rerun if it completed before with the same
+    command line, and none of the tasks it depends on were rerun: its saved
+    results are passed to its update function instead.
+
+    A task fails if its command returns a nonzero exit code, or its action
+    raises an exception. Tasks that depend on a failed task are not run.
+    Returns the names of the failed tasks.
+    """
+    tasks = list(tasks)
+    dependents, waiting = {}, {}
+    for task in tasks:
+        if task.name in dependents:
+            raise PDPPipelineError("Task %s is defined twice" % task.name)
+        missing = [_ for _ in task.depends if _ not in dependents]
+        if missing:
+            raise PDPPipelineError("Task %s depends on %s, which must be " %
+                                   (task.name, ', '.join(missing)) +
+                                   "defined before it")
+        dependents[task.name] = []
+        for dep in task.depends:
+            dependents[dep].append(task)
+        waiting[task.name] = set(task.depends)
+
+    state = load_state(statefile)
+    toolcache = cache.PDPToolCache(cachedir) if cachedir else None
+    if scheduler == 'multiprocessing':
+        runner = _LocalRunner(workers, timeout)
+    elif scheduler == 'SGE':
+        runner = _SGERunner(logger, sgedir, qsub, qstat)
+    else:
+        raise ValueError('Scheduler must be one of ' +
+                         '[multiprocessing|SGE], got %s' % scheduler)
+
+    ready = deque(task for task in tasks if not task.depends)
+    rerun, failed, running = set(), [], {}
+
+    def complete(task, cline):
+        """Finish a task, record its state, and release its dependents"""
+        try:
+            results = task.finish(cline)
+        except (Exception, SystemExit):
+            if logger:
+                logger.error("Task %s failed:\n%s", task.name,
+                             traceback.format_exc())
+            failed.append(task.name)
+            return
+        state[task.name] = {'command': cline, 'results': results}
+        save_state(state, statefile)
+        rerun.add(task.name)
+        release(task)
+
+    def release(task):
+        """Queue the dependents of a completed task that are now ready"""
+        for dependent in dependents[task.name]:
+            waiting[dependent.name].discard(task.name)
+            if not waiting[dependent.name]:
+                ready.append(dependent)
+
+    try:
+        while ready or running:
+            while ready and not (failfast and failed):
+                task = ready.popleft()
+                cline = None if task.command is None else str(task.command())
+                saved = state.get(task.name)
+                if saved is not None and saved['command'] == cline and \
+                   not rerun.intersection(task.depends):
+                    if logger:
+                        logger.info("Task %s complete in earlier run",
+                                    task.name)
+                    if task.update is not None:
+                        task.update(saved['results'])
+                    release(task)
+                    continue
+                # Forget earlier results until the task completes again
+                state.pop(task.name, None)
+                if cline is None:
+                    if logger:
+                        logger.info("Running task %s", task.name)
+                    complete(task, cline)
+                elif toolcache is not None and toolcache.restore(cline):
+                    if logger:
+                        logger.info("Task %s output restored from cache",
+                                    task.name)
+                    complete(task, cline)
+                else:
+                    if logger:
+                        logger.info("Starting task %s: %s", task.name, cline)
+                    running[runner.submit(cline)] = (task, cline)
+            runner.flush()
+            if not running or (failfast and failed):
+                break
+            for key, returncode, message in runner.wait_finished():
+                task, cline = running.pop(key)
+                if returncode != 0:
+                    if logger:
+                        logger.error("Task %s failed: %s\n%s", task.name,
+                                     cline, message)
+                    failed.append(task.name)
+                    continue
+                if logger:
+                    logger.info("Task %s finished", task.name)
+                if toolcache is not None:
+                    toolcache.store(cline)
+                complete(task, cline)
+    finally:
+        runner.close()
+    return failed
+
+
+class _LocalRunner(object):
+
+    """Runs command lines on local workers, as they are submitted."""
+
+    def __init__(self, workers=None, timeout=None):
+        self._feed = queue.Queue()
+        self._count = 0
+        self._results = multiprocessing.run_iter(iter(self._feed.get, None),
+                                                 workers=workers,
+                                                 timeout=timeout,
+                                                 indexed=True)
+
+    def submit(self, cline):
+        """Start running a command line, returning its key"""
+        self._feed.put(cline)
+        self._count += 1
+        return self._count - 1
+
+    def flush(self):
+        """Start any queued command lines (they are started on submission)"""
+        pass
+
+    def wait_finished(self):
+        """Wait for a job to finish, returning [(key, returncode, message)]"""
+        key, result = next(self._results)
+        return [(key, result.returncode,
+                 result.stderr.decode(errors='replace'))]
+
+    def close(self):
+        """Stop accepting jobs, and kill any that are still running"""
+        self._feed.put(None)
+        self._results.close()
+
+
+class _SGERunner(object):
+
+    """Submits command lines to SGE as array jobs, a batch at a time."""
+
+    def __init__(self, logger=None, root_dir=os.curdir,
+                 qsub=sge.QSUB_DEFAULT, qstat=sge.QSTAT_DEFAULT):
+        self._root = root_dir
+        self._qsub = qsub
+        self._queued = []            # Jobs waiting for the next flush()
+        self._pending = {}           # submitted JobGroups, keyed by name
+        self._count = 0
+        self._batches = 0
+        self._jobs = sge.iter_finished_jobs(root_dir, self._pending, logger,
+                                            qstat)
+
+    def submit(self, cline):
+        """Queue a command line for submission, returning its key"""
+        self._count += 1
+        job = sge_jobs.Job("%s_%06d" % (JOBPREFIX, self._count), cline)
+        self._queued.append(job)
+        return job.name
+
+    def flush(self):
+        """Submit the queued command lines as array jobs"""
+        if not self._queued:
+            return
+        self._batches += 1
+        jobgroups = sge.compile_jobgroups(self._queued, "%s_%06d" %
+                                          (JOBPREFIX, self._batches))
+        sge.build_and_submit_jobs(self._root, jobgroups, self._qsub)
+        self._pending.update((_.name, _) for _ in jobgroups)
+        self._queued = []
+
+    def wait_finished(self):
+        """Wait for an array job to finish, returning a list of
+        (key, returncode, message) for each of its tasks
+        """
+        jobgroup, failures = next(self._jobs)
+        messages = defaultdict(list)     # failure messages, by task
+        for failure in failures:
+            messages[failure.task].append(failure.message)
+        finished = []
+        for task, job in enumerate(jobgroup.jobs, 1):
+            message = '; '.join(messages[task] + messages[None])
+            finished.append((job.name, 1 if message else 0, message))
+        return finished
+
+    def close(self):
+        """Stop tracking submitted jobs (which are left to run)"""
+        self._jobs.close()
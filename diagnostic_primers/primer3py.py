@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""primer3py.py
+
+Code to design primers in-process with the primer3-py library
+
+(c) The James Hutton Institute 2018
+
+Author: Leighton Pritchard
+Contact: leighton.pritchard@hutton.ac.uk
+
+Leighton Pritchard,
+Information and Computing Sciences,
+James Hutton Institute,
+Errol Road,
+Invergowrie,
+Dundee,
+DD6 9LH,
+Scotland,
+UK
+
+The MIT License
+
+Copyright (c) 2018 The James Hutton Institute
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+
+
+import multiprocessing
+import os
+
+from Bio import SeqIO
+from Bio.Emboss import Primer3
+
+from .eprimer3 import (merge_primers, window_offsets)
+
+try:
+    import primer3
+except ImportError:
+    primer3 = None
+
+
+# primer3 settings corresponding to the ePrimer3 options (the ep_* arguments
+# of the pdp.py eprimer3 subcommand)
+EP3_TAGS = {'numreturn': 'PRIMER_NUM_RETURN',
+            'osize': 'PRIMER_OPT_SIZE',
+            'minsize': 'PRIMER_MIN_SIZE',
+            'maxsize': 'PRIMER_MAX_SIZE',
+            'opttm': 'PRIMER_OPT_TM',
+            'mintm': 'PRIMER_MIN_TM',
+            'maxtm': 'PRIMER_MAX_TM',
+            'ogcpercent': 'PRIMER_OPT_GC_PERCENT',
+            'mingc': 'PRIMER_MIN_GC',
+            'maxgc': 'PRIMER_MAX_GC',
+            'psizeopt': 'PRIMER_PRODUCT_OPT_SIZE',
+            'maxpolyx': 'PRIMER_MAX_POLY_X',
+            'hybridprobe': 'PRIMER_PICK_INTERNAL_OLIGO',
+            'osizeopt': 'PRIMER_INTERNAL_OPT_SIZE',
+            'ominsize': 'PRIMER_INTERNAL_MIN_SIZE',
+            'omaxsize': 'PRIMER_INTERNAL_MAX_SIZE',
+            'otmopt': 'PRIMER_INTERNAL_OPT_TM',
+            'otmmin': 'PRIMER_INTERNAL_MIN_TM',
+            'otmmax': 'PRIMER_INTERNAL_MAX_TM',
+            'ogcopt': 'PRIMER_INTERNAL_OPT_GC_PERCENT',
+            'ogcmin': 'PRIMER_INTERNAL_MIN_GC',
+            'ogcmax': 'PRIMER_INTERNAL_MAX_GC'}
+
+# primer3 settings matching the Tm calculation and oligo alignment used by
+# EMBOSS ePrimer3, so that the engines design comparable primers
+EP3_COMPATIBLE = {'PRIMER_TM_FORMULA': 0,
+                  'PRIMER_SALT_CORRECTIONS': 0,
+                  'PRIMER_THERMODYNAMIC_OLIGO_ALIGNMENT': 0,
+                  'PRIMER_THERMODYNAMIC_TEMPLATE_ALIGNMENT': 0}
+
+
+class PDPPrimer3Error(Exception):
+
+    """Exception raised when primers cannot be designed with primer3-py."""
+
+    def __init__(self, message):
+        super(PDPPrimer3Error, self).__init__(message)
+
+
+def build_global_args(argdict=None):
+    """Return primer3 global settings for the passed ePrimer3 arguments
+
+    - argdict     dictionary of arguments, as for eprimer3.build_command();
+                  keys starting 'ep_' name ePrimer3 options
+
+    The product size range defaults to 0-200, as for ePrimer3.
+    """
+    global_args = dict(EP3_COMPATIBLE)
+    prange = [0, 200]
+    for arg, val in (argdict or {}).items():
+        if not arg.startswith('ep_'):
+            continue
+        arg = arg[3:]
+        if arg == 'psizemin':
+            prange[0] = val
+        elif arg == 'psizemax':
+            prange[1] = val
+        elif arg in EP3_TAGS:
+            global_args[EP3_TAGS[arg]] = int(val) if \
+                isinstance(val, bool) else val
+        else:
+            raise PDPPrimer3Error("ePrimer3 option %s is not supported " %
+                                  arg + "by the primer3-py engine")
+    global_args['PRIMER_PRODUCT_SIZE_RANGE'] = [prange]
+    return global_args
+
+
+def design_collection(collection, outdir, argdict=None, workers=None,
+                      window=None, overlap=None):
+    """Design primers to each sequence in the passed PDPCollection
+
+    - collection  PDPCollection describing input sequences
+    - outdir      directory for primer output files
+    - argdict     dictionary of ePrimer3 arguments (see build_global_args())
+    - workers     number of worker processes (default: number of cores)
+    - window      if set, design primers to windows of this length
+    - overlap     overlap between windows (default: maximum product size)
+
+    Primers are designed in-process with primer3-py, from sequences held in
+    memory, so no intermediate files are written. Windows (or whole
+    sequences) are distributed across a pool of worker processes.
+
+    Returns a dictionary, keyed by PDPData name, of (outfile, primers)
+    tuples. outfile is the path to which ePrimer3 would write output for the
+    sequence (though no file is written), and primers is a list of
+    Primer3.Primers objects in sequence coordinates, named as
+    eprimer3.load_primers() would name the primers in that file.
+    """
+    if primer3 is None:
+        raise PDPPrimer3Error("The primer3-py package is required to " +
+                              "design primers with the primer3 engine")
+    global_args = build_global_args(argdict)
+    if window is not None and overlap is None:
+        overlap = global_args['PRIMER_PRODUCT_SIZE_RANGE'][0][1]
+
+    # One job per window (or per sequence, if not using windows)
+    jobs, windows, outfiles = [], [], {}
+    for gcc in collection.data:
+        outfiles[gcc.name] = os.path.join(outdir, os.path.splitext(
+            os.path.split(gcc.seqfile)[-1])[0] + '.eprimer3')
+        try:
+            seq = str(SeqIO.read(gcc.seqfile, 'fasta').seq)
+        except ValueError:
+            raise PDPPrimer3Error("%s must contain a single sequence " %
+                                  gcc.seqfile + "(see pdp.py config)")
+        if window is None:
+            jobs.append((seq, global_args))
+            windows.append((gcc.name, 0))
+            continue
+        for offset in window_offsets(len(seq), window, overlap):
+            jobs.append((seq[offset:offset + window], global_args))
+            windows.append((gcc.name, offset))
+
+    pool = multiprocessing.Pool(processes=workers)
+    results = pool.map(_design_window, jobs)
+    pool.close()
+    pool.join()
+
+    # Merge window primers for each input sequence, in window order
+    merged = {gcc.name: [] for gcc in collection.data}
+    for (name, offset), primers in zip(windows, results):
+        merged[name].append((primers, offset))
+    return {name: (outfiles[name], merge_primers(merged[name],
+                                                 outfiles[name]))
+            for name in merged}
+
+
+def design_primers(seq, global_args):
+    """Return list of Primer3.Primers designed to the passed sequence
+
+    - seq           sequence string
+    - global_args   primer3 global settings (see build_global_args())
+
+    Primer positions use ePrimer3 conventions: 1-based, with the start of the
+    reverse primer given as its leftmost position on the forward strand.
+    Tm and %GC are rounded to two decimal places, as in ePrimer3 output.
+    """
+    result = primer3.design_primers({'SEQUENCE_ID': 'template',
+                                     'SEQUENCE_TEMPLATE': seq}, global_args)
+    primers = []
+    for idx in range(result.get('PRIMER_PAIR_NUM_RETURNED', 0)):
+        primer = Primer3.Primers()
+        primer.size = result['PRIMER_PAIR_%d_PRODUCT_SIZE' % idx]
+        for oligo, tag in (('forward', 'LEFT'), ('reverse', 'RIGHT'),
+                           ('internal', 'INTERNAL')):
+            tag = 'PRIMER_%s_%d' % (tag, idx)
+            if tag not in result:
+                continue
+            start, length = result[tag]
+            if oligo == 'reverse':  # primer3 gives the 5' (rightmost) base
+                start = start - length + 1
+            setattr(primer, oligo + '_start', start + 1)
+            setattr(primer, oligo + '_length', length)
+            setattr(primer, oligo + '_tm', round(result[tag + '_TM'], 2))
+            setattr(primer, oligo + '_gc',
+                    round(result[tag + '_GC_PERCENT'], 2))
+            setattr(primer, oligo + '_seq', result[tag + '_SEQUENCE'])
+        primers.append(primer)
+    return primers
+
+
+def _design_window(job):
+    """Design primers to a single sequence window, for a worker process.
+
+    - job       tuple of (window sequence, primer3 global settings)
+    """
+    return design_primers(*job)
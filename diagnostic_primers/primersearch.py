@@ -43,68 +43,259 @@
 # THE SOFTWARE.
 
 import json
+import mmap
+import multiprocessing
 import os
 import re
 
+import numpy as np
+
+from Bio import SeqIO
 from Bio.Emboss.Applications import PrimerSearchCommandline
 
-from .eprimer3 import load_primers, write_primers
+from .eprimer3 import PrimerTable, load_primer_table, write_primers
+
+
+# Lookup table converting ASCII nucleotide symbols to 2-bit codes. Any
+# non-ACGT symbol (including N) is coded as 4, and never matches a primer.
+NT_CODES = np.full(256, 4, dtype=np.uint8)
+for _idx, _nt in enumerate('ACGT'):
+    NT_CODES[ord(_nt)] = _idx
+    NT_CODES[ord(_nt.lower())] = _idx
+
+# Default seed length for the native search k-mer index
+SEEDLEN = 12
+
+# Complement table for reverse-complementing primer sequences
+COMPLEMENT = str.maketrans('ACGTacgt', 'TGCAtgca')
+
+# Regular expression matching either a primer name line, or a complete
+# amplimer block of PrimerSearch output (sequence name, description line,
+# forward and reverse strand hits, amplimer length). Both alternatives
+# begin with a literal, so the expression can be applied quickly to a
+# whole (memory-mapped) file by parse_results()
+PS_BLOCK = re.compile(rb"Primer name ([^\n]*)|"
+                      rb"Sequence: ([^\n]*)\n[^\n]*\n"
+                      rb"\t([^\t\n ]+) hits forward strand at (\d+)[^\n]*\n"
+                      rb"\t([^\t\n ]+) hits reverse strand at \[(\d+)\][^\n]*\n"
+                      rb"\tAmplimer length: (\d+)")
+
+# Regular expression splitting PrimerSearch output into per-primer blocks
+PS_NAME = re.compile(rb"(?:\A|\n)Primer name ([^\n]*)\n")
+
+# Prefix for names and files describing primer sets that are searched once
+# on behalf of all inputs that share them
+UNIQUE_PREFIX = 'pdp_unique'
 
 
 def build_commands(collection, primersearch_exe, primersearch_dir,
-                   mismatchpercent):
+                   mismatchpercent, dedup=False):
     """Build and return a list of command-lines to run primersearch.
 
     collection          - PDPCollection describing analysis inputs
     primersearch_exe    - path to primersearch executable
     primersearch_dir    - path to primersearch output
     mismatchpercent     - allowed 'wobble' for primers
+    dedup               - if True, search each unique primer set once per
+                          target (see dedup_searches()); the per-query
+                          output files must then be written with
+                          fan_out_results() once the commands have run
     """
     clines = []    # holds command lines
 
     # Make sure output directory exists
     os.makedirs(primersearch_dir, exist_ok=True)
 
+    if dedup:
+        for _, primerpath, seqfile, outstem in dedup_searches(
+                collection, primersearch_dir):
+            clines.append(build_command(primersearch_exe, primerpath,
+                                        seqfile, outstem, mismatchpercent))
+        return clines
+
     # Build command-lines for each input primer set
     # We generate a collection of target sequences from each PDPData
-    # object, then loop over all PDPData objects, and build a command
-    # line comparing that object's predicted primers to all other
+    # object, then loop over all PDPData objects, and build command
+    # lines comparing that object's predicted primers to all other
     # target sequences.
+    targets = {dat.name: dat.seqfile for dat in collection.data}
+    for dat in collection.data:
+        clines.extend(build_query_commands(dat, targets, primersearch_exe,
+                                           primersearch_dir,
+                                           mismatchpercent).values())
+    return clines
+
+
+def build_query_commands(dat, targets, primersearch_exe, primersearch_dir,
+                         mismatchpercent):
+    """Build and return primersearch command-lines for one query's primers.
+
+    dat                 - PDPData object whose primers are searched
+    targets             - dictionary of target sequence file paths, keyed
+                          by target name
+    primersearch_exe    - path to primersearch executable
+    primersearch_dir    - path to primersearch output
+    mismatchpercent     - allowed 'wobble' for primers
+
+    The primers are written to the output directory, with a JSON file
+    naming the output file for each target, which is added to the PDPData
+    object. Returns a dictionary of command-lines, keyed by the name of
+    each target other than the query itself.
+    """
     # Primersearch - bafflingly - doesn't accept EMBOSS' ePrimer3
     # format, so we need to write primers out as 3-column TSV
-    targets = {dat.name: dat.seqfile for dat in collection.data}
+    os.makedirs(primersearch_dir, exist_ok=True)
+    primerpath = os.path.join(primersearch_dir,
+                              '{}_primers.primertab'.format(dat.name))
+    primers = load_primer_table(dat.primers)
+    write_primers(primers, primerpath, 'tsv')
+    # Create a dictionary to hold target names, to be written
+    # to a JSON file, and the path added to the PDPData object
+    psdict = {'query': dat.name,
+              'primers': primerpath}
+    clines = {}
+    for tgtname, tgtpath in targets.items():
+        if dat.name != tgtname:
+            # Name for output file is built from the PDPData
+            # query/target object names
+            outstem = os.path.join(primersearch_dir,
+                                   '{}_ps_{}.primersearch'.format(dat.name,
+                                                                  tgtname))
+            # Add the output file to the PDPData primersearch attr
+            psdict[tgtname] = outstem
+            # Generate the primersearch cmd-line
+            clines[tgtname] = build_command(primersearch_exe, primerpath,
+                                            tgtpath, outstem,
+                                            mismatchpercent)
+    # Write primersearch output JSON file and add to PDPData object
+    psjson = os.path.join(primersearch_dir,
+                          '{}_primersearch.json'.format(dat.name))
+    with open(psjson, 'w') as ofh:
+        json.dump(psdict, ofh, sort_keys=True)
+    dat.primersearch = psjson
+    return clines
+
+
+def dedup_searches(collection, primersearch_dir):
+    """Write primer files for deduplicated searches, and return the searches.
+
+    collection          - PDPCollection describing analysis inputs
+    primersearch_dir    - path to primersearch output
+
+    Closely-related inputs often share primer sets. Primer sets are
+    identified by their (forward, reverse, internal) sequences, and each
+    unique primer set is given a single name. For each target, one primer
+    file is written, holding the unique primer sets from all other inputs,
+    so each primer set is searched against each target only once.
+
+    The per-query primersearch JSON files are written, and added to the
+    PDPData objects, as for build_commands(), but the output files they
+    refer to are not written until fan_out_results() is called. The
+    membership of each query's primer sets is written to
+    pdp_unique_primersearch.json in the output directory.
+
+    Returns a list of (unique PrimerTable, primer file, target sequence
+    file, output file) tuples, one per target.
+    """
+    os.makedirs(primersearch_dir, exist_ok=True)
+
+    # Assign a name to each unique primer set, and record the queries that
+    # share it
+    keys, members, owners = {}, {}, []
+    queries = {}
+    for dat in collection.data:
+        primers = load_primer_table(dat.primers).sorted()
+        queries[dat.name] = primers
+        members[dat.name] = []
+        for row, (name, key) in enumerate(zip(
+                primers.names, zip(*[primers.array(_) for _ in
+                                     ('forward_seq', 'reverse_seq',
+                                      'internal_seq')]))):
+            if key not in keys:
+                keys[key] = len(owners)
+                owners.append((primers, row, set()))
+            owners[keys[key]][2].add(dat.name)
+            members[dat.name].append(
+                (name, '%s_primer_%06d' % (UNIQUE_PREFIX, keys[key] + 1)))
+    uniquenames = ['%s_primer_%06d' % (UNIQUE_PREFIX, _ + 1)
+                   for _ in range(len(owners))]
+
+    # Write each query's primers and JSON file, as for build_commands()
+    searches, outfiles = [], {}
     for dat in collection.data:
-        # Get the primers from the JSON file and write them
-        # to the output directory
         primerpath = os.path.join(primersearch_dir,
                                   '{}_primers.primertab'.format(dat.name))
-        primers = load_primers(dat.primers, 'json')
-        write_primers(primers, primerpath, 'tsv')
-        # Create a dictionary to hold target names, to be written
-        # to a JSON file, and the path added to the PDPData object
-        psdict = {'query': dat.name,
-                  'primers': primerpath}
-        for tgtname, tgtpath in targets.items():
-            if dat.name != tgtname:
-                # Name for output file is built from the PDPData
-                # query/target object names
-                outstem = os.path.join(primersearch_dir,
-                                       '{}_ps_{}.primersearch'.format(dat.name,
-                                                                      tgtname))
-                # Add the output file to the PDPData primersearch attr
-                psdict[tgtname] = outstem
-                # Generate the primersearch cmd-line
-                cline = build_command(primersearch_exe, primerpath,
-                                      tgtpath, outstem,
-                                      mismatchpercent)
-                clines.append(cline)
-        # Write primersearch output JSON file and add to PDPData object
+        write_primers(queries[dat.name], primerpath, 'tsv')
+        psdict = {'query': dat.name, 'primers': primerpath}
+        for tgt in collection.data:
+            if dat.name != tgt.name:
+                psdict[tgt.name] = os.path.join(
+                    primersearch_dir,
+                    '{}_ps_{}.primersearch'.format(dat.name, tgt.name))
         psjson = os.path.join(primersearch_dir,
                               '{}_primersearch.json'.format(dat.name))
         with open(psjson, 'w') as ofh:
             json.dump(psdict, ofh, sort_keys=True)
         dat.primersearch = psjson
-    return clines
+
+    # Write the unique primer sets needed by each target: those belonging
+    # to any other input
+    for tgt in collection.data:
+        rows = [idx for idx, (_, _, names) in enumerate(owners)
+                if names - {tgt.name}]
+        primers = PrimerTable.from_dicts(
+            [dict(owners[_][0][owners[_][1]].to_dict(),
+                  name=uniquenames[_]) for _ in rows])
+        primerpath = os.path.join(primersearch_dir,
+                                  '{}_primers_{}.primertab'.format(
+                                      UNIQUE_PREFIX, tgt.name))
+        write_primers(primers, primerpath, 'tsv')
+        outfiles[tgt.name] = os.path.join(
+            primersearch_dir,
+            '{}_ps_{}.primersearch'.format(UNIQUE_PREFIX, tgt.name))
+        searches.append((primers, primerpath, tgt.seqfile,
+                         outfiles[tgt.name]))
+
+    with open(os.path.join(primersearch_dir, '{}_primersearch.json'.format(
+            UNIQUE_PREFIX)), 'w') as ofh:
+        json.dump({'members': members, 'searches': outfiles}, ofh,
+                  sort_keys=True)
+    return searches
+
+
+def fan_out_results(primersearch_dir):
+    """Write per-query primersearch output from deduplicated searches.
+
+    primersearch_dir    - path to primersearch output from dedup_searches()
+
+    Each unique primer set's block of output from the search against a
+    target is copied, under the query's own primer name, to the output file
+    for each query that shares it. The files written are the same as if
+    each query had been searched against each target separately. Primer sets
+    with no block in the search output are written with an empty record.
+
+    Returns the list of primersearch output files written.
+    """
+    with open(os.path.join(primersearch_dir, '{}_primersearch.json'.format(
+            UNIQUE_PREFIX)), 'r') as ifh:
+        plan = json.load(ifh)
+    outfiles = []
+    for tgtname, infname in sorted(plan['searches'].items()):
+        with open(infname, 'rb') as ifh:
+            fields = PS_NAME.split(ifh.read())
+        blocks = dict(zip(fields[1::2], fields[2::2]))
+        for query, members in sorted(plan['members'].items()):
+            if query == tgtname:
+                continue
+            outfname = os.path.join(primersearch_dir,
+                                    '{}_ps_{}.primersearch'.format(
+                                        query, tgtname))
+            with open(outfname, 'wb') as ofh:
+                for name, uniquename in members:
+                    ofh.write(b"\nPrimer name " + name.encode() + b"\n" +
+                              blocks.get(uniquename.encode(), b""))
+            outfiles.append(outfname)
+    return outfiles
 
 
 def build_command(primersearch_exe, primerfile, seqfile, filestem,
@@ -122,7 +313,7 @@ def build_command(primersearch_exe, primerfile, seqfile, filestem,
     mismatchpercent       - allowed 'wobble' for primers
     """
     # Build command-line with defaults
-    cline = PrimerSearchCommandline()
+    cline = PrimerSearchCommandline(cmd=primersearch_exe)
     cline.auto = True
     cline.seqall = seqfile
     cline.infile = primerfile
@@ -239,3 +430,459 @@ def parse_output(filename):
                     re.search("(?<=at \[)[0-9]*", line).group())
                 amplimer.reverse_seq = line.strip().split()[0]
     return records
+
+
+class PrimerSearchResult(object):
+
+    """Primer name-indexed contents of a single PrimerSearch output file
+
+    Amplimer data is held column-wise in arrays, with the amplimers of
+    each primer in a contiguous block:
+
+    - start         1-based position of the forward strand hit
+    - revstart      position of the reverse strand hit, counted from the
+                    end of the target sequence
+    - length        amplimer length
+    - sequence      index into the sequences list of the target sequence
+
+    The primer sequences reported for each hit are held as arrays of
+    bytestrings. Indexing the result with a primer name returns a
+    PrimerSearchRecord, built on request, so only the records that are
+    used are created.
+    """
+
+    def __init__(self, names, offsets, start, revstart, length, sequence,
+                 sequences, forward_seqs, reverse_seqs):
+        self._names = list(names)
+        self._index = {name: idx for idx, name in enumerate(self._names)}
+        self._offsets = offsets
+        self.start = start
+        self.revstart = revstart
+        self.length = length
+        self.sequence = sequence
+        self.sequences = sequences
+        self._forward_seqs = forward_seqs
+        self._reverse_seqs = reverse_seqs
+
+    @property
+    def names(self):
+        """Names of all primers in the output, in file order"""
+        return self._names[:]
+
+    def amplimer_slice(self, name):
+        """Returns the slice of the amplimer arrays for the named primer"""
+        idx = self._index[name]
+        return slice(self._offsets[idx], self._offsets[idx + 1])
+
+    def lengths(self, name):
+        """Returns array of amplimer lengths for the named primer"""
+        return self.length[self.amplimer_slice(name)]
+
+    def amplified(self, min_length=None, max_length=None):
+        """Returns names of primers with at least one amplimer
+
+        - min_length    if given, amplimers must be longer than this
+        - max_length    if given, amplimers must be shorter than this
+        """
+        keep = np.ones(len(self.length), dtype=bool)
+        if min_length is not None:
+            keep &= self.length > min_length
+        if max_length is not None:
+            keep &= self.length < max_length
+        owners = np.repeat(np.arange(len(self._names)),
+                           np.diff(self._offsets))
+        return [self._names[_] for _ in np.unique(owners[keep])]
+
+    def __getitem__(self, name):
+        record = PrimerSearchRecord(name)
+        block = self.amplimer_slice(name)
+        for num, idx in enumerate(range(block.start, block.stop), 1):
+            amplimer = PrimerSearchAmplimer("Amplimer %d" % num)
+            amplimer.sequence = self.sequences[self.sequence[idx]]
+            amplimer.length = int(self.length[idx])
+            amplimer.start = int(self.start[idx])
+            amplimer.revstart = int(self.revstart[idx])
+            amplimer.forward_seq = self._forward_seqs[idx].decode()
+            amplimer.reverse_seq = self._reverse_seqs[idx].decode()
+            record.add_amplimer(amplimer)
+        return record
+
+    def __contains__(self, name):
+        return name in self._index
+
+    def __iter__(self):
+        return iter(self._names)
+
+    def __len__(self):
+        return len(self._names)
+
+
+def parse_results(filename):
+    """Return a PrimerSearchResult describing a PrimerSearch output file
+
+    The file is memory-mapped, and scanned once with a single regular
+    expression that matches either a primer name, or a whole amplimer
+    block, so there is no per-line Python processing. The matched fields
+    are converted to arrays column-wise, and each amplimer is assigned to
+    the most recent primer name preceding it in the file.
+
+    Unlike parse_output(), each primer appears once, including primers
+    with no amplimers.
+    """
+    with open(filename, 'rb') as ifh:
+        if os.fstat(ifh.fileno()).st_size == 0:
+            matches = []
+        else:
+            with mmap.mmap(ifh.fileno(), 0,
+                           access=mmap.ACCESS_READ) as buf:
+                matches = PS_BLOCK.findall(buf)
+    columns = [np.array(_, dtype=bytes) for _ in zip(*matches)] or \
+        [np.zeros(0, dtype=bytes)] * 7
+
+    # Rows with a primer name mark the start of each primer's amplimers
+    isprimer = columns[0] != b''
+    names = [_.decode().strip() for _ in columns[0][isprimer]]
+    counts = np.bincount(np.cumsum(isprimer)[~isprimer] - 1,
+                         minlength=len(names))
+    offsets = np.zeros(len(names) + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+
+    # Target sequence names are held once each, referred to by index
+    amplimers = [_[~isprimer] for _ in columns[1:]]
+    sequences, seqidx = np.unique(amplimers[0], return_inverse=True)
+    return PrimerSearchResult(
+        names, offsets,
+        amplimers[2].astype(np.int64), amplimers[4].astype(np.int64),
+        amplimers[5].astype(np.int64), seqidx.astype(np.int64),
+        [_.decode().strip() for _ in sequences],
+        amplimers[1], amplimers[3])
+
+
+def reverse_complement(seq):
+    """Return the reverse complement of the passed nucleotide string."""
+    return seq.translate(COMPLEMENT)[::-1]
+
+
+def kmer_codes(seq, seedlen):
+    """Return the k-mer code, and number of valid symbols, at each position
+
+    - seq       array of nucleotide codes (see NT_CODES)
+    - seedlen   k-mer length (at most 16)
+
+    Each k-mer code packs the 2-bit codes of the seedlen symbols starting
+    at that position. The sequence is padded with invalid symbols so every
+    position starts a full-length window. The number of valid (ACGT)
+    symbols at the start of each window is also returned, so that seeds
+    need never match across N runs (e.g. the spacers in stitched sequences).
+    """
+    seqlen = len(seq)
+    padded = np.concatenate((seq, np.full(seedlen, 4, dtype=np.uint8)))
+    bits = np.where(padded == 4, 0, padded).astype(np.uint32)
+    codes = np.zeros(seqlen, dtype=np.uint32)
+    for offset in range(seedlen):
+        codes = (codes << 2) | bits[offset:offset + seqlen]
+    invalid = np.flatnonzero(padded == 4)
+    positions = np.arange(seqlen)
+    nextinvalid = invalid[np.searchsorted(invalid, positions)]
+    prefix = np.minimum(nextinvalid - positions, seedlen).astype(np.uint8)
+    return codes, prefix
+
+
+class PrimerSearchIndex(object):
+
+    """Seed index of a single target sequence for in-process primer search
+
+    The target sequence is held as an array of 2-bit nucleotide codes, and
+    every position is indexed by the integer code of the k-mer that starts
+    there. The k-mer codes are sorted, so all occurrences of any seed of
+    length <= k can be found with a binary search over the code range that
+    shares the seed as a prefix.
+
+    Windows containing non-ACGT symbols are retained, but we record the
+    number of valid bases at the start of each window, so that seeds never
+    match across N runs (e.g. the spacers in stitched sequences).
+    """
+
+    def __init__(self, seqrecord, seedlen=SEEDLEN):
+        """Build the index for the passed Biopython SeqRecord.
+
+        - seqrecord     target sequence
+        - seedlen       length of k-mer used for the index
+        """
+        self._id = seqrecord.id
+        # Biopython includes the identifier in the description, EMBOSS not
+        self._description = seqrecord.description
+        if self._description.startswith(self._id):
+            self._description = self._description[len(self._id):].strip()
+        self._seedlen = int(seedlen)
+        seqbytes = str(seqrecord.seq).encode('ascii')
+        self._seq = NT_CODES[np.frombuffer(seqbytes, dtype=np.uint8)]
+        self.__build_index()
+
+    def __build_index(self):
+        """Populate the sorted k-mer code and position arrays."""
+        codes, prefix = kmer_codes(self._seq, self._seedlen)
+        keep = np.flatnonzero(prefix)
+        order = np.argsort(codes[keep], kind='stable')
+        self._codes = codes[keep][order]
+        self._positions = keep[order]
+        self._prefix = prefix[keep][order]
+
+    def seed_hits(self, seed):
+        """Return sorted positions at which the passed seed occurs exactly.
+
+        - seed      nucleotide string, no longer than the index seed length
+        """
+        size = len(seed)
+        if not 0 < size <= self._seedlen:
+            raise ValueError("Seed length must be in range 1-%d, got %d" %
+                             (self._seedlen, size))
+        seedcodes = NT_CODES[np.frombuffer(seed.encode('ascii'),
+                                           dtype=np.uint8)]
+        if (seedcodes == 4).any():
+            return np.array([], dtype=np.int64)
+        code = 0
+        for val in seedcodes:
+            code = (code << 2) | int(val)
+        shift = 2 * (self._seedlen - size)
+        # Search values must share the index dtype, or numpy will convert
+        # the whole index on every call
+        bounds = np.array([code << shift, (code + 1) << shift],
+                          dtype=self._codes.dtype)
+        lower, upper = np.searchsorted(self._codes, bounds)
+        hits = self._positions[lower:upper][self._prefix[lower:upper] >= size]
+        return np.sort(hits)
+
+    def find(self, oligo, mismatches=0):
+        """Return (position, mismatches) for forward-strand matches to oligo.
+
+        - oligo         nucleotide string to search for
+        - mismatches    maximum number of mismatches allowed
+
+        Positions are zero-based offsets into the target sequence. Candidate
+        positions are generated from exact matches to mismatches + 1
+        non-overlapping seeds of the oligo (at least one must match exactly,
+        by the pigeonhole principle), then each candidate is verified by
+        counting mismatches over the whole oligo.
+        """
+        size = len(oligo)
+        nseeds = min(mismatches + 1, size)
+        seedsize = size // nseeds
+        candidates = []
+        for seedidx in range(nseeds):
+            offset = seedidx * seedsize
+            seed = oligo[offset:offset + min(seedsize, self._seedlen)]
+            candidates.append(self.seed_hits(seed) - offset)
+        candidates = np.unique(np.concatenate(candidates))
+        candidates = candidates[(candidates >= 0) &
+                                (candidates <= len(self._seq) - size)]
+        if not len(candidates):
+            return []
+        # Primer non-ACGT symbols are coded so they match nothing
+        oligocodes = NT_CODES[np.frombuffer(oligo.encode('ascii'),
+                                            dtype=np.uint8)].astype(np.int16)
+        oligocodes[oligocodes == 4] = 5
+        windows = self._seq[candidates[:, None] + np.arange(size)]
+        counts = (windows != oligocodes).sum(axis=1)
+        passed = counts <= mismatches
+        return list(zip(candidates[passed].tolist(), counts[passed].tolist()))
+
+    @property
+    def id(self):
+        """Identifier of the indexed sequence."""
+        return self._id
+
+    @property
+    def description(self):
+        """Description of the indexed sequence."""
+        return self._description
+
+    def __len__(self):
+        """Return length of the indexed sequence."""
+        return len(self._seq)
+
+
+def allowed_mismatches(oligo, mismatchpercent):
+    """Return number of mismatches permitted for the oligo by primersearch.
+
+    - oligo             primer sequence
+    - mismatchpercent   allowed 'wobble' for primers, as an integer percentage
+
+    EMBOSS primersearch truncates the product of primer length and mismatch
+    percentage to an integer number of mismatches, and we do the same.
+    """
+    return int(len(oligo) * mismatchpercent) // 100
+
+
+def search_target(primers, indexes, mismatchpercent):
+    """Return PrimerSearchRecords for the passed primers against one target.
+
+    - primers           iterable of Primer3.Primers or PrimerRecord objects
+    - indexes           PrimerSearchIndex objects, one for each sequence in
+                        the target
+    - mismatchpercent   allowed 'wobble' for primers, as an integer percentage
+
+    As with EMBOSS primersearch, an amplimer is reported wherever one primer
+    of the pair matches the forward strand and the other primer matches the
+    reverse strand downstream of it. The primer that matches the forward
+    strand is reported as the amplimer's forward_seq, so this may be the
+    primer set's reverse primer. One record is returned per primer set, in
+    the order passed, whether or not there are any amplimers.
+    """
+    records = []
+    for primer in primers:
+        record = PrimerSearchRecord(primer.name)
+        for index in indexes:
+            for amplimer in _find_amplimers(primer, index, mismatchpercent,
+                                            len(record.amplimers) + 1):
+                record.add_amplimer(amplimer)
+        records.append(record)
+    return records
+
+
+def _find_amplimers(primer, index, mismatchpercent, first=1):
+    """Return PrimerSearchAmplimers for a primer set on an indexed sequence.
+
+    Amplimers are numbered consecutively, starting from first.
+    """
+    hits = {}
+    for oligo in (primer.forward_seq, primer.reverse_seq):
+        maxmis = allowed_mismatches(oligo, mismatchpercent)
+        hits[(oligo, '+')] = index.find(oligo, maxmis)
+        hits[(oligo, '-')] = index.find(reverse_complement(oligo), maxmis)
+    amplimers = []
+    for fwd, rev in ((primer.forward_seq, primer.reverse_seq),
+                     (primer.reverse_seq, primer.forward_seq)):
+        for fstart, fmis in hits[(fwd, '+')]:
+            for rstart, rmis in hits[(rev, '-')]:
+                rend = rstart + len(rev)
+                if rstart < fstart or rend < fstart + len(fwd):
+                    continue
+                amplimer = PrimerSearchAmplimer(
+                    "Amplimer %d" % (first + len(amplimers)))
+                amplimer.sequence = index.id
+                amplimer.description = index.description
+                amplimer.length = rend - fstart
+                amplimer.start = fstart + 1
+                amplimer.revstart = len(index) - rend + 1
+                amplimer.forward_seq = fwd
+                amplimer.reverse_seq = rev
+                amplimer.forward_mismatches = fmis
+                amplimer.reverse_mismatches = rmis
+                amplimers.append(amplimer)
+    return amplimers
+
+
+def write_output(records, filename):
+    """Write PrimerSearchRecords to file in EMBOSS primersearch format.
+
+    - records       iterable of PrimerSearchRecord objects
+    - filename      path to output file
+
+    The output can be read with parse_output().
+    """
+    with open(filename, 'w') as ofh:
+        for record in records:
+            ofh.write("\nPrimer name %s\n" % record.name)
+            for amplimer in record.amplimers:
+                ofh.write("%s\n" % amplimer.name)
+                ofh.write("\tSequence: %s  \n" % amplimer.sequence)
+                ofh.write("\t%s\n" % getattr(amplimer, 'description', ''))
+                ofh.write("\t%s hits forward strand at %d with %d mismatches\n" %
+                          (amplimer.forward_seq, amplimer.start,
+                           getattr(amplimer, 'forward_mismatches', 0)))
+                ofh.write("\t%s hits reverse strand at [%d] with %d mismatches\n" %
+                          (amplimer.reverse_seq, amplimer.revstart,
+                           getattr(amplimer, 'reverse_mismatches', 0)))
+                ofh.write("\tAmplimer length: %d bp\n" % len(amplimer))
+
+
+def search_collection(collection, primersearch_dir, mismatchpercent,
+                      workers=None, dedup=False):
+    """Run the native primer search engine over the passed PDPCollection.
+
+    collection          - PDPCollection describing analysis inputs
+    primersearch_dir    - path to primersearch output
+    mismatchpercent     - allowed 'wobble' for primers, as integer percentage
+    workers             - number of worker processes (None uses all cores)
+    dedup               - if True, search each unique primer set once per
+                          target, and write the per-query output files
+                          from the results (see dedup_searches())
+
+    This is an in-process alternative to running the command-lines from
+    build_commands(). Each target sequence is read and indexed once, and the
+    primers from every other input are searched against it, so there is one
+    job per target rather than one process per (query, target) pair. The
+    output files and per-query JSON files have the same names and formats
+    as those produced by the EMBOSS route, and the path to each JSON file is
+    added to the corresponding PDPData object.
+
+    Returns the list of primersearch output files written.
+    """
+    os.makedirs(primersearch_dir, exist_ok=True)
+
+    if dedup:
+        jobs = [(seqfile, [(primers, outfile)], mismatchpercent)
+                for primers, _, seqfile, outfile in
+                dedup_searches(collection, primersearch_dir)]
+        pool = multiprocessing.Pool(processes=workers)
+        pool.map(_search_target_job, jobs)
+        pool.close()
+        pool.join()
+        return fan_out_results(primersearch_dir)
+
+    # Load each input's primers once, and define the output paths
+    queries = {}
+    psdicts = {}
+    for dat in collection.data:
+        primerpath = os.path.join(primersearch_dir,
+                                  '{}_primers.primertab'.format(dat.name))
+        queries[dat.name] = load_primer_table(dat.primers)
+        write_primers(queries[dat.name], primerpath, 'tsv')
+        psdicts[dat.name] = {'query': dat.name, 'primers': primerpath}
+
+    # One job per target: the target sequence, and all other primer sets
+    jobs = []
+    for tgt in collection.data:
+        searches = []
+        for dat in collection.data:
+            if dat.name != tgt.name:
+                outstem = os.path.join(primersearch_dir,
+                                       '{}_ps_{}.primersearch'.format(
+                                           dat.name, tgt.name))
+                psdicts[dat.name][tgt.name] = outstem
+                searches.append((queries[dat.name], outstem))
+        jobs.append((tgt.seqfile, searches, mismatchpercent))
+
+    pool = multiprocessing.Pool(processes=workers)
+    outfiles = [fname for result in pool.map(_search_target_job, jobs)
+                for fname in result]
+    pool.close()
+    pool.join()
+
+    # Write primersearch output JSON files and add to PDPData objects
+    for dat in collection.data:
+        psjson = os.path.join(primersearch_dir,
+                              '{}_primersearch.json'.format(dat.name))
+        with open(psjson, 'w') as ofh:
+            json.dump(psdicts[dat.name], ofh, sort_keys=True)
+        dat.primersearch = psjson
+    return outfiles
+
+
+def _search_target_job(job):
+    """Index a single target and search primer sets against it.
+
+    - job       tuple of (target sequence path, [(primers, outfile), ...],
+                mismatchpercent)
+
+    Returns the list of output files written.
+    """
+    seqfile, searches, mismatchpercent = job
+    indexes = [PrimerSearchIndex(_) for _ in SeqIO.parse(seqfile, 'fasta')]
+    outfiles = []
+    for primers, outfile in searches:
+        write_output(search_target(primers, indexes, mismatchpercent),
+                     outfile)
+        outfiles.append(outfile)
+    return outfiles
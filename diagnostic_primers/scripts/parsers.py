@@ -10,6 +10,7 @@ Provides functions to generate subcommand parsers for the pdp.py script
 - primersearch:  run in-silico hybridisation with EMBOSS PrimerSearch
 - blastscreen:   screen primers with BLASTN
 - classify:      classify primers
+- run:           run the pipeline as a dependency graph of tasks per input
 
 (c) The James Hutton Institute 2017
 
@@ -52,6 +53,8 @@ import sys
 
 from argparse import ArgumentParser
 
+from diagnostic_primers.cache import SCREEN_CACHE_SIZE
+
 from . import subcommands
 
 
@@ -103,268 +106,199 @@ def build_scheduler_parser():
         default=None,
         type=int,
         help='Number of parallel workers to use')
-    return parser_scheduler
-
-
-# Build subcommand parsers
-# Each subcommand gets its own parser, and the entry point to the subcommand
-# is defined with parser.set_defaults().
-# See https://docs.python.org/3.6/library/argparse.html#sub-commands
-def build_parser_config(subparsers, parents=None):
-    """Add parser for `config` subcommand to subparsers
-
-    This parser implements options for processing configuration files.
-    """
-    parser = subparsers.add_parser('config', parents=parents)
-    parser.add_argument(
-        '--validate',
-        action='store_true',
-        dest='validate',
-        default=False,
-        help='Validate config file, then exit')
-    parser.add_argument(
-        '--fix_sequences',
-        action='store',
-        dest='fix_sequences',
-        default=None,
-        help='Fix config file sequences and write new JSON ' + 'config file')
-    parser.add_argument(
-        '--to_json',
-        action='store',
-        dest='to_json',
-        default=None,
-        help='Convert .tab config file to JSON and write')
-    parser.add_argument(
-        '--to_tab',
+    parser_scheduler.add_argument(
+        '--timeout',
+        dest='timeout',
         action='store',
-        dest='to_tab',
         default=None,
-        help='Convert JSON config file to .tab and write')
-    parser.set_defaults(func=subcommands.subcmd_config)
-
-
-def build_parser_prodigal(subparsers, parents=None):
-    """Add parser for `prodigal` subcommand to subparsers
-
-    This parser implements options for controlling the prodigal bacterial
-    gene prediction tool.
-    """
-    parser = subparsers.add_parser(
-        'prodigal', aliases=['prod'], parents=parents)
-    parser.add_argument(
-        'outfilename', help='Path to write new configuration file')
-    parser.add_argument(
-        '--prodigal',
-        dest='prodigal_exe',
-        action='store',
-        default='prodigal',
-        help='path to Prodigal executable')
-    parser.add_argument(
-        '--outdir',
-        dest='prodigaldir',
-        action='store',
-        default='prodigal',
-        help='path to directory for Prodigal output')
-    parser.add_argument(
-        '-f',
-        '--force',
-        dest='prodigalforce',
+        type=float,
+        help='Kill jobs running longer than this many seconds ' +
+        '(multiprocessing only)')
+    parser_scheduler.add_argument(
+        '--failfast',
+        dest='failfast',
         action='store_true',
         default=False,
-        help='Allow overwrite in Prodigal output directory')
-    parser.set_defaults(func=subcommands.subcmd_prodigal)
+        help='Stop all jobs as soon as one fails (multiprocessing only)')
+    parser_scheduler.add_argument(
+        '--cache',
+        dest='cachedir',
+        action='store',
+        default=None,
+        help='Reuse output of unchanged jobs from, and store new output ' +
+        'in, this cache directory')
+    return parser_scheduler
 
 
-def build_parser_eprimer3(subparsers, parents=None):
-    """Add parser for `eprimer3` subcommand to subparsers
+# Build parser for primer design options, shared by the eprimer3 and run
+# subcommands
+def build_primer3_parser():
+    """Returns the primer design argument parser for the script.
 
-    This parser implements options for controlling primer creation with the
-    EMBOSS ePrimer3 tool.
+    This parser implements the ePrimer3 primer design options.
     """
-    parser = subparsers.add_parser('eprimer3', aliases=['e3'], parents=parents)
-    # Primer prediction options - subcommand eprimer3
-    parser.add_argument(
-        'outfilename', help='Path to write new configuration file')
-    parser.add_argument(
-        '--eprimer3',
-        dest='eprimer3_exe',
-        action='store',
-        default='eprimer3',
-        help='path to ePrimer3 executable')
-    parser.add_argument(
-        '--outdir',
-        dest='eprimer3_dir',
-        action='store',
-        default='eprimer3',
-        help='path to directory for ePrimer3 output')
-    parser.add_argument(
-        '-f',
-        '--force',
-        dest='eprimer3_force',
-        action='store_true',
-        default=False,
-        help='Overwrite old ePrimer3 output')
-    parser.add_argument(
+    parser_primer3 = ArgumentParser(add_help=False)
+    parser_primer3.add_argument(
         '--numreturn',
         dest='ep_numreturn',
         action='store',
         default=10,
         type=int,
         help='number of primers to return')
-    parser.add_argument(
+    parser_primer3.add_argument(
         '--osize',
         dest='ep_osize',
         action='store',
         default=20,
         type=int,
         help='optimal size for primer oligo')
-    parser.add_argument(
+    parser_primer3.add_argument(
         '--minsize',
         dest='ep_minsize',
         action='store',
         default=18,
         type=int,
         help='minimum size for primer oligo')
-    parser.add_argument(
+    parser_primer3.add_argument(
         '--maxsize',
         dest='ep_maxsize',
         action='store',
         default=22,
         type=int,
         help='maximum size for primer oligo')
-    parser.add_argument(
+    parser_primer3.add_argument(
         '--opttm',
         dest='ep_opttm',
         action='store',
         default=59,
         type=int,
         help='optimal Tm for primer oligo')
-    parser.add_argument(
+    parser_primer3.add_argument(
         '--mintm',
         dest='ep_mintm',
         action='store',
         default=58,
         type=int,
         help='minimum Tm for primer oligo')
-    parser.add_argument(
+    parser_primer3.add_argument(
         '--maxtm',
         dest='ep_maxtm',
         action='store',
         default=60,
         type=int,
         help='maximum Tm for primer oligo')
-    parser.add_argument(
+    parser_primer3.add_argument(
         '--ogcpercent',
         dest='ep_ogcpercent',
         action='store',
         default=55,
         type=int,
         help='optimal %%GC for primer oligo')
-    parser.add_argument(
+    parser_primer3.add_argument(
         '--mingcpercent',
         dest='ep_mingc',
         action='store',
         default=30,
         type=int,
         help='minimum %%GC for primer oligo')
-    parser.add_argument(
+    parser_primer3.add_argument(
         '--maxgcpercent',
         dest='ep_maxgc',
         action='store',
         default=80,
         type=int,
         help='maximum %%GC for primer oligo')
-    parser.add_argument(
+    parser_primer3.add_argument(
         '--psizeopt',
         dest='ep_psizeopt',
         action='store',
         default=100,
         type=int,
         help='optimal size of amplified region')
-    parser.add_argument(
+    parser_primer3.add_argument(
         '--psizemin',
         dest='ep_psizemin',
         action='store',
         default=50,
         type=int,
         help='minimum size of amplified region')
-    parser.add_argument(
+    parser_primer3.add_argument(
         '--psizemax',
         dest='ep_psizemax',
         action='store',
         default=150,
         type=int,
         help='maximum size of amplified region')
-    parser.add_argument(
+    parser_primer3.add_argument(
         '--maxpolyx',
         dest='ep_maxpolyx',
         action='store',
         default=3,
         type=int,
         help='maximum run of repeated nucleotides ' + 'in primer')
-    parser.add_argument(
+    parser_primer3.add_argument(
         '--hybridprobe',
         dest='ep_hybridprobe',
         action='store_true',
         default=False,
         help='design a reporter oligo')
-    parser.add_argument(
+    parser_primer3.add_argument(
         '--oligoosize',
         dest='ep_osizeopt',
         action='store',
         default=20,
         type=int,
         help='optimal size for internal oligo')
-    parser.add_argument(
+    parser_primer3.add_argument(
         '--oligominsize',
         dest='ep_ominsize',
         action='store',
         default=13,
         type=int,
         help='minimum size for internal oligo')
-    parser.add_argument(
+    parser_primer3.add_argument(
         '--oligomaxsize',
         dest='ep_omaxsize',
         action='store',
         default=30,
         type=int,
         help='maximum size for internal oligo')
-    parser.add_argument(
+    parser_primer3.add_argument(
         '--oligootm',
         dest='ep_otmopt',
         action='store',
         default=69,
         type=int,
         help='optimal Tm for internal oligo')
-    parser.add_argument(
+    parser_primer3.add_argument(
         '--oligomintm',
         dest='ep_otmmin',
         action='store',
         default=68,
         type=int,
         help='minimum Tm for internal oligo')
-    parser.add_argument(
+    parser_primer3.add_argument(
         '--oligomaxtm',
         dest='ep_otmmax',
         action='store',
         default=70,
         type=int,
         help='maximum Tm for internal oligo')
-    parser.add_argument(
+    parser_primer3.add_argument(
         '--oligoogcpercent',
         dest='ep_ogcopt',
         action='store',
         default=55,
         type=int,
         help='optimal %%GC for internal oligo')
-    parser.add_argument(
+    parser_primer3.add_argument(
         '--oligomingcpercent',
         dest='ep_ogcmin',
         action='store',
         default=30,
         type=int,
         help='minimum %%GC for internal oligo')
-    parser.add_argument(
+    parser_primer3.add_argument(
         '--oligomaxgcpercent',
         dest='ep_ogcmax',
         action='store',
@@ -373,11 +307,143 @@ def build_parser_eprimer3(subparsers, parents=None):
         help='maximum %%GC for internal oligo')
     # Commented out until Biopython command line code catches up with new
     # EMBOSS options
-    #    parser.add_argument("--oligomaxpolyx", dest="ep_opolymax",
+    #    parser_primer3.add_argument("--oligomaxpolyx",
+    #                                 dest="ep_opolymax",
     #                                 action="store",
     #                                 default=3, type=int,
-    #                                 help="maximum run of repeated nucleotides " +
-    #                                 "in internal primer")
+    #                                 help="maximum run of repeated " +
+    #                                 "nucleotides in internal primer")
+    return parser_primer3
+
+
+# Build subcommand parsers
+# Each subcommand gets its own parser, and the entry point to the subcommand
+# is defined with parser.set_defaults().
+# See https://docs.python.org/3.6/library/argparse.html#sub-commands
+def build_parser_config(subparsers, parents=None):
+    """Add parser for `config` subcommand to subparsers
+
+    This parser implements options for processing configuration files.
+    """
+    parser = subparsers.add_parser('config', parents=parents)
+    parser.add_argument(
+        '--validate',
+        action='store_true',
+        dest='validate',
+        default=False,
+        help='Validate config file, then exit')
+    parser.add_argument(
+        '--fix_sequences',
+        action='store',
+        dest='fix_sequences',
+        default=None,
+        help='Fix config file sequences and write new JSON ' + 'config file')
+    parser.add_argument(
+        '--to_json',
+        action='store',
+        dest='to_json',
+        default=None,
+        help='Convert .tab config file to JSON and write')
+    parser.add_argument(
+        '--to_tab',
+        action='store',
+        dest='to_tab',
+        default=None,
+        help='Convert JSON config file to .tab and write')
+    parser.set_defaults(func=subcommands.subcmd_config)
+
+
+def build_parser_prodigal(subparsers, parents=None):
+    """Add parser for `prodigal` subcommand to subparsers
+
+    This parser implements options for controlling the prodigal bacterial
+    gene prediction tool.
+    """
+    parser = subparsers.add_parser(
+        'prodigal', aliases=['prod'], parents=parents)
+    parser.add_argument(
+        'outfilename', help='Path to write new configuration file')
+    parser.add_argument(
+        '--prodigal',
+        dest='prodigal_exe',
+        action='store',
+        default='prodigal',
+        help='path to Prodigal executable')
+    parser.add_argument(
+        '--outdir',
+        dest='prodigaldir',
+        action='store',
+        default='prodigal',
+        help='path to directory for Prodigal output')
+    parser.add_argument(
+        '-f',
+        '--force',
+        dest='prodigalforce',
+        action='store_true',
+        default=False,
+        help='Allow overwrite in Prodigal output directory')
+    parser.set_defaults(func=subcommands.subcmd_prodigal)
+
+
+def build_parser_eprimer3(subparsers, parents=None):
+    """Add parser for `eprimer3` subcommand to subparsers
+
+    This parser implements options for controlling primer creation with the
+    EMBOSS ePrimer3 tool.
+    """
+    parser = subparsers.add_parser('eprimer3', aliases=['e3'], parents=parents)
+    # Primer prediction options - subcommand eprimer3
+    parser.add_argument(
+        'outfilename', help='Path to write new configuration file')
+    parser.add_argument(
+        '--eprimer3',
+        dest='eprimer3_exe',
+        action='store',
+        default='eprimer3',
+        help='path to ePrimer3 executable')
+    parser.add_argument(
+        '--outdir',
+        dest='eprimer3_dir',
+        action='store',
+        default='eprimer3',
+        help='path to directory for ePrimer3 output')
+    parser.add_argument(
+        '-f',
+        '--force',
+        dest='eprimer3_force',
+        action='store_true',
+        default=False,
+        help='Overwrite old ePrimer3 output')
+    parser.add_argument(
+        '--npz',
+        dest='eprimer3_npz',
+        action='store_true',
+        default=False,
+        help='Also write primers in binary .npz format, and use these ' +
+        'in the new configuration file')
+    parser.add_argument(
+        '--engine',
+        dest='eprimer3_engine',
+        action='store',
+        default='eprimer3',
+        choices=['eprimer3', 'primer3'],
+        help='Design primers with the EMBOSS ePrimer3 executable, or ' +
+        'in-process with the primer3-py library')
+    parser.add_argument(
+        '--window',
+        dest='eprimer3_window',
+        action='store',
+        default=None,
+        type=int,
+        help='Split each sequence into windows of this length, and design ' +
+        'primers to each window in parallel')
+    parser.add_argument(
+        '--window_overlap',
+        dest='eprimer3_overlap',
+        action='store',
+        default=None,
+        type=int,
+        help='Overlap between sequence windows (default: --psizemax)')
     parser.set_defaults(func=subcommands.subcmd_eprimer3)
 
 
@@ -424,6 +490,41 @@ def build_parser_blastscreen(subparsers, parents=None):
         action='store_true',
         default=False,
         help='Overwrite old BLASTN+ output')
+    parser.add_argument(
+        '--batch',
+        dest='bs_batch',
+        action='store',
+        default=None,
+        type=int,
+        help='screen all primers in this many batched BLASTN+ jobs')
+    parser.add_argument(
+        '--engine',
+        dest='bs_engine',
+        action='store',
+        choices=['blastn', 'native'],
+        default='blastn',
+        help='Screen with BLASTN+, or the built-in k-mer index engine')
+    parser.add_argument(
+        '--indexdir',
+        dest='bs_indexdir',
+        action='store',
+        default=None,
+        help='path to directory for built-in engine k-mer index')
+    parser.add_argument(
+        '--seedlen',
+        dest='bs_seedlen',
+        action='store',
+        default=None,
+        type=int,
+        help='built-in engine contiguous seed length (default: spaced ' +
+        'seeds that find every alignment longer than --maxaln)')
+    parser.add_argument(
+        '--cache_size',
+        dest='bs_cachesize',
+        action='store',
+        default=SCREEN_CACHE_SIZE,
+        type=int,
+        help='maximum number of primer oligos held in the screen cache')
     parser.set_defaults(func=subcommands.subcmd_blastscreen)
 
 
@@ -465,6 +566,19 @@ def build_parser_primersearch(subparsers, parents=None):
         type=float,
         default=0.1,
         help='Allowed percentage primer mismatch')
+    parser.add_argument(
+        '--engine',
+        dest='ps_engine',
+        action='store',
+        choices=['emboss', 'native'],
+        default='emboss',
+        help='Search with EMBOSS primersearch, or the built-in engine')
+    parser.add_argument(
+        '--dedup',
+        dest='ps_dedup',
+        action='store_true',
+        default=False,
+        help='Search primer sets shared between inputs only once')
     parser.set_defaults(func=subcommands.subcmd_primersearch)
 
 
@@ -548,6 +662,89 @@ def build_parser_plot(subparsers, parents=None):
     parser.set_defaults(func=subcommands.subcmd_plot)
 
 
+def build_parser_run(subparsers, parents=None):
+    """Add parser for `run` command to subparsers
+
+    This parser controls options for running the prodigal, eprimer3,
+    blastscreen, primersearch, classify and extract stages as a single
+    dependency graph of tasks for each input sequence.
+    """
+    parser = subparsers.add_parser('run', parents=parents)
+    parser.add_argument('outdir', help='Path to directory for output')
+    parser.add_argument(
+        '--restart',
+        dest='run_restart',
+        action='store_true',
+        default=False,
+        help='Ignore tasks completed in earlier runs, and rerun them all')
+    parser.add_argument(
+        '--skip',
+        dest='run_skip',
+        action='append',
+        choices=['prodigal', 'extract'],
+        default=[],
+        help='Do not run this stage (may be given more than once)')
+    parser.add_argument(
+        '--prodigal',
+        dest='prodigal_exe',
+        action='store',
+        default='prodigal',
+        help='path to Prodigal executable')
+    parser.add_argument(
+        '--eprimer3',
+        dest='eprimer3_exe',
+        action='store',
+        default='eprimer3',
+        help='path to ePrimer3 executable')
+    parser.add_argument(
+        '--blastn',
+        dest='bs_exe',
+        action='store',
+        default='blastn',
+        help='path to BLASTN+ executable')
+    parser.add_argument(
+        '--db',
+        dest='bs_db',
+        action='store',
+        default=None,
+        help='path to BLASTN+ database for primer screen (no screen if ' +
+        'not given)')
+    parser.add_argument(
+        '--maxaln',
+        dest='maxaln',
+        action='store',
+        default=15,
+        type=int,
+        help='exclude primers with longer alignment')
+    parser.add_argument(
+        '--primersearch',
+        dest='ps_exe',
+        action='store',
+        default='primersearch',
+        help='path to primersearch executable')
+    parser.add_argument(
+        '--mismatchpercent',
+        '-m',
+        dest='mismatchpercent',
+        action='store',
+        type=float,
+        default=0.1,
+        help='Allowed percentage primer mismatch')
+    parser.add_argument(
+        '--mafft',
+        dest='mafft_exe',
+        action="store",
+        default="mafft",
+        help="Path to MAFFT executable")
+    parser.add_argument(
+        '--noalign',
+        dest='noalign',
+        action="store_true",
+        default=False,
+        help="Suppress amplicon alignment")
+    parser.set_defaults(func=subcommands.subcmd_run)
+
+
 # Process command-line
 def parse_cmdline(args=None):
     """Parse command-line arguments for script.
@@ -562,6 +759,7 @@ def parse_cmdline(args=None):
     primersearch - check/filter designed primers against complete genome
                    negative examples
     classify - classify designed primers against input genome/classes
+    run - run all of the above for each input, as a dependency graph
     """
     # Main parent parser
     parser_main = ArgumentParser(prog='pdp.py')
@@ -573,13 +771,15 @@ def parse_cmdline(args=None):
     # Common parser to be included with all the subcommand parsers
     parser_common = build_common_parser()
     parser_scheduler = build_scheduler_parser()
+    parser_primer3 = build_primer3_parser()
 
     # Add subcommand parsers to the main parser's subparsers
-    build_parser_config(subparsers, parents=[parser_common])
+    build_parser_config(subparsers, parents=[parser_common, parser_scheduler])
     build_parser_prodigal(
         subparsers, parents=[parser_common, parser_scheduler])
     build_parser_eprimer3(
-        subparsers, parents=[parser_common, parser_scheduler])
+        subparsers, parents=[parser_common, parser_scheduler,
+                             parser_primer3])
     build_parser_blastscreen(
         subparsers, parents=[parser_common, parser_scheduler])
     build_parser_primersearch(
@@ -587,6 +787,9 @@ def parse_cmdline(args=None):
     build_parser_classify(subparsers, parents=[parser_common])
     build_parser_extract(subparsers, parents=[parser_common])
     build_parser_plot(subparsers, parents=[parser_common])
+    build_parser_run(
+        subparsers, parents=[parser_common, parser_scheduler,
+                             parser_primer3])
 
     # Parse arguments
     if args is None:
@@ -41,7 +41,12 @@ OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
 THE SOFTWARE.
 """
 
+import multiprocessing
+
+import os
+
 from diagnostic_primers import blast
+from diagnostic_primers.cache import PDPScreenCache
 
 from ..tools import (create_output_directory, load_config_json, log_clines,
                      run_parallel_jobs)
@@ -61,25 +66,170 @@ def subcmd_blastscreen(args, logger):
     # Get config file data
     coll = load_config_json(args, logger)
 
-    # Run BLASTN search with primer sequences
-    logger.info("Building BLASTN screen command-lines...")
-    clines = blast.build_commands(coll, args.bs_exe, args.bs_db, args.bs_dir)
-    pretty_clines = [str(c).replace(' -', ' \\\n          -') for c in clines]
-    log_clines(pretty_clines, logger)
-    run_parallel_jobs(clines, args, logger)
-
-    logger.info("BLASTN+ search complete")
-
-    # Amend primer JSON files to remove screened primers
-    for blastout, indata in zip([cline.out for cline in clines], coll.data):
-        logger.info("Amending primer file %s with results from %s",
-                    indata.primers, blastout)
-        newprimers = blast.apply_screen(blastout, indata.primers, args.maxaln)
-        logger.info("Screened primers placed in %s", newprimers)
-        indata.primers = newprimers
+    if getattr(args, 'cachedir', None):
+        screen_cached(coll, args, logger)
+    elif args.bs_engine == 'native':
+        screen_native(coll, args, logger)
+    else:
+        screen_blastn(coll, args, logger)
 
     # Write new config file post-BLASTN screen
     logger.info('Writing new config file to %s', args.outfilename)
     coll.write_json(args.outfilename)
 
     return 0
+
+
+def screen_cached(coll, args, logger):
+    """Screen primers, searching only oligos not in the screen cache.
+
+    Results for each primer oligo are kept in the screen cache in the
+    --cache directory, keyed by the oligo sequence, the screening database
+    and the screen settings, so oligos screened in earlier runs, or
+    shared between inputs, are not searched again.
+    """
+    screencache = PDPScreenCache(os.path.join(args.cachedir,
+                                              'screen.sqlite'),
+                                 args.bs_cachesize)
+    fingerprint = screencache.fingerprint(
+        args.bs_db, **blast.screen_settings(args.bs_engine,
+                                            native_seeds(args)))
+    oligos = blast.primer_oligos([_.primers for _ in coll.data])
+    alignments = screencache.lookup(oligos, fingerprint)
+    unseen = sorted(oligos - set(alignments))
+    logger.info("%d of %d primer oligos found in screen cache %s",
+                len(alignments), len(oligos), args.cachedir)
+
+    if unseen and args.bs_engine == 'native':
+        logger.info("Screening %d oligos against %s with built-in engine",
+                    len(unseen), args.bs_db)
+        index = blast.ScreenIndex.open(args.bs_db, args.bs_indexdir,
+                                       native_seeds(args))
+        blastouts = [os.path.join(args.bs_dir, 'oligos.blasttab')]
+        blast.write_blasttab(index.search(
+            [(blast.OLIGO_PREFIX % idx, seq) for idx, seq in
+             enumerate(unseen)], logger=logger), blastouts[0])
+    elif unseen:
+        nchunks = args.bs_batch or 1
+        threads = max(1, (args.workers or multiprocessing.cpu_count()) //
+                      nchunks)
+        clines = blast.build_oligo_commands(unseen, args.bs_exe, args.bs_db,
+                                            args.bs_dir, nchunks, threads)
+        pretty_clines = [str(c).replace(' -', ' \\\n          -')
+                         for c in clines]
+        log_clines(pretty_clines, logger)
+        run_parallel_jobs(clines, args, logger)
+        blastouts = [cline.out for cline in clines]
+    if unseen:
+        found = blast.oligo_alignments(blastouts, unseen)
+        screencache.store(found, fingerprint)
+        alignments.update(found)
+    screencache.close()
+
+    # Amend primer JSON files to remove screened primers
+    for indata in coll.data:
+        logger.info("Amending primer file %s with cached screen results",
+                    indata.primers)
+        indata.primers = blast.apply_alignments(indata.primers, alignments,
+                                                args.maxaln)
+        logger.info("Screened primers placed in %s", indata.primers)
+
+
+def native_seeds(args):
+    """Returns the seeds for the built-in screen engine.
+
+    Unless a contiguous seed length is given with --seedlen, these are
+    seeds that are sure to find every alignment longer than --maxaln (see
+    blast.screen_seeds()).
+    """
+    if args.bs_seedlen:
+        return ('1' * args.bs_seedlen,)
+    return blast.screen_seeds(args.maxaln)
+
+
+def screen_native(coll, args, logger):
+    """Screen primers against a FASTA file with the built-in engine."""
+    logger.info("Screening primers against %s with built-in engine...",
+                args.bs_db)
+    if args.scheduler != 'multiprocessing':
+        logger.warning("Built-in engine runs locally, ignoring " +
+                       "scheduler %s", args.scheduler)
+    blastouts = blast.screen_collection(coll, args.bs_db, args.bs_dir,
+                                        args.workers, args.bs_indexdir,
+                                        native_seeds(args), logger=logger)
+    logger.info("Screen search complete")
+
+    # Amend primer JSON files to remove screened primers
+    jobs = [(blastout, indata.primers, args.maxaln) for blastout, indata in
+            zip(blastouts, coll.data)]
+    with multiprocessing.Pool(processes=args.workers) as pool:
+        newprimers = pool.starmap(blast.apply_screen, jobs)
+    for (blastout, _, _), indata, primers in zip(jobs, coll.data,
+                                                 newprimers):
+        logger.info("Amended primer file %s with results from %s",
+                    indata.primers, blastout)
+        logger.info("Screened primers placed in %s", primers)
+        indata.primers = primers
+
+
+def screen_blastn(coll, args, logger):
+    """Screen primers against a BLAST database with BLASTN+."""
+    # Run BLASTN search with primer sequences
+    logger.info("Building BLASTN screen command-lines...")
+    if args.bs_batch:
+        # Share the workers between batched jobs as BLASTN+ threads
+        threads = max(1, (args.workers or multiprocessing.cpu_count()) //
+                      args.bs_batch)
+        logger.info("Batching primers into %d jobs, with %d thread(s) each",
+                    args.bs_batch, threads)
+        clines = blast.build_batch_commands(coll, args.bs_exe, args.bs_db,
+                                            args.bs_dir, args.bs_batch,
+                                            threads)
+    else:
+        clines = blast.build_commands(coll, args.bs_exe, args.bs_db,
+                                      args.bs_dir)
+    pretty_clines = [str(c).replace(' -', ' \\\n          -') for c in clines]
+    log_clines(pretty_clines, logger)
+
+    # Amend primer JSON files to remove screened primers. Each input's
+    # screen is applied in a worker process as soon as its BLASTN+ job
+    # completes, while other jobs are still running.
+    with multiprocessing.Pool(processes=args.workers) as pool:
+        screens = {}
+
+        def screen(blastout, indata):
+            """Start applying the BLASTN+ screen to an input's primers"""
+            logger.info("Amending primer file %s with results from %s",
+                        indata.primers, blastout)
+            screens[indata.name] = pool.apply_async(
+                blast.apply_screen, (blastout, indata.primers, args.maxaln))
+
+        # Batched jobs each hold primers from several inputs
+        jobs = {} if args.bs_batch else \
+            {str(cline): (cline.out, indata) for cline, indata in
+             zip(clines, coll.data)}
+
+        def job_done(retval):
+            """Apply the screen for a completed per-genome BLASTN+ job"""
+            screen(*jobs[retval.args])
+
+        run_parallel_jobs(clines, args, logger,
+                          callback=None if args.bs_batch else job_done)
+        logger.info("BLASTN+ search complete")
+
+        # Batched output must be split by genome once all jobs are done;
+        # schedulers that do not report individual job completion (e.g.
+        # SGE) leave their output to be screened here
+        if args.bs_batch:
+            blastouts = blast.demultiplex([cline.out for cline in clines],
+                                          coll, args.bs_dir)
+        else:
+            blastouts = [cline.out for cline in clines]
+        for blastout, indata in zip(blastouts, coll.data):
+            if indata.name not in screens:
+                screen(blastout, indata)
+
+        for indata in coll.data:
+            newprimers = screens[indata.name].get()
+            logger.info("Screened primers placed in %s", newprimers)
+            indata.primers = newprimers
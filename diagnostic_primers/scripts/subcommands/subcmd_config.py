@@ -41,6 +41,7 @@ OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
 THE SOFTWARE.
 """
 
+import multiprocessing
 import os
 
 from ..tools import (load_config_tab, load_config_json)
@@ -74,34 +75,27 @@ def subcmd_config(args, logger):
 
     # Do sequences need to be stitched or their ambiguities replaced?
     # If --validate is active, we report only and do not modify.
-    # Note that the underlying code doesn't require us to check whether
-    # the sequence files need stitching or symbols replacing, and
-    # we could more efficiently use
-    # for g in gc.data:
-    #     g.stitch()
-    #     g.replace_ambiguities()
-    # but we're being helpfully verbose.
+    # Each input sequence is checked (and fixed) independently, so the
+    # checks are farmed out to a pool of worker processes. Results are
+    # returned in collection order, so the report is deterministic.
     logger.info('Checking whether input sequences require stitching, ' +
                 'or have non-N ambiguities.')
     problems = ["Validation problems"]  # Holds messages about problem files
-    for gcc in coll.data:
-        if gcc.needs_stitch:
-            msg = '%s requires stitch' % gcc.name
+    nproblems = 0  # Count of input sequences with problems
+    for gcc, (fixed, messages, errors) in zip(
+            coll.data, check_sequences(coll, args, logger)):
+        for msg in messages:
             logger.info(msg)
-            problems.append('%s (%s)' % (msg, gcc.seqfile))
-            if args.fix_sequences:
-                gcc.stitch()
-        else:
-            logger.info('%s does not require stitch', gcc.name)
-        if gcc.has_ambiguities:
-            msg = '%s has non-N ambiguities' % gcc.name
-            logger.info(msg)
-            problems.append('%s (%s)' % (msg, gcc.seqfile))
-            if args.fix_sequences:
-                gcc.replace_ambiguities()
-        else:
-            logger.info('%s does not contain non-N ambiguities', gcc.name)
+        problems.extend(['%s (%s)' % (msg, gcc.seqfile) for msg in errors])
+        nproblems += bool(errors)
+        # Fixed files were written by the worker: update our copy of the data
+        gcc.seqfile = fixed.seqfile
+        gcc.features = fixed.features
+        gcc.primers = fixed.primers
+        gcc.offsets = fixed.offsets
         logger.info('Sequence file: %s', gcc.seqfile)
+    logger.info('%d of %d input sequence(s) have problems', nproblems,
+                len(coll.data))
 
     # If we were not fixing sequences, report problems
     if not args.fix_sequences:
@@ -119,3 +113,62 @@ def subcmd_config(args, logger):
         logger.info('Writing JSON config file to %s', args.fix_sequences)
         coll.write_json(args.fix_sequences)
     return 0
+
+
+# Check (and fix) each input sequence in the collection, in parallel
+def check_sequences(coll, args, logger):
+    """Return list of (PDPData, messages, problems) for each input sequence
+
+    - coll        PDPCollection describing input sequences
+    - args        parsed command-line arguments
+    - logger      logger for the program
+
+    If args.fix_sequences is set, sequences are stitched and their
+    ambiguities replaced, as necessary. The returned PDPData objects are
+    copies, reflecting any changes to the sequence files. Results are
+    returned in the order of coll.data.
+
+    Sequences are checked with args.workers processes. The checks run in
+    Python, rather than as command-lines, so with the SGE scheduler they
+    run locally.
+    """
+    if getattr(args, 'scheduler', 'multiprocessing') == 'SGE':
+        logger.info('Sequence checks run locally, not with SGE')
+    jobs = [(gcc, bool(args.fix_sequences)) for gcc in coll.data]
+    pool = multiprocessing.Pool(processes=getattr(args, 'workers', None))
+    results = pool.map(_check_sequence, jobs)
+    pool.close()
+    pool.join()
+    return results
+
+
+def _check_sequence(job):
+    """Check (and optionally fix) a single input sequence.
+
+    - job       tuple of (PDPData, fix sequences True/False)
+
+    Returns the (possibly modified) PDPData object, a list of messages
+    describing its sequence, and the list of those messages that describe
+    problems with the sequence.
+    """
+    gcc, fix = job
+    profile = gcc.profile  # single pass over the sequence file
+    messages = ['%s: %d sequence(s), %d bases, GC %.3f, '
+                '%d non-N ambiguities (sha256 %s)' %
+                (gcc.name, len(profile.names), profile.total_length,
+                 profile.gc_content, sum(profile.ambiguities),
+                 profile.digest)]
+    problems = []
+    if gcc.needs_stitch:
+        problems.append('%s requires stitch' % gcc.name)
+        messages.append(problems[-1])
+    else:
+        messages.append('%s does not require stitch' % gcc.name)
+    if gcc.has_ambiguities:
+        problems.append('%s has non-N ambiguities' % gcc.name)
+        messages.append(problems[-1])
+    else:
+        messages.append('%s does not contain non-N ambiguities' % gcc.name)
+    if fix:
+        gcc.fix_sequences()  # stitch and replace ambiguities in one pass
+    return gcc, messages, problems
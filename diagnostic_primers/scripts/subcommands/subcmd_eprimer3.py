@@ -43,10 +43,10 @@ THE SOFTWARE.
 
 import os
 
-from diagnostic_primers import eprimer3
+from diagnostic_primers import (eprimer3, primer3py)
 
-from ..tools import (create_output_directory, load_config_json, log_clines,
-                     run_parallel_jobs)
+from ..tools import (create_output_directory, last_exception,
+                     load_config_json, log_clines, run_parallel_jobs)
 
 
 def subcmd_eprimer3(args, logger):
@@ -65,32 +65,126 @@ def subcmd_eprimer3(args, logger):
     # Check if output exists and if we should overwrite
     create_output_directory(args.eprimer3_dir, args.eprimer3_force, logger)
 
+    # Design primers with the requested engine, writing named primer files
+    # and recording their paths in the PDPData objects
+    if getattr(args, 'eprimer3_engine', 'eprimer3') == 'primer3':
+        design_primer3(coll, args, logger)
+    else:
+        design_eprimer3(coll, args, logger)
+
+    logger.info('Writing new config file to %s' % args.outfilename)
+    coll.write_json(args.outfilename)
+    return 0
+
+
+def design_eprimer3(coll, args, logger):
+    """Design primers for each input sequence with EMBOSS ePrimer3."""
     # Build command-lines for ePrimer3 and run
     # This will write 'bare' ePrimer3 files, with unnamed primer pairs
     logger.info('Building ePrimer3 command lines...')
-    clines = eprimer3.build_commands(coll, args.eprimer3_exe,
-                                     args.eprimer3_dir, vars(args))
+    clines = eprimer3.build_commands(
+        coll, args.eprimer3_exe, args.eprimer3_dir, vars(args),
+        window=getattr(args, 'eprimer3_window', None),
+        overlap=getattr(args, 'eprimer3_overlap', None))
     pretty_clines = [str(c).replace(' -', ' \\\n          -') for c in clines]
     log_clines(pretty_clines, logger)
-    run_parallel_jobs(clines, args, logger)
 
     # Load bare ePrimer3 data for each input sequence, and write JSON
-    # representation with named primer sets
-    # Record the path to the JSON representation in the PDPData object
+    # representation with named primer sets, as the ePrimer3 jobs for each
+    # sequence (one per window, if sequences are split) complete.
+    jobs, pending = {}, {}
     for gcc in coll.data:
+        gclines = [_[0] for _ in gcc.cmds.get('ePrimer3_windows',
+                                              [(gcc.cmds['ePrimer3'], 0)])]
+        jobs.update({str(cline): gcc for cline in gclines})
+        pending[gcc.name] = len(gclines)
+    processed = set()
+
+    def job_done(retval):
+        """Name primers for a PDPData once all its jobs are complete"""
+        gcc = jobs[retval.args]
+        pending[gcc.name] -= 1
+        if not pending[gcc.name]:
+            name_primers(gcc)
+
+    def name_primers(gcc):
+        """Write named ePrimer3 and JSON output for the passed PDPData"""
         ep3file = gcc.cmds['ePrimer3'].outfile
-        logger.info("Loading primers from ePrimer3 output %s", ep3file)
-        primers = eprimer3.load_primers(ep3file, fmt='eprimer3')
-        # Write named ePrimer3
-        outfname = os.path.splitext(ep3file)[0] + '_named.eprimer3'
-        logger.info('Writing named primer sequences to %s' % outfname)
-        eprimer3.write_primers(primers, outfname, fmt='ep3')
-        # Write named JSON
-        outfname = os.path.splitext(ep3file)[0] + '_named.json'
-        logger.info('Writing primer JSON sequences to %s' % outfname)
-        eprimer3.write_primers(primers, outfname, fmt='json')
+        if 'ePrimer3_windows' in gcc.cmds:
+            windows = [(cline.outfile, offset) for cline, offset in
+                       gcc.cmds['ePrimer3_windows']]
+            logger.info("Merging primers from %d ePrimer3 windows for %s",
+                        len(windows), gcc.name)
+            primers = eprimer3.merge_window_primers(windows, ep3file)
+        else:
+            logger.info("Loading primers from ePrimer3 output %s", ep3file)
+            primers = eprimer3.load_primers(ep3file, fmt='eprimer3')
+        write_named_primers(gcc, primers, ep3file, args, logger)
+        processed.add(gcc.name)
+
+    run_parallel_jobs(clines, args, logger, callback=job_done)
+
+    # Schedulers that do not report individual job completion (e.g. SGE)
+    # leave their output to be processed here
+    for gcc in coll.data:
+        if gcc.name not in processed:
+            name_primers(gcc)
+
+
+def design_primer3(coll, args, logger):
+    """Design primers for each input sequence in-process with primer3-py."""
+    logger.info('Designing primers with primer3-py...')
+    try:
+        designed = primer3py.design_collection(
+            coll, args.eprimer3_dir, vars(args),
+            workers=getattr(args, 'workers', None),
+            window=getattr(args, 'eprimer3_window', None),
+            overlap=getattr(args, 'eprimer3_overlap', None))
+    except primer3py.PDPPrimer3Error:
+        logger.error('Could not design primers with primer3-py (exiting)')
+        logger.error(last_exception())
+        raise SystemExit(1)
+    for gcc in coll.data:
+        ep3file, primers = designed[gcc.name]
+        logger.info('Designed %d primer sets for %s', len(primers), gcc.name)
+        write_named_primers(gcc, primers, ep3file, args, logger)
+
+
+def write_named_primers(gcc, primers, ep3file, args, logger):
+    """Write named primers for the passed PDPData, and record their path
+
+    - gcc         PDPData object for the input sequence
+    - primers     named primer sets designed to the input sequence
+    - ep3file     path to ePrimer3 output for the sequence, giving the
+                  stem for output files
+    - args        parsed command-line arguments
+    - logger      logger for the program
+    """
+    # Write named ePrimer3
+    outfname = os.path.splitext(ep3file)[0] + '_named.eprimer3'
+    logger.info('Writing named primer sequences to %s' % outfname)
+    eprimer3.write_primers(primers, outfname, fmt='ep3')
+    # Write named JSON
+    outfname = os.path.splitext(ep3file)[0] + '_named.json'
+    logger.info('Writing primer JSON sequences to %s' % outfname)
+    eprimer3.write_primers(primers, outfname, fmt='json')
+    gcc.primers = outfname
+    # Write named binary primers, if requested, for faster loading
+    if getattr(args, 'eprimer3_npz', False):
+        outfname = os.path.splitext(ep3file)[0] + '_named.npz'
+        logger.info('Writing binary primer data to %s' % outfname)
+        eprimer3.write_primers(primers, outfname, fmt='npz')
+        gcc.primers = outfname
+    # Remove primer sets whose products span the junction between
+    # contigs in a stitched sequence
+    if gcc.contig_index is not None:
+        kept = eprimer3.filter_junction_primers(primers, gcc.contig_index)
+        logger.info('%s: removed %d of %d primer sets spanning contig ' +
+                    'junctions', gcc.name, len(primers) - len(kept),
+                    len(primers))
+        outfname = '_nojunction'.join(os.path.splitext(gcc.primers))
+        logger.info('Writing junction-filtered primers to %s' % outfname)
+        eprimer3.write_primers(
+            kept, outfname,
+            fmt='npz' if outfname.endswith('.npz') else 'json')
         gcc.primers = outfname
-
-    logger.info('Writing new config file to %s' % args.outfilename)
-    coll.write_json(args.outfilename)
-    return 0
@@ -65,11 +65,9 @@ def subcmd_extract(args, logger):
     create_output_directory(outdir, args.ex_force, logger)
 
     # Load the config file and extract the amplicons
-    primers = eprimer3.load_primers(args.primerfile, fmt='json')
+    primers = eprimer3.load_primer_table(args.primerfile)
     coll = load_config_json(args, logger)
     logger.info("Extracting amplicons from source genomes")
-    # TODO: make this call for a single primer, and cache sequence
-    #       and other (primersearch, primers) data here
     amplicons = extract.extract_amplicons(task_name, primers, coll)
 
     # Write the amplicons and primers to suitable output files
@@ -48,21 +48,43 @@ from ..tools import (create_output_directory, load_config_json, log_clines,
 
 
 def subcmd_primersearch(args, logger):
-    """Perform in silico hybridisation with EMBOSS PrimerSearch."""
+    """Perform in silico hybridisation with PrimerSearch.
+
+    The EMBOSS primersearch tool is used by default; the built-in engine
+    can be selected with --engine native.
+    """
     # Does output already exist, and should we overwrite?
     create_output_directory(args.ps_dir, args.ps_force, logger)
 
     # Get config file data
     coll = load_config_json(args, logger)
 
-    # Construct command lines for primersearch
-    logger.info("Building primersearch command-lines...")
     mismatchpercent = int(100 * args.mismatchpercent)  # for EMBOSS
-    clines = primersearch.build_commands(coll, args.ps_exe, args.ps_dir,
-                                         mismatchpercent)
-    pretty_clines = [str(c).replace(' -', ' \\\n          -') for c in clines]
-    log_clines(pretty_clines, logger)
-    run_parallel_jobs(clines, args, logger)
+    if args.ps_engine == 'native':
+        # Search with the built-in engine: one job per target genome
+        logger.info("Running primer search with built-in engine...")
+        if args.scheduler != 'multiprocessing':
+            logger.warning("Built-in engine runs locally, ignoring " +
+                           "scheduler %s", args.scheduler)
+        outfiles = primersearch.search_collection(coll, args.ps_dir,
+                                                  mismatchpercent,
+                                                  args.workers,
+                                                  args.ps_dedup)
+        logger.info("Wrote %d primersearch output files", len(outfiles))
+    else:
+        # Construct command lines for primersearch
+        logger.info("Building primersearch command-lines...")
+        clines = primersearch.build_commands(coll, args.ps_exe, args.ps_dir,
+                                             mismatchpercent, args.ps_dedup)
+        pretty_clines = [str(c).replace(' -', ' \\\n          -')
+                         for c in clines]
+        log_clines(pretty_clines, logger)
+        run_parallel_jobs(clines, args, logger)
+        if args.ps_dedup:
+            # Copy unique primer set results to each query's output
+            outfiles = primersearch.fan_out_results(args.ps_dir)
+            logger.info("Wrote %d primersearch output files from %d " +
+                        "deduplicated searches", len(outfiles), len(clines))
 
     # Write new config file, and exit
     logger.info('Writing new config file to %s', args.outfilename)
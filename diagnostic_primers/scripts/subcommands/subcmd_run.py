@@ -0,0 +1,262 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""subcmd_run.py
+
+Provides the run subcommand for pdp.py
+
+(c) The James Hutton Institute 2017-18
+
+Author: Leighton Pritchard
+Contact: leighton.pritchard@hutton.ac.uk
+
+Leighton Pritchard,
+Information and Computing Sciences,
+James Hutton Institute,
+Errol Road,
+Invergowrie,
+Dundee,
+DD6 9LH,
+Scotland,
+UK
+
+The MIT License
+
+Copyright (c) 2017-18 The James Hutton Institute
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+
+import json
+import os
+import types
+
+from argparse import Namespace
+
+from diagnostic_primers import (blast, classify, eprimer3, pipeline,
+                                primersearch, prodigal)
+
+from .subcmd_eprimer3 import write_named_primers
+from .subcmd_extract import subcmd_extract
+from ..tools import load_config_json
+
+# Output subdirectory for each pipeline stage
+STAGES = ('prodigal', 'eprimer3', 'blastscreen', 'primersearch', 'classify',
+          'extract')
+
+
+def subcmd_run(args, logger):
+    """Run the pipeline as a dependency graph of tasks for each input.
+
+    Each input's tasks start as soon as the tasks they depend on finish, so
+    that, e.g., primersearch for one input runs while ePrimer3 is still
+    running for others. Completed tasks are recorded in a state file in
+    the output directory, and are not rerun when the command is repeated.
+    """
+    coll = load_config_json(args, logger)
+    os.makedirs(args.outdir, exist_ok=True)
+    statefile = os.path.join(args.outdir, 'pipeline_state.json')
+    if os.path.isfile(statefile):
+        if args.run_restart:
+            logger.info("Discarding state of earlier runs in %s", statefile)
+            os.remove(statefile)
+        else:
+            logger.info("Resuming from state of earlier runs in %s",
+                        statefile)
+
+    tasks = build_tasks(coll, args, logger)
+    logger.info("Running %d tasks for %d inputs", len(tasks), len(coll))
+    failed = pipeline.run_tasks(tasks, statefile, args.scheduler,
+                                args.workers, getattr(args, 'timeout', None),
+                                getattr(args, 'failfast', False),
+                                getattr(args, 'cachedir', None), logger)
+
+    # Write config file describing the output of all completed tasks
+    outfilename = os.path.join(args.outdir, 'pipeline.json')
+    logger.info('Writing new config file to %s', outfilename)
+    coll.write_json(outfilename)
+    if failed:
+        logger.error("%d task(s) failed (exiting): %s", len(failed),
+                     ', '.join(failed))
+        logger.error("Repeat the command to resume the run")
+        raise SystemExit(1)
+    return 0
+
+
+def build_tasks(coll, args, logger):
+    """Returns list of PDPTasks for the pipeline run.
+
+    - coll      PDPCollection describing the inputs
+    - args      parsed command-line arguments
+    - logger    logger for the program
+
+    Each input has Prodigal, ePrimer3, BLASTN+ screen (if a database is
+    given) and primersearch tasks, with one primersearch task for each
+    other input as target. The classify task needs all primersearch
+    results, and extract tasks the results of classify.
+    """
+    outdirs = {stage: os.path.join(args.outdir, stage) for stage in STAGES}
+    configfile = os.path.join(args.outdir, 'pipeline.json')
+    tasks = []
+    for gcc in coll.data:
+        if 'prodigal' not in args.run_skip:
+            tasks.append(prodigal_task(gcc, args, outdirs['prodigal']))
+        tasks.append(eprimer3_task(gcc, args, outdirs['eprimer3'], logger))
+        if args.bs_db is not None:
+            tasks.append(blastscreen_task(gcc, args, outdirs['blastscreen']))
+        tasks.append(primersearch_task(gcc, coll, args,
+                                       outdirs['primersearch'],
+                                       tasks[-1].name))
+    for gcc in coll.data:
+        for target in coll.data:
+            if target.name != gcc.name:
+                tasks.append(primersearch_target_task(gcc, target, args))
+    primersearch_tasks = [_.name for _ in tasks if
+                          _.name.startswith('primersearch:')]
+    diagnostic = {}    # diagnostic primer files, keyed by group
+    tasks.append(classify_task(coll, outdirs['classify'], configfile,
+                               diagnostic, primersearch_tasks))
+    if 'extract' not in args.run_skip:
+        tasks.append(extract_task(args, outdirs['extract'], configfile,
+                                  diagnostic, logger))
+    return tasks
+
+
+def prodigal_task(gcc, args, outdir):
+    """Returns task predicting CDS features for an input with Prodigal"""
+    def command():
+        return prodigal.build_commands(_collection(gcc), args.prodigal_exe,
+                                       outdir)[0]
+
+    def action(cline):
+        return {'features': cline.split()[-1].strip()}
+
+    def update(results):
+        gcc.features = results['features']
+
+    return pipeline.PDPTask('prodigal:%s' % gcc.name, command, action, update)
+
+
+def eprimer3_task(gcc, args, outdir, logger):
+    """Returns task designing primers to an input with ePrimer3"""
+    def command():
+        return eprimer3.build_commands(_collection(gcc), args.eprimer3_exe,
+                                       outdir, vars(args))[0]
+
+    def action(cline):
+        ep3file = gcc.cmds['ePrimer3'].outfile
+        primers = eprimer3.load_primers(ep3file, fmt='eprimer3')
+        write_named_primers(gcc, primers, ep3file, args, logger)
+        return {'primers': gcc.primers}
+
+    def update(results):
+        gcc.primers = results['primers']
+
+    return pipeline.PDPTask('eprimer3:%s' % gcc.name, command, action, update)
+
+
+def blastscreen_task(gcc, args, outdir):
+    """Returns task screening an input's primers with BLASTN+"""
+    def command():
+        cline = blast.build_commands(_collection(gcc), args.bs_exe,
+                                     args.bs_db, outdir)[0]
+        gcc.cmds['blastscreen'] = cline
+        return cline
+
+    def action(cline):
+        return {'primers': blast.apply_screen(gcc.cmds['blastscreen'].out,
+                                              gcc.primers, args.maxaln)}
+
+    def update(results):
+        gcc.primers = results['primers']
+
+    return pipeline.PDPTask('blastscreen:%s' % gcc.name, command, action,
+                            update, depends=['eprimer3:%s' % gcc.name])
+
+
+def primersearch_task(gcc, coll, args, outdir, primertask):
+    """Returns task writing an input's primers for primersearch
+
+    The primersearch output file for each target is recorded in the
+    input's primersearch JSON file.
+    """
+    def action(cline):
+        targets = {_.name: _.seqfile for _ in coll.data}
+        primersearch.build_query_commands(gcc, targets, args.ps_exe, outdir,
+                                          int(100 * args.mismatchpercent))
+        return {'primersearch': gcc.primersearch}
+
+    def update(results):
+        gcc.primersearch = results['primersearch']
+
+    return pipeline.PDPTask('primersearch:%s' % gcc.name, None, action,
+                            update, depends=[primertask])
+
+
+def primersearch_target_task(gcc, target, args):
+    """Returns task searching an input's primers against a target input"""
+    def command():
+        with open(gcc.primersearch, 'r') as ifh:
+            psdict = json.load(ifh)
+        return primersearch.build_command(args.ps_exe, psdict['primers'],
+                                          target.seqfile, psdict[target.name],
+                                          int(100 * args.mismatchpercent))
+
+    return pipeline.PDPTask('primersearch:%s:%s' % (gcc.name, target.name),
+                            command, depends=['primersearch:%s' % gcc.name])
+
+
+def classify_task(coll, outdir, configfile, diagnostic, depends):
+    """Returns task classifying primers, once all searches are complete
+
+    Paths to the diagnostic primer files for each group are placed in the
+    passed diagnostic dictionary.
+    """
+    def action(cline):
+        os.makedirs(outdir, exist_ok=True)
+        coll.write_json(configfile)
+        results = classify.classify_primers(coll)
+        classify.write_results(results, os.path.join(outdir, 'results.json'))
+        classify.write_results(results, os.path.join(outdir, 'summary.tab'),
+                               fmt='summary')
+        return {'diagnostic': {group: os.path.join(outdir,
+                                                   "%s_primers.json" % group)
+                               for group in results.groups}}
+
+    def update(results):
+        diagnostic.update(results['diagnostic'])
+
+    return pipeline.PDPTask('classify', None, action, update, depends)
+
+
+def extract_task(args, outdir, configfile, diagnostic, logger):
+    """Returns task extracting amplicons for each group's primer sets"""
+    def action(cline):
+        for group, primerfile in sorted(diagnostic.items()):
+            subcmd_extract(Namespace(infilename=configfile,
+                                     primerfile=primerfile, outdir=outdir,
+                                     ex_force=True, mafft_exe=args.mafft_exe,
+                                     noalign=args.noalign), logger)
+
+    return pipeline.PDPTask('extract', None, action, depends=['classify'])
+
+
+def _collection(gcc):
+    """Returns a collection holding only the passed PDPData object"""
+    # Command builders only use the collection's data attribute, and record
+    # commands on the PDPData object itself, so that it must not be copied
+    return types.SimpleNamespace(data=[gcc])
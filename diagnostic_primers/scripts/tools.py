@@ -49,10 +49,11 @@ THE SOFTWARE.
 """
 
 import os
+import subprocess
 import sys
 import traceback
 
-from diagnostic_primers import (multiprocessing, sge, sge_jobs, config)
+from diagnostic_primers import (cache, multiprocessing, sge, sge_jobs, config)
 
 
 # Report last exception as string
@@ -104,19 +105,57 @@ def log_clines(clines, logger):
 
 
 # Pass jobs to the appropriate scheduler
-def run_parallel_jobs(clines, args, logger):
-    """Run the passed command-lines in parallel."""
+def run_parallel_jobs(clines, args, logger, callback=None):
+    """Run the passed command-lines in parallel.
+
+    - clines        iterable of command-lines to run
+    - args          parsed command-line arguments, giving the scheduler
+                    and its settings
+    - logger        logger for the program
+    - callback      optional function called with each CompletedProcess
+                    as its job completes successfully (multiprocessing
+                    scheduler only)
+
+    With the multiprocessing scheduler, results are handled as each job
+    finishes, so the callback can process a job's output while other jobs
+    are still running. If args.failfast is set, the remaining jobs are
+    cancelled as soon as one job fails.
+
+    If args.cachedir is set, jobs whose output is held in the result cache
+    at that location are not run; their output is restored from the cache
+    (and passed to the callback), and the output of jobs that do run is
+    added to the cache.
+    """
+    clines = list(clines)
+    toolcache = None
+    if getattr(args, 'cachedir', None):
+        toolcache = cache.PDPToolCache(args.cachedir)
+        clines = restore_cached_jobs(clines, toolcache, logger, callback)
+        if not clines:
+            logger.info('All jobs restored from cache %s' % args.cachedir)
+            return
+    jobs = {str(cline): cline for cline in clines}
+
     logger.info('Running jobs using scheduler: %s' % args.scheduler)
     # Pass lines to scheduler and run
     if args.scheduler == 'multiprocessing':
-        retvals = multiprocessing.run(
-            clines, workers=args.workers, verbose=args.verbose)
-        if sum([r.returncode for r in retvals]):
+        failed = []
+        for retval in multiprocessing.run_iter(
+                clines, workers=args.workers,
+                timeout=getattr(args, 'timeout', None),
+                failfast=getattr(args, 'failfast', False)):
+            if retval.returncode != 0:
+                failed.append(retval)
+                continue
+            if toolcache is not None:
+                toolcache.store(jobs[retval.args])
+            if callback is not None and not failed:
+                callback(retval)
+        if failed:
             logger.error('At least one run has problems (exiting).')
-            for retval in retvals:
-                if retval.returncode != 0:
-                    logger.error('Failing command: %s' % retval.args)
-                    logger.error('Failing stderr:\n %s' % retval.stderr)
+            for retval in failed:
+                logger.error('Failing command: %s' % retval.args)
+                logger.error('Failing stderr:\n %s' % retval.stderr)
             raise SystemExit(1)
         else:
             logger.info('Runs completed without error.')
@@ -125,12 +164,47 @@ def run_parallel_jobs(clines, args, logger):
             sge_jobs.Job("pdp_%06d" % idx, cmd)
             for idx, cmd in enumerate(clines)
         ]
-        sge.run_dependency_graph(joblist, logger=logger)
+        failures = sge.run_dependency_graph(joblist, logger=logger)
+        if failures:
+            logger.error('At least one SGE task has problems (exiting).')
+            for failure in failures:
+                logger.error('Failing SGE job %s, task %s: %s' %
+                             (failure.job, failure.task, failure.message))
+            raise SystemExit(1)
+        logger.info('Runs completed without error.')
+        if toolcache is not None:
+            for cline in clines:
+                toolcache.store(cline)
     else:
         raise ValueError('Scheduler must be one of ' +
                          '[multiprocessing|SGE], got %s' % args.scheduler)
 
 
+# Restore output of cached jobs, returning those that must be run
+def restore_cached_jobs(clines, toolcache, logger, callback=None):
+    """Restore output for cached command-lines, returning the rest
+
+    - clines        list of command-lines to run
+    - toolcache     PDPToolCache holding output of previous runs
+    - logger        logger for the program
+    - callback      optional function called with a CompletedProcess for
+                    each job whose output is restored
+
+    Returns the list of command-lines with no valid cached output.
+    """
+    torun = []
+    for cline in clines:
+        if toolcache.restore(cline):
+            logger.info('Restored cached output for %s' % cline)
+            if callback is not None:
+                callback(subprocess.CompletedProcess(str(cline), 0, b'', b''))
+        else:
+            torun.append(cline)
+    logger.info('%d of %d jobs restored from cache' %
+                (len(clines) - len(torun), len(clines)))
+    return torun
+
+
 # Test whether the passed PDPCollection has primersearch output linked
 def has_primersearch(coll):
     """Returns True if the passed PDPCollection has primersearch output
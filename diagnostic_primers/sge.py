@@ -11,14 +11,34 @@ For parallelisation on multi-node system, we use some custom code to submit
 jobs.
 """
 
-from collections import defaultdict
+from collections import defaultdict, namedtuple
+from xml.etree import ElementTree
 
-from .sge_jobs import JobGroup
+from .sge_jobs import JobGroup, SGE_WAIT
 
 import itertools
 import os
+import shlex
+import subprocess
+import time
 
 QSUB_DEFAULT = 'qsub'
+QSTAT_DEFAULT = 'qstat'
+
+# Maximum time between qstat polls, in seconds
+SGE_MAXWAIT = 60
+
+# Number of polls for which a finished job's exit status files may be
+# missing (e.g. due to filesystem latency) before its tasks are reported
+# as failed
+SGE_EXIT_GRACE = 3
+
+# Maximum number of tasks in a single array job (JobGroup)
+SGE_MAXTASKS = 10000
+
+# Description of a failed SGE task; exitcode is None where no exit status
+# was recorded
+SGEFailure = namedtuple('SGEFailure', 'job task exitcode message')
 
 JGPREFIX = 'pdp'
 
@@ -33,26 +53,30 @@ def split_seq(iterable, size):
 
 
 # Run a job dependency graph, with SGE
-def run_dependency_graph(jobgraph, logger=None, jgprefix=JGPREFIX):
+def run_dependency_graph(jobgraph, logger=None, jgprefix=JGPREFIX,
+                         qsub=QSUB_DEFAULT, qstat=QSTAT_DEFAULT,
+                         root_dir=os.curdir):
     """Creates and runs GridEngine scripts for jobs based on the passed
     jobgraph.
 
     - jobgraph   - list of jobs, which may have dependencies.
     - logger     - a logger module logger (optional)
     - jgprefix   - string to use as prefix for jobs when submitted to SGE
+    - qsub       - command used to submit jobs
+    - qstat      - command used to query job status
+    - root_dir   - root directory for SGE and job output
 
-    The strategy here is to loop over each job in the list of jobs (jobgraph),
-    and create/populate a series of Sets of commands, to be run in
-    reverse order with multiprocessing_run as asynchronous pools.
+    Returns a list of SGEFailure tuples describing any tasks that failed.
 
-    The strategy here is to loop over each job in the dependency graph, and
-    add the job to a new list of jobs, swapping out the Job dependency for
-    the name of the Job on which it depends.
+    The jobs are compiled into array jobs (JobGroups) by dependency layer
+    and executable (see compile_jobgroups()), so that a workflow of many
+    thousands of jobs is submitted with a handful of qsub calls, and the
+    arrays are held until the arrays they depend on have run.
     """
     jobset = set()
     for job in jobgraph:
         jobset = populate_jobset(job, jobset, depth=1)
-    joblist = list(jobset)
+    joblist = sorted(jobset, key=lambda _: _.name)
 
     # Try to be informative by telling the user what jobs will run
     dep_count = 0  # how many dependencies are there
@@ -64,44 +88,256 @@ def run_dependency_graph(jobgraph, logger=None, jgprefix=JGPREFIX):
                 dep_count += len(job.dependencies)
                 for dep in job.dependencies:
                     logger.info("\t[^ depends on: %s]" % dep.name)
-    logger.info("There are %d job dependencies" % dep_count)
-
-    # If there are no job dependencies, we can use an array (or series of
-    # arrays) to schedule our jobs. This cuts down on problems with long
-    # job lists choking up the queue.
-    if dep_count == 0:
-        logger.info("Compiling jobs into JobGroups")
-        jobcmds = defaultdict(list)
-        for job in joblist:
-            if hasattr(job.command, "program_name"):   # For EMBOSS integration
-                jobcmds[job.command.program_name].append(str(job.command))
-            else:
-                jobcmds[job.command.split(' ')[0]].append(str(job.command))
-        jobgroups = []
-        for cmd, jobcmd in list(jobcmds.items()):
-            # Break arglist up into batches of 10,000
-            sublists = split_seq(jobcmd, 10000)
-            count = 0
-            for sublist in sublists:
-                count += 1
-                sge_jobcmdlist = ['\"%s\"' % jc for jc in sublist]
-                jobgroups.append(JobGroup("%s_%d" % (jgprefix, count),
-                                          "$cmds",
-                                          arguments={'cmds': sge_jobcmdlist}))
-        joblist = jobgroups
+        logger.info("There are %d job dependencies" % dep_count)
+
+    # We use a series of arrays to schedule our jobs. This cuts down on
+    # problems with long job lists choking up the queue.
+    njobs = len(joblist)
+    joblist = compile_jobgroups(joblist, jgprefix)
+    if logger:
+        logger.info("Compiled %d jobs into %d JobGroups", njobs, len(joblist))
 
     # Send jobs to scheduler
-    logger.info("Running jobs with scheduler...")
-    build_and_submit_jobs(os.curdir, joblist)
-    logger.info("Waiting for SGE-submitted jobs to finish (polling)")
+    if logger:
+        logger.info("Running jobs with scheduler...")
+    build_and_submit_jobs(root_dir, joblist, qsub)
+    if logger:
+        logger.info("Waiting for SGE-submitted jobs to finish (polling)")
+    return wait_for_jobs(root_dir, joblist, logger, qstat)
+
+
+def compile_jobgroups(joblist, jgprefix=JGPREFIX, maxtasks=SGE_MAXTASKS):
+    """Returns list of JobGroups that run the passed jobs, in submission order
+
+    - joblist    - list of Jobs, including every job that any of them
+                   depends on
+    - jgprefix   - string to use as prefix for JobGroup names
+    - maxtasks   - maximum number of tasks in a JobGroup
+
+    Each job is placed in a dependency layer one deeper than the deepest
+    job it depends on, and the jobs in each layer are grouped into arrays
+    by executable (i.e. by pipeline stage).
+
+    Where each job in a group depends on a single job, and these are the
+    tasks of one earlier JobGroup, the new group's tasks are placed in the
+    same order and the group is held with -hold_jid_ad, so that each task
+    starts as soon as its own dependency has finished. Otherwise the group
+    is held with -hold_jid until all of the JobGroups holding its jobs'
+    dependencies have finished.
+
+    The jobs run by each JobGroup's tasks, in task order, are placed in its
+    jobs attribute.
+    """
+    layers = defaultdict(list)
+    depths = {}
     for job in joblist:
-        job.wait()
+        layers[(_job_depth(job, depths), _job_program(job))].append(job)
+
+    jobgroups = []
+    location = {}    # JobGroup and task number of each compiled job
+    for layer in sorted(layers):
+        # Group jobs with a single dependency by the array that holds it
+        byparent = defaultdict(list)
+        for job in layers[layer]:
+            parent = None
+            if len(job.dependencies) == 1:
+                parent = location[job.dependencies[0]][0]
+            byparent[parent].append(job)
+        for parent, jobs in byparent.items():
+            aligned = parent is not None and \
+                sorted(location[_.dependencies[0]][1] for _ in jobs) == \
+                list(range(1, parent.tasks + 1))
+            if aligned:
+                chunks = [sorted(jobs,
+                                 key=lambda _: location[_.dependencies[0]][1])]
+            else:
+                chunks = split_seq(jobs, maxtasks)
+            for chunk in chunks:
+                jobgroup = JobGroup("%s_%d" % (jgprefix, len(jobgroups) + 1),
+                                    "$cmds",
+                                    arguments={'cmds': ['\"%s\"' % _.command
+                                                        for _ in chunk]})
+                if aligned:
+                    jobgroup.add_array_dependency(parent)
+                else:
+                    deps = {location[dep][0].name: location[dep][0] for
+                            job in chunk for dep in job.dependencies}
+                    for name in sorted(deps):
+                        jobgroup.add_dependency(deps[name])
+                jobgroup.jobs = list(chunk)
+                for idx, job in enumerate(chunk, 1):
+                    location[job] = (jobgroup, idx)
+                jobgroups.append(jobgroup)
+    return jobgroups
+
+
+def _job_depth(job, depths):
+    """Returns the dependency layer of a job, recording it in depths
+
+    Jobs with no dependencies are in layer zero.
+    """
+    if job not in depths:
+        depths[job] = 1 + max([_job_depth(_, depths) for _ in
+                               job.dependencies] or [-1])
+    return depths[job]
+
+
+def _job_program(job):
+    """Returns the executable run by a job"""
+    if hasattr(job.command, "program_name"):   # For EMBOSS integration
+        return job.command.program_name
+    return job.command.split(' ')[0]
+
+
+def parse_qstat_xml(xmltext):
+    """Returns dictionary of job states, keyed by job name
+
+    - xmltext    output from qstat -xml
+
+    Each value is the set of SGE state codes (e.g. 'r', 'qw', 'hqw',
+    'Eqw') reported for the job's tasks.
+    """
+    states = defaultdict(set)
+    for joblist in ElementTree.fromstring(xmltext).iter('job_list'):
+        name = joblist.findtext('JB_name')
+        if name is not None:
+            states[name].add(joblist.findtext('state', default=''))
+    return states
+
+
+def query_job_states(qstat=QSTAT_DEFAULT):
+    """Returns dictionary of states for all queued/running jobs
+
+    - qstat      command used to query job status
+
+    A single qstat -xml call reports on all jobs. Returns None if qstat
+    could not be run, or its output could not be read.
+    """
+    result = subprocess.run(shlex.split(qstat) + ['-xml'],
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if result.returncode != 0:
+        return None
+    try:
+        return parse_qstat_xml(result.stdout)
+    except ElementTree.ParseError:
+        return None
+
+
+def exit_status_path(root_dir, jobname, task):
+    """Returns path to the file recording exit status of a job's task"""
+    return os.path.join(root_dir, "output", "%s.%s.exit" % (jobname, task))
+
+
+def read_exit_codes(root_dir, job):
+    """Returns dictionary of exit codes, keyed by task number
+
+    - root_dir   Root directory for SGE and job output
+    - job        Job or JobGroup
+
+    Tasks with no (readable) exit status file have value None.
+    """
+    codes = {}
+    for task in range(1, job.tasks + 1):
+        try:
+            with open(exit_status_path(root_dir, job.name, task)) as ifh:
+                codes[task] = int(ifh.read().strip())
+        except (IOError, ValueError):
+            codes[task] = None
+    return codes
+
+
+def wait_for_jobs(root_dir, jobs, logger=None, qstat=QSTAT_DEFAULT,
+                  interval=SGE_WAIT, maxinterval=SGE_MAXWAIT):
+    """Wait for all the passed jobs to finish, returning failed tasks
+
+    - root_dir     Root directory for SGE and job output
+    - jobs         list of submitted Job/JobGroup objects
+    - logger       a logger module logger (optional)
+    - qstat        command used to query job status
+    - interval     initial time between polls, in seconds (doubles with
+                   each poll, up to maxinterval)
+
+    See iter_finished_jobs() for how jobs are tracked.
+
+    Returns a list of SGEFailure tuples, one per failed task.
+    """
+    pending = {job.name: job for job in jobs}
+    failures = []
+    ntasks, ndone = sum(job.tasks for job in jobs), 0
+    for job, jobfailures in iter_finished_jobs(root_dir, pending, logger,
+                                               qstat, interval, maxinterval):
+        failures.extend(jobfailures)
+        ndone += job.tasks
+        if logger:
+            logger.info("SGE job %s finished (%d of %d tasks complete)",
+                        job.name, ndone, ntasks)
+    return failures
+
+
+def iter_finished_jobs(root_dir, pending, logger=None, qstat=QSTAT_DEFAULT,
+                       interval=SGE_WAIT, maxinterval=SGE_MAXWAIT):
+    """Generator yielding (job, failures) as each pending job finishes
+
+    - root_dir     Root directory for SGE and job output
+    - pending      dictionary of submitted Job/JobGroup objects, keyed by
+                   job name
+    - logger       a logger module logger (optional)
+    - qstat        command used to query job status
+    - interval     initial time between polls, in seconds (doubles with
+                   each poll, up to maxinterval)
+
+    All jobs are tracked with a single qstat -xml call per poll. A job has
+    finished when it is no longer listed by qstat; the exit status of each
+    of its tasks is then read from the file written by the job script (see
+    build_job_scripts()). Jobs in an SGE error state (e.g. Eqw) will never
+    run, and are reported as failed. failures is a list of SGEFailure
+    tuples, one per failed task of the job.
+
+    Finished jobs are removed from pending. The caller may submit further
+    jobs, and add them to pending, while the generator is suspended; these
+    are tracked from the next poll.
+    """
+    missing = defaultdict(int)      # polls with absent exit status files
+    while pending:
+        time.sleep(interval)
+        interval = min(2 * interval, maxinterval)
+        states = query_job_states(qstat)
+        if states is None:
+            if logger:
+                logger.warning("Could not query SGE job status with %s",
+                               qstat)
+            continue
+        for name in sorted(pending):
+            job = pending[name]
+            errstates = [_ for _ in states.get(name, ()) if 'E' in _]
+            if name in states and not errstates:
+                continue
+            if errstates:
+                failures = [SGEFailure(name, None, None,
+                                       "SGE error state %s" %
+                                       ','.join(sorted(errstates)))]
+            else:
+                codes = read_exit_codes(root_dir, job)
+                if None in codes.values() and \
+                   missing[name] < SGE_EXIT_GRACE:
+                    missing[name] += 1
+                    continue
+                failures = [SGEFailure(name, task, code,
+                                       "no exit status recorded" if
+                                       code is None else
+                                       "exit status %d" % code)
+                            for task, code in sorted(codes.items())
+                            if code != 0]
+            del pending[name]
+            yield job, failures
 
 
 def populate_jobset(job, jobset, depth):
     """ Creates a set of jobs, containing jobs at difference depths of the
     dependency tree, retaining dependencies as strings, not Jobs.
     """
+    if job in jobset:       # already added, with its dependencies
+        return jobset
     jobset.add(job)
     if len(job.dependencies) == 0:
         return jobset
@@ -139,10 +375,18 @@ def build_job_scripts(root_dir, jobs):
     """
     # Loop over the job list, creating each job script in turn, and then adding
     # scriptPath to the Job object
+    # Each script records the exit status of its command in the output
+    # directory, so that failed tasks can be identified when the job ends
     for job in jobs:
         scriptPath = os.path.join(root_dir, "jobs", job.name)
+        task = "$SGE_TASK_ID" if isinstance(job, JobGroup) else 1
+        for idx in range(1, job.tasks + 1):   # remove any stale status
+            if os.path.exists(exit_status_path(root_dir, job.name, idx)):
+                os.remove(exit_status_path(root_dir, job.name, idx))
         with open(scriptPath, "w") as scriptFile:
             scriptFile.write("#!/bin/sh\n#$ -S /bin/bash\n%s\n" % job.script)
+            scriptFile.write("echo $? > %s\n" %
+                             exit_status_path(root_dir, job.name, task))
         job.scriptPath = scriptPath
 
 
@@ -158,18 +402,20 @@ def extract_submittable_jobs(waiting):
     # append the job to the list of submittable jobs.
     for job in waiting:
         unsatisfied = sum([(subjob.submitted is False) for subjob in
-                           job.dependencies])
+                           job.dependencies +
+                           getattr(job, 'array_dependencies', [])])
         if 0 == unsatisfied:
             submittable.add(job)
     return list(submittable)
 
 
-def submit_safe_jobs(root_dir, jobs):
+def submit_safe_jobs(root_dir, jobs, qsub=QSUB_DEFAULT):
     """Submit the passed list of jobs to the Grid Engine server, using the passed
     directory as the root for scheduler output.
 
     - root_dir      Path to output directory
     - jobs          Iterable of Job objects
+    - qsub          command used to submit jobs
     """
     # Loop over each job, constructing SGE command-line
     for job in jobs:
@@ -199,19 +445,26 @@ def submit_safe_jobs(root_dir, jobs):
                 args += dep.name + ","
             args = args[:-1]
 
+        # If tasks of this array job depend on the corresponding tasks of
+        # other array jobs, hold each task until its own dependency is done
+        if getattr(job, 'array_dependencies', []):
+            args += " -hold_jid_ad %s " % ','.join(
+                dep.name for dep in job.array_dependencies)
+
         # Build the qsub SGE commandline (passing local environment)
         qsubcmd = ("%s -V %s %s" %
-                   (QSUB_DEFAULT, args, job.scriptPath))
+                   (qsub, args, job.scriptPath))
         os.system(qsubcmd)               # Run the command
         job.submitted = True             # Set the job's submitted flag to True
 
 
-def submit_jobs(root_dir, jobs):
+def submit_jobs(root_dir, jobs, qsub=QSUB_DEFAULT):
     """ Submit each of the passed jobs to the SGE server, using the passed
     directory as root for SGE output.
 
     - root_dir       Path to output directory
     - jobs           List of Job objects
+    - qsub           command used to submit jobs
     """
     waiting = list(jobs)                 # List of jobs still to be done
     # Loop over the list of pending jobs, while there still are any
@@ -219,19 +472,21 @@ def submit_jobs(root_dir, jobs):
         # extract submittable jobs
         submittable = extract_submittable_jobs(waiting)
         # run those jobs
-        submit_safe_jobs(root_dir, submittable)
+        submit_safe_jobs(root_dir, submittable, qsub)
         # remove those from the waiting list
         for job in submittable:
             waiting.remove(job)
 
 
-def build_and_submit_jobs(root_dir, jobs):
+def build_and_submit_jobs(root_dir, jobs, qsub=QSUB_DEFAULT):
     """Submits the passed iterable of Job objects to SGE, placing SGE's output in
     the passed root directory
 
     - root_dir   Root directory for SGE and job output
 
     - jobs       List of Job objects, describing each job to be submitted
+
+    - qsub       command used to submit jobs
     """
     # If the passed set of jobs is not a list, turn it into one.
     # This makes use of a single JobGroup a little more intutitive
@@ -241,4 +496,4 @@ def build_and_submit_jobs(root_dir, jobs):
     # Build and submit the passed jobs
     build_directories(root_dir)        # build all necessary directories
     build_job_scripts(root_dir, jobs)  # build job scripts
-    submit_jobs(root_dir, jobs)        # submit the jobs to SGE
+    submit_jobs(root_dir, jobs, qsub)  # submit the jobs to SGE
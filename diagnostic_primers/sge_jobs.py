@@ -29,10 +29,7 @@ This code is essentially a frozen and cut-down version of pysge
 (https://github.com/widdowquinn/pysge)
 """
 
-import os
-import time
-
-SGE_WAIT = 0.01  # Initial polling wait time in s
+SGE_WAIT = 0.01  # Initial polling wait time in s (see sge.wait_for_jobs)
 
 ###
 # CLASSES
@@ -60,6 +57,7 @@ class Job(object):
         self.scriptPath = None          # Will hold path to the script file
         self.dependencies = []          # Job dependencies
         self.submitted = False          # Flag for if job is submitted
+        self.tasks = 1                  # Number of SGE tasks for the job
 
     def add_dependency(self, job):
         """Add the passed job to the dependency list for this Job.  This
@@ -76,14 +74,6 @@ class Job(object):
         """
         self.dependencies.remove(job)
 
-    def wait(self, interval=SGE_WAIT):
-        """Wait until the job finishes."""
-        finished = False
-        while not finished:
-            time.sleep(interval)
-            interval = min(2 * interval, 60)
-            finished = os.system("qstat -j %s > /dev/null" % (self.name))
-
 
 class JobGroup(object):
 
@@ -113,7 +103,9 @@ class JobGroup(object):
         self.queue = queue                # Set SGE queue to request
         self.command = command            # Set command string
         self.dependencies = []            # Create empty list for dependencies
-        self.submitted = True             # Set submitted Boolean
+        self.array_dependencies = []      # Arrays with task-wise dependencies
+        self.jobs = []                    # Jobs run by tasks, if compiled
+        self.submitted = False            # Set submitted Boolean
         if arguments is None:
             self.arguments = dict()       # Dictionary of arguments for command
         else:
@@ -165,17 +157,21 @@ class JobGroup(object):
         """
         self.dependencies.append(job)
 
+    def add_array_dependency(self, jobgroup):
+        """Add the passed JobGroup to the array dependency list for this
+        JobGroup. Each task of this JobGroup should not execute until the
+        task with the same number in the passed JobGroup is complete
+
+        - jobgroup    JobGroup with the same number of tasks as this one
+        """
+        if jobgroup.tasks != self.tasks:
+            raise ValueError("Array dependency %s has %d tasks (expected %d)"
+                             % (jobgroup.name, jobgroup.tasks, self.tasks))
+        self.array_dependencies.append(jobgroup)
+
     def remove_dependency(self, job):
         """ Remove the passed job from this JobGroup's dependency list
 
         - job         Job, job to be removed from the JobGroup's dependency list
         """
         self.dependencies.remove(job)
-
-    def wait(self, interval=SGE_WAIT):
-        """Wait for a defined period."""
-        finished = False
-        while not finished:
-            time.sleep(interval)
-            interval = min(2 * interval, 60)
-            finished = os.system("qstat -j %s > /dev/null" % (self.name))
@@ -0,0 +1,366 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""thermo.py
+
+Code to calculate primer thermodynamic properties for whole primer tables
+
+(c) The James Hutton Institute 2018
+
+Author: Leighton Pritchard
+Contact: leighton.pritchard@hutton.ac.uk
+
+Leighton Pritchard,
+Information and Computing Sciences,
+James Hutton Institute,
+Errol Road,
+Invergowrie,
+Dundee,
+DD6 9LH,
+Scotland,
+UK
+
+The MIT License
+
+Copyright (c) 2018 The James Hutton Institute
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+
+
+import numpy as np
+
+
+# Nearest-neighbour parameters (SantaLucia (1998) PNAS 95:1460-1465) for
+# each Watson-Crick stack 5'-XY-3'/3'-X'Y'-5', keyed by XY: (dH kcal/mol,
+# dS cal/K/mol)
+NN_PARAMS = {'AA': (-7.9, -22.2), 'TT': (-7.9, -22.2),
+             'AT': (-7.2, -20.4), 'TA': (-7.2, -21.3),
+             'CA': (-8.5, -22.7), 'TG': (-8.5, -22.7),
+             'GT': (-8.4, -22.4), 'AC': (-8.4, -22.4),
+             'CT': (-7.8, -21.0), 'AG': (-7.8, -21.0),
+             'GA': (-8.2, -22.2), 'TC': (-8.2, -22.2),
+             'CG': (-10.6, -27.2), 'GC': (-9.8, -24.4),
+             'GG': (-8.0, -19.9), 'CC': (-8.0, -19.9)}
+
+# Initiation parameters for terminal A.T and G.C pairs: (dH, dS)
+INIT_AT = (2.3, 4.1)
+INIT_GC = (0.1, -2.8)
+
+# Gas constant (cal/K/mol), and 37C in Kelvin
+R = 1.987
+T37 = 310.15
+
+# Default reaction conditions, as for primer3: monovalent cation, divalent
+# cation and dNTP concentrations (mM), and oligo concentration (nM)
+CONDITIONS = {'mv_conc': 50.0, 'dv_conc': 1.5, 'dntp_conc': 0.6,
+              'dna_conc': 50.0}
+
+# Number of primers scored at once when calculating stem stabilities
+BATCHSIZE = 1024
+
+# Sequence symbols are encoded as 0-3 (ACGT); anything else is 4
+BASES = 'ACGT'
+CODES = np.full(256, 4, dtype=np.uint8)
+for __idx, __base in enumerate(BASES):
+    CODES[ord(__base)] = CODES[ord(__base.lower())] = __idx
+
+# Stack parameters indexed by 5 * first base + second base; stacks that
+# include a non-ACGT symbol have no parameters (NaN)
+STACK_DH = np.full(25, np.nan)
+STACK_DS = np.full(25, np.nan)
+for __stack, (__dh, __ds) in NN_PARAMS.items():
+    __idx = 5 * BASES.index(__stack[0]) + BASES.index(__stack[1])
+    STACK_DH[__idx], STACK_DS[__idx] = __dh, __ds
+STACK_DG = STACK_DH - T37 * STACK_DS / 1000
+
+
+def encode(seqs):
+    """Return (codes, lengths) for the passed sequences
+
+    - seqs      sequence of strings, or NumPy bytestring array (such as a
+                PrimerTable sequence column)
+
+    codes is an (nseqs, maxlength) uint8 array of symbols encoded as 0-3
+    (ACGT), padded with 4; lengths is an array of sequence lengths.
+    """
+    seqs = np.asarray(seqs)
+    if seqs.dtype.kind == 'U':
+        seqs = np.char.encode(seqs, 'ascii')
+    seqs = seqs.astype('S%d' % max(seqs.dtype.itemsize, 1))
+    raw = seqs.view(np.uint8).reshape(len(seqs), seqs.dtype.itemsize)
+    return CODES[raw], np.char.str_len(seqs)
+
+
+def gc_content(seqs):
+    """Return array of GC content (percent) for the passed sequences."""
+    codes, lengths = encode(seqs)
+    gc = ((codes == 1) | (codes == 2)).sum(axis=1)
+    return np.where(lengths > 0, 100. * gc / np.maximum(lengths, 1), 0.)
+
+
+def monovalent_equivalent(mv_conc, dv_conc, dntp_conc):
+    """Return monovalent cation concentration (mM), including divalent ions
+
+    Divalent cations not bound by dNTPs are converted to an equivalent
+    monovalent concentration (von Ahsen et al. (2001) Clin Chem 47:1956), as
+    in primer3.
+    """
+    if dv_conc <= 0:
+        return mv_conc
+    return mv_conc + 120 * np.sqrt(max(dv_conc - dntp_conc, 0))
+
+
+def melting_temp(seqs, mv_conc=CONDITIONS['mv_conc'],
+                 dv_conc=CONDITIONS['dv_conc'],
+                 dntp_conc=CONDITIONS['dntp_conc'],
+                 dna_conc=CONDITIONS['dna_conc']):
+    """Return array of melting temperatures (C) for the passed sequences
+
+    - seqs        sequences, as for encode()
+    - mv_conc     monovalent cation concentration (mM)
+    - dv_conc     divalent cation concentration (mM)
+    - dntp_conc   dNTP concentration (mM)
+    - dna_conc    oligo concentration (nM)
+
+    Tm is calculated by the nearest-neighbour method, with the parameters
+    and salt correction of SantaLucia (1998), as primer3 does by default.
+    Stacks including a symbol other than ACGT are ignored.
+    """
+    codes, lengths = encode(seqs)
+    dh, ds = _duplex_params(codes, lengths)
+    salt = monovalent_equivalent(mv_conc, dv_conc, dntp_conc)
+    ds = ds + 0.368 * (lengths - 1) * np.log(salt / 1000.)
+    # Self-complementary oligos have a symmetry penalty, and the whole
+    # strand concentration contributes to duplex formation
+    selfcomp = _self_complementary(codes, lengths)
+    ds = ds - 1.4 * selfcomp
+    conc = np.where(selfcomp, dna_conc, dna_conc / 4.) / 1e9
+    with np.errstate(divide='ignore', invalid='ignore'):
+        tm = 1000 * dh / (ds + R * np.log(conc)) - 273.15
+    return np.where(lengths > 1, tm, np.nan)
+
+
+def end_stability(seqs, nbases=5):
+    """Return array of dG37 (kcal/mol) for the 3' nbases of each sequence
+
+    The stability of the 3' end of a primer is the nearest-neighbour free
+    energy of the duplex formed by its last nbases, including initiation.
+    More negative values indicate a more stable 3' end, and a greater
+    likelihood of mispriming.
+    """
+    codes, lengths = encode(seqs)
+    nbases = np.minimum(lengths, nbases)
+    cols = (lengths - nbases)[:, None] + np.arange(codes.shape[1])[None, :]
+    inend = np.arange(codes.shape[1])[None, :] < nbases[:, None]
+    ends = np.where(inend, np.take_along_axis(
+        codes, np.minimum(cols, codes.shape[1] - 1), axis=1), 4)
+    dh, ds = _duplex_params(ends.astype(np.uint8), nbases)
+    return dh - T37 * ds / 1000
+
+
+def hairpin_dg(seqs, minloop=3):
+    """Return array of dG37 (kcal/mol) of the most stable hairpin stem
+
+    - seqs      sequences, as for encode()
+    - minloop   minimum number of unpaired bases in the hairpin loop
+
+    The score is the sum of nearest-neighbour free energies of the most
+    stable contiguous run of Watson-Crick stacks formed by folding each
+    sequence back on itself. Loop, dangling end and initiation terms are
+    not included. Sequences that cannot form a stack score 0.
+    """
+    codes, _ = encode(seqs)
+    return _stem_dg(codes, codes, minloop=minloop)
+
+
+def dimer_dg(seqs, others=None):
+    """Return array of dG37 (kcal/mol) of the most stable duplex stem
+
+    - seqs      sequences, as for encode()
+    - others    sequences to pair with each of seqs; if None, each sequence
+                is paired with itself (self-dimer)
+
+    The score is calculated as for hairpin_dg(), for the two sequences
+    paired in antiparallel.
+    """
+    codes, _ = encode(seqs)
+    othercodes = codes if others is None else encode(others)[0]
+    return _stem_dg(codes, othercodes)
+
+
+def score_table(primers, **conditions):
+    """Return dictionary of property arrays for each primer set in a table
+
+    - primers       PrimerTable
+    - conditions    reaction conditions passed to melting_temp()
+
+    For each oligo (forward, reverse and, where present, internal) the
+    dictionary holds <oligo>_tm, <oligo>_gc, <oligo>_hairpin_dg,
+    <oligo>_dimer_dg and <oligo>_end_dg arrays, and pair_dimer_dg holds the
+    stability of the forward:reverse primer dimer. Internal oligo values
+    are NaN for primer sets without one.
+    """
+    scores = {}
+    for oligo in ('forward', 'reverse', 'internal'):
+        seqs = primers.array(oligo + '_seq')
+        scores[oligo + '_tm'] = melting_temp(seqs, **conditions)
+        scores[oligo + '_gc'] = gc_content(seqs)
+        scores[oligo + '_hairpin_dg'] = hairpin_dg(seqs)
+        scores[oligo + '_dimer_dg'] = dimer_dg(seqs)
+        scores[oligo + '_end_dg'] = end_stability(seqs)
+        if oligo == 'internal':
+            for key in [_ for _ in scores if _.startswith('internal')]:
+                scores[key] = np.where(np.char.str_len(seqs) > 0,
+                                       scores[key], np.nan)
+    scores['pair_dimer_dg'] = dimer_dg(primers.array('forward_seq'),
+                                       primers.array('reverse_seq'))
+    return scores
+
+
+def rescore(primers, **conditions):
+    """Return a new PrimerTable with recalculated Tm and GC content
+
+    - primers       PrimerTable
+    - conditions    reaction conditions passed to melting_temp()
+
+    The <oligo>_tm and <oligo>_gc fields of each primer set are replaced by
+    values calculated with melting_temp() and gc_content(), rounded to two
+    decimal places as in ePrimer3 output. Internal oligo fields are only
+    changed for primer sets with an internal oligo.
+    """
+    columns = {}
+    for oligo in ('forward', 'reverse', 'internal'):
+        seqs = primers.array(oligo + '_seq')
+        present = np.char.str_len(seqs) > 0
+        for field, values in ((oligo + '_tm',
+                               melting_temp(seqs, **conditions)),
+                              (oligo + '_gc', gc_content(seqs))):
+            columns[field] = np.where(present, np.round(values, 2),
+                                      primers.array(field))
+    return primers.replace(**columns)
+
+
+def filter_primers(primers, mintm=None, maxtm=None, maxtmdiff=None,
+                   mingc=None, maxgc=None, min_hairpin_dg=None,
+                   min_dimer_dg=None, **conditions):
+    """Return PrimerTable of primer sets passing the thermodynamic filters
+
+    - primers         PrimerTable
+    - mintm, maxtm    range of acceptable primer Tm (C)
+    - maxtmdiff       maximum difference in Tm between forward and reverse
+                      primers (C)
+    - mingc, maxgc    range of acceptable primer GC content (percent)
+    - min_hairpin_dg  least stable (most negative) acceptable primer hairpin
+                      stem dG37 (kcal/mol)
+    - min_dimer_dg    least stable (most negative) acceptable primer
+                      self-dimer and forward:reverse dimer stem dG37
+    - conditions      reaction conditions passed to melting_temp()
+
+    Filters that are None are not applied. Properties are recalculated from
+    the primer sequences, not taken from the table.
+    """
+    scores = score_table(primers, **conditions)
+    keep = np.ones(len(primers), dtype=bool)
+    for oligo in ('forward', 'reverse'):
+        tm, gc = scores[oligo + '_tm'], scores[oligo + '_gc']
+        if mintm is not None:
+            keep &= tm >= mintm
+        if maxtm is not None:
+            keep &= tm <= maxtm
+        if mingc is not None:
+            keep &= gc >= mingc
+        if maxgc is not None:
+            keep &= gc <= maxgc
+        if min_hairpin_dg is not None:
+            keep &= scores[oligo + '_hairpin_dg'] >= min_hairpin_dg
+        if min_dimer_dg is not None:
+            keep &= scores[oligo + '_dimer_dg'] >= min_dimer_dg
+    if min_dimer_dg is not None:
+        keep &= scores['pair_dimer_dg'] >= min_dimer_dg
+    if maxtmdiff is not None:
+        keep &= np.abs(scores['forward_tm'] -
+                       scores['reverse_tm']) <= maxtmdiff
+    return primers.select(keep)
+
+
+def _duplex_params(codes, lengths):
+    """Return (dH, dS) arrays for the perfect duplex of each sequence."""
+    stacks = 5 * codes[:, :-1].astype(np.intp) + codes[:, 1:]
+    dh = np.nansum(STACK_DH[stacks], axis=1)
+    ds = np.nansum(STACK_DS[stacks], axis=1)
+    # Initiation terms for the terminal base pairs
+    rows = np.arange(len(codes))
+    for terminal in (codes[:, 0], codes[rows, np.maximum(lengths - 1, 0)]):
+        isgc = (terminal == 1) | (terminal == 2)
+        dh = dh + np.where(isgc, INIT_GC[0], INIT_AT[0])
+        ds = ds + np.where(isgc, INIT_GC[1], INIT_AT[1])
+    return dh, ds
+
+
+def _self_complementary(codes, lengths):
+    """Return boolean array: True if each sequence is its own complement."""
+    width = codes.shape[1]
+    # Reverse each sequence within its own length, and complement
+    cols = (lengths[:, None] - 1 - np.arange(width)[None, :]) % max(width, 1)
+    revcomp = np.where(codes < 4, 3 - codes, 4)
+    revcomp = np.take_along_axis(revcomp, cols, axis=1)
+    valid = np.arange(width)[None, :] < lengths[:, None]
+    return ((codes == revcomp) | ~valid).all(axis=1) & (lengths > 0)
+
+
+def _stem_dg(codes, othercodes, minloop=None):
+    """Return array of most stable contiguous stem dG37 for sequence pairs.
+
+    - codes         encoded sequences (see encode())
+    - othercodes    encoded sequences paired antiparallel with codes
+    - minloop       if not None, codes and othercodes are the same
+                    molecule, and pairs must enclose at least minloop bases
+
+    Position i of codes pairs with position j of othercodes along
+    antidiagonals i + j = k; the stack of pairs (i, j), (i + 1, j - 1) has
+    the nearest-neighbour dG37 of codes[i:i + 2] if both pairs are
+    Watson-Crick. The most negative sum of consecutive stacks on any
+    antidiagonal is returned.
+    """
+    width, otherwidth = codes.shape[1], othercodes.shape[1]
+    result = np.zeros(len(codes))
+    if width < 2 or otherwidth < 2:
+        return result
+    # Index arrays for stacks along each antidiagonal
+    ii = np.arange(width - 1)[None, :]
+    kk = np.arange(width + otherwidth - 1)[:, None]
+    jj = kk - ii
+    valid = (jj >= 1) & (jj < otherwidth)
+    if minloop is not None:
+        valid &= (jj - 1) - (ii + 1) - 1 >= minloop
+    ii, jj = np.broadcast_to(ii, valid.shape), np.where(valid, jj, 1)
+    for start in range(0, len(codes), BATCHSIZE):
+        batch = codes[start:start + BATCHSIZE].astype(np.intp)
+        other = othercodes[start:start + BATCHSIZE].astype(np.intp)
+        # Watson-Crick pairs are codes summing to 3 (A:T, C:G)
+        paired = (batch[:, ii] + other[:, jj] == 3) & \
+            (batch[:, ii + 1] + other[:, jj - 1] == 3) & valid
+        stacks = np.where(paired, STACK_DG[5 * batch[:, ii] +
+                                           batch[:, ii + 1]], 0.)
+        # Sum of each run of consecutive stacks: all stack dG are negative,
+        # so running sums fall within a run, and the sum at the last break
+        # is the least of the sums at earlier breaks
+        total = np.cumsum(stacks, axis=2)
+        breaks = np.minimum.accumulate(np.where(paired, 0., total), axis=2)
+        result[start:start + BATCHSIZE] = (total - breaks).min(axis=(1, 2))
+    return result
@@ -42,7 +42,7 @@ setup(
     packages=['diagnostic_primers',
               'diagnostic_primers/scripts',
               'diagnostic_primers/scripts/subcommands'],
-    install_requires=['biopython'],
+    install_requires=['biopython', 'numpy'],
     package_data={},
     classifiers=[
         'Development Status :: 5 - Production/Stable',
@@ -47,12 +47,18 @@ OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
 THE SOFTWARE.
 """
 
+import itertools
+import json
+import logging
 import os
+import shutil
 import subprocess
 import sys
 import unittest
 
-from diagnostic_primers import (config, blast)
+from Bio import SeqIO
+
+from diagnostic_primers import (config, blast, eprimer3)
 
 from nose.tools import assert_equal
 
@@ -117,3 +123,257 @@ class TestCommands(unittest.TestCase):
         for cline in clines:
             assert_equal(os.path.split(cline.out)[:-1],
                          os.path.split(cline.query)[:-1])
+
+
+class TestBatch(unittest.TestCase):
+
+    """Class defining tests of batched BLAST screening."""
+
+    def setUp(self):
+        """Set parameters for tests."""
+        self.screendb = os.path.join('tests', 'test_input', 'blast',
+                                     'primerscreen')
+        self.outdir = os.path.join('tests', 'test_output', 'blast', 'batch')
+        self.config = os.path.join('tests', 'test_input', 'config',
+                                   'testnative.json')
+        self.pdpc = config.PDPCollection()
+        self.pdpc.from_json(self.config)
+
+    def test_batch_cmds(self):
+        """batched BLASTN commands split all primers into balanced chunks."""
+        clines = blast.build_batch_commands(self.pdpc, 'blastn',
+                                            self.screendb, self.outdir, 3, 4)
+        assert_equal(len(clines), 3)
+        # Five primer sets, each with two oligos
+        ids = [[_.id for _ in SeqIO.parse(cline.query, 'fasta')] for
+               cline in clines]
+        assert_equal([len(_) for _ in ids], [3, 3, 4])
+        assert_equal(ids[0][:2], ['pdp000000_genome_a_primer_00001_fwd',
+                                  'pdp000000_genome_a_primer_00001_rev'])
+        assert_equal(ids[-1][-1], 'pdp000002_genome_c_primer_00001_rev')
+        for cline in clines:
+            assert_equal(cline.num_threads, 4)
+            assert_equal(cline.task, 'blastn-short')
+
+    def test_demultiplex(self):
+        """batched BLASTN output is split back into per-genome files."""
+        os.makedirs(self.outdir, exist_ok=True)
+        hits = [('pdp000000_genome_a_primer_00001_fwd', 20),
+                ('pdp000002_genome_c_primer_00001_rev', 18),
+                ('pdp000000_genome_a_primer_00003_fwd', 12)]
+        blastfiles = []
+        for idx, (qid, length) in enumerate(hits):
+            blastfiles.append(os.path.join(self.outdir,
+                                           'batch_%03d.blasttab' % idx))
+            with open(blastfiles[-1], 'w') as ofh:
+                ofh.write('\t'.join([qid, 'target', '100.000', str(length),
+                                     '0', '0', '1', str(length), '1',
+                                     str(length), '0.1', '30.0']) + '\n')
+        outfiles = blast.demultiplex(blastfiles, self.pdpc, self.outdir)
+        assert_equal([os.path.basename(_) for _ in outfiles],
+                     ['genome_%s_primers.blasttab' % _ for _ in 'abc'])
+        with open(outfiles[0]) as ifh:
+            assert_equal([_.split('\t')[0] for _ in ifh],
+                         ['genome_a_primer_00001_fwd',
+                          'genome_a_primer_00003_fwd'])
+        assert_equal(os.path.getsize(outfiles[1]), 0)
+
+
+class TestScreenIndex(unittest.TestCase):
+
+    """Class defining tests of the built-in k-mer screen engine."""
+
+    def setUp(self):
+        """Set parameters for tests."""
+        self.datadir = os.path.join('tests', 'test_input', 'native')
+        self.dbfasta = os.path.join(self.datadir, 'genome_b.fasta')
+        self.indexdir = os.path.join('tests', 'test_output', 'blast',
+                                     'index')
+        primers = eprimer3.load_primer_table(
+            os.path.join(self.datadir, 'genome_a_named.json'))
+        self.queries = []
+        for primer in primers:
+            self.queries.append((primer.name + '_fwd', primer.forward_seq))
+            self.queries.append((primer.name + '_rev', primer.reverse_seq))
+
+    def test_index_reuse(self):
+        """k-mer screen index is built once, and reused."""
+        if os.path.isdir(self.indexdir):
+            shutil.rmtree(self.indexdir)
+        index = blast.ScreenIndex.open(self.dbfasta, self.indexdir)
+        stem = blast.ScreenIndex.index_stem(self.dbfasta, self.indexdir)
+        assert_equal((index.ids, len(index), index.seeds),
+                     (['genome_b'], 3000, blast.SCREEN_SEEDS))
+        mtime = os.stat(stem + '_kmers.npy').st_mtime_ns
+        blast.ScreenIndex.open(self.dbfasta, self.indexdir)
+        assert_equal(os.stat(stem + '_kmers.npy').st_mtime_ns, mtime)
+        # Different seeds need a different index
+        index = blast.ScreenIndex.open(self.dbfasta, self.indexdir,
+                                       ('11111111',))
+        assert_equal(index.seeds, ('11111111',))
+        assert_equal(os.path.basename(index._stem),
+                     'genome_b.fasta.pdpk_ff')
+
+    def test_search(self):
+        """k-mer screen reports ungapped hits in BLAST tabular format."""
+        index = blast.ScreenIndex.open(self.dbfasta, self.indexdir)
+        rows = index.search(self.queries)
+        assert_equal([_[:10] for _ in rows],
+                     [('genome_a_primer_00001_fwd', 'genome_b', 100., 20, 0,
+                       0, 1, 20, 1001, 1020),
+                      ('genome_a_primer_00001_rev', 'genome_b', 100., 20, 0,
+                       0, 1, 20, 1100, 1081),
+                      ('genome_a_primer_00002_fwd', 'genome_b', 95., 20, 1,
+                       0, 1, 20, 2120, 2101),
+                      ('genome_a_primer_00002_rev', 'genome_b', 100., 20, 0,
+                       0, 1, 20, 2001, 2020)])
+        # Hits below the identity threshold are not reported
+        assert_equal(len(index.search(self.queries, perc_identity=96)), 3)
+        # Extending candidates in small chunks gives the same rows
+        maxcandidates = blast.SCREEN_MAXCANDIDATES
+        try:
+            blast.SCREEN_MAXCANDIDATES = 1
+            assert_equal(index.search(self.queries), rows)
+        finally:
+            blast.SCREEN_MAXCANDIDATES = maxcandidates
+
+    def test_maxhits(self):
+        """k-mer screen warns when seeds with too many hits are ignored."""
+        index = blast.ScreenIndex.open(self.dbfasta, self.indexdir)
+        logger = logging.getLogger('test_blast')
+        with self.assertLogs(logger, 'WARNING') as logs:
+            assert_equal(index.search(self.queries, maxhits=0,
+                                      logger=logger), [])
+        assert 'were not extended' in logs.output[0]
+
+    def test_seeds(self):
+        """default seeds find imperfect alignments longer than maxaln."""
+        assert_equal(blast.screen_seedlen(), 6)
+        assert_equal(blast.screen_seedlen(perc_identity=100), 16)
+        assert_equal(blast.screen_seeds(), blast.SCREEN_SEEDS)
+        assert_equal(blast.screen_seeds(maxaln=20), blast.SCREEN_SEEDS)
+        # Shorter alignments need a shorter, contiguous seed
+        assert_equal(blast.screen_seeds(maxaln=10), ('11111',))
+        # An 18bp alignment with one central mismatch has no exact 11-mer
+        target = "GATTACAGGCCTTAGCAA"
+        query = target[:9] + "T" + target[10:]
+        dbfasta = os.path.join(self.indexdir, 'target.fasta')
+        os.makedirs(self.indexdir, exist_ok=True)
+        with open(dbfasta, 'w') as ofh:
+            ofh.write(">target\nTTTTTTTTTT%sTTTTTTTTTT\n" % target)
+        assert_equal(blast.ScreenIndex.open(dbfasta, self.indexdir,
+                                            ('1' * 11,)).search(
+                                                [('q', query)]), [])
+        rows = blast.ScreenIndex.open(dbfasta, self.indexdir).search(
+            [('q', query)])
+        assert_equal([_[3:5] for _ in rows], [(18, 1)])
+        # The diagonal of every 20bp alignment with two mismatches is found
+        target = "GATTACAGGCCTTAGCAACG"
+        with open(dbfasta, 'w') as ofh:
+            ofh.write(">target\nTTTTTTTTTT%sTTTTTTTTTT\n" % target)
+        queries = []
+        for first, second in itertools.combinations(range(20), 2):
+            query = list(target)
+            query[first] = 'T' if query[first] == 'A' else 'A'
+            query[second] = 'T' if query[second] == 'A' else 'A'
+            queries.append(('q%d_%d' % (first, second), ''.join(query)))
+        rows = blast.ScreenIndex.open(dbfasta, self.indexdir).search(
+            queries, perc_identity=0)
+        assert_equal({_[0] for _ in rows if _[8] - _[6] == 10},
+                     {_[0] for _ in queries})
+
+    def test_screen_output(self):
+        """k-mer screen output can be applied as a BLASTN screen."""
+        index = blast.ScreenIndex.open(self.dbfasta, self.indexdir)
+        outfname = os.path.join(self.indexdir, 'genome_a.blasttab')
+        blast.write_blasttab(index.search(self.queries), outfname)
+        assert_equal(blast.excluded_primers(outfname),
+                     {'genome_a_primer_00001', 'genome_a_primer_00002'})
+
+
+class TestScreen(unittest.TestCase):
+
+    """Class defining tests of applying a BLAST screen to primers."""
+
+    def setUp(self):
+        """Set parameters for tests."""
+        self.datadir = os.path.join('tests', 'test_input', 'eprimer3')
+        self.blastdir = os.path.join('tests', 'test_targets', 'blastscreen')
+        self.outdir = os.path.join('tests', 'test_output', 'blast')
+        os.makedirs(self.outdir, exist_ok=True)
+        self.primerjson = os.path.join(self.outdir,
+                                       'GCF_000011605.1_named.json')
+        shutil.copyfile(os.path.join(self.datadir,
+                                     'GCF_000011605.1_named.json'),
+                        self.primerjson)
+
+    def test_apply_screen(self):
+        """BLAST screen removes primer sets with long alignments."""
+        jsonpath = blast.apply_screen(
+            os.path.join(self.blastdir, 'GCF_000011605.1_primers.blasttab'),
+            self.primerjson)
+        for ext in ('.json', '.fasta'):
+            with open(os.path.splitext(jsonpath)[0] + ext) as ofh:
+                with open(os.path.join(
+                        self.datadir,
+                        'GCF_000011605.1_named_screened' + ext)) as tfh:
+                    if ext == '.json':
+                        assert_equal(json.load(ofh), json.load(tfh))
+                    else:
+                        assert_equal(ofh.read(), tfh.read())
+
+    def test_excluded_primers(self):
+        """BLAST screen excludes primer sets with any long alignment."""
+        blastfile = os.path.join(self.outdir, 'excluded.blasttab')
+        rows = [('set_1_fwd', 12), ('set_1_fwd', 20), ('set_1_fwd', 'NA'),
+                ('set_1_rev', 'NA'), ('set_2_fwd', 10), ('set_2_rev', 15),
+                ('set_3_int', 16)]
+        with open(blastfile, 'w') as ofh:
+            for qseqid, length in rows:
+                ofh.write('\t'.join([qseqid, 'target', '100.000',
+                                     str(length), '0', '0']) + '\n')
+        # Remaining hits for excluded primer sets are not parsed
+        assert_equal(blast.excluded_primers(blastfile, 15),
+                     {'set_1', 'set_3'})
+        assert_equal(blast.excluded_primers(blastfile, 9),
+                     {'set_1', 'set_2', 'set_3'})
+
+    def test_apply_alignments(self):
+        """Oligo alignments screen primer sets as BLAST output does."""
+        primers = eprimer3.load_primer_table(self.primerjson)
+        oligos = sorted(blast.primer_oligos([self.primerjson]))
+        seqs = {}
+        for primer in primers:
+            seqs.update({primer.name + '_fwd': primer.forward_seq,
+                         primer.name + '_rev': primer.reverse_seq,
+                         primer.name + '_int': primer.internal_seq})
+        # Rewrite the primer set screen as a screen of each oligo
+        blastfile = os.path.join(self.outdir, 'oligos.blasttab')
+        with open(os.path.join(
+                self.blastdir, 'GCF_000011605.1_primers.blasttab')) as ifh:
+            with open(blastfile, 'w') as ofh:
+                for line in ifh:
+                    qseqid, rest = line.split('\t', 1)
+                    ofh.write('\t'.join([blast.OLIGO_PREFIX %
+                                         oligos.index(seqs[qseqid]), rest]))
+        alignments = blast.oligo_alignments([blastfile], oligos)
+        assert_equal(set(alignments), set(oligos))
+        jsonpath = blast.apply_alignments(self.primerjson, alignments)
+        with open(os.path.join(self.datadir,
+                               'GCF_000011605.1_named_screened.json')) as tfh:
+            assert_equal(eprimer3.load_primer_table(jsonpath).to_dicts(),
+                         json.load(tfh))
+
+    def test_apply_screen_npz(self):
+        """BLAST screen of binary primer file writes binary output."""
+        npzfile = os.path.splitext(self.primerjson)[0] + '.npz'
+        eprimer3.write_primers(eprimer3.load_primer_table(self.primerjson),
+                               npzfile, 'npz')
+        outfile = blast.apply_screen(
+            os.path.join(self.blastdir, 'GCF_000011605.1_primers.blasttab'),
+            npzfile)
+        assert_equal(os.path.splitext(outfile)[-1], '.npz')
+        with open(os.path.join(self.datadir,
+                               'GCF_000011605.1_named_screened.json')) as tfh:
+            assert_equal(eprimer3.load_primer_table(outfile).to_dicts(),
+                         json.load(tfh))
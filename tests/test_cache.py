@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""test_cache.py
+
+Test caching of external tool output
+
+This test suite is intended to be run from the repository root using:
+
+nosetests -v
+
+(c) The James Hutton Institute 2018
+Author: Leighton Pritchard
+
+Contact:
+leighton.pritchard@hutton.ac.uk
+
+Leighton Pritchard,
+Information and Computing Sciences,
+James Hutton Institute,
+Errol Road,
+Invergowrie,
+Dundee,
+DD6 9LH,
+Scotland,
+UK
+
+The MIT License
+
+Copyright (c) 2018 The James Hutton Institute
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+
+import glob
+import logging
+import os
+import shutil
+import unittest
+
+from argparse import Namespace
+
+from nose.tools import (assert_equal, assert_false, assert_not_equal,
+                        assert_true)
+
+from diagnostic_primers import cache, primersearch
+from diagnostic_primers.scripts import tools
+
+
+class TestToolCache(unittest.TestCase):
+
+    """Class defining tests of the external tool result cache."""
+
+    def setUp(self):
+        """Set parameters for tests."""
+        self.outdir = os.path.join('tests', 'test_output', 'cache')
+        self.cachedir = os.path.join(self.outdir, 'cache')
+        self.infile = os.path.join(self.outdir, 'input.txt')
+        if os.path.isdir(self.outdir):
+            shutil.rmtree(self.outdir)
+        os.makedirs(self.outdir)
+        with open(self.infile, 'w') as ofh:
+            ofh.write("c\nb\na\n")
+
+        # Null logger for nosetests
+        self.logger = logging.getLogger('TestToolCache logger')
+        self.logger.addHandler(logging.NullHandler())
+
+    def sort_cmd(self, outfile, infile=None):
+        """Returns a command-line that sorts the input file."""
+        return "sort -o %s %s" % (os.path.join(self.outdir, outfile),
+                                  infile or self.infile)
+
+    def test_key_ignores_paths(self):
+        """cache key depends on input contents, not input/output paths."""
+        toolcache = cache.PDPToolCache(self.cachedir)
+        copyfile = os.path.join(self.outdir, 'copy.txt')
+        shutil.copyfile(self.infile, copyfile)
+        assert_equal(toolcache.key(self.sort_cmd('out1.txt')),
+                     toolcache.key(self.sort_cmd('out2.txt', copyfile)))
+        assert_equal(toolcache.outputs(self.sort_cmd('out1.txt')),
+                     [os.path.join(self.outdir, 'out1.txt')])
+
+    def test_key_input_contents(self):
+        """cache key changes when input contents change."""
+        toolcache = cache.PDPToolCache(self.cachedir)
+        key = toolcache.key(self.sort_cmd('out1.txt'))
+        with open(self.infile, 'a') as ofh:
+            ofh.write("d\n")
+        assert_not_equal(key, cache.PDPToolCache(self.cachedir).key(
+            self.sort_cmd('out1.txt')))
+
+    def test_key_commandline(self):
+        """cache key of Biopython command-lines ignores output path."""
+        toolcache = cache.PDPToolCache(self.cachedir)
+        clines = [primersearch.build_command('primersearch', self.infile,
+                                             self.infile, outfile, 10)
+                  for outfile in ('out1.ps', 'out2.ps')]
+        assert_equal(toolcache.key(clines[0]), toolcache.key(clines[1]))
+        assert_equal(toolcache.outputs(clines[1]), ['out2.ps'])
+        other = primersearch.build_command('primersearch', self.infile,
+                                           self.infile, 'out1.ps', 20)
+        assert_not_equal(toolcache.key(clines[0]), toolcache.key(other))
+
+    def test_store_restore(self):
+        """cached output is restored to a new location."""
+        toolcache = cache.PDPToolCache(self.cachedir)
+        assert_false(toolcache.restore(self.sort_cmd('out1.txt')))
+        os.system(self.sort_cmd('out1.txt'))
+        toolcache.store(self.sort_cmd('out1.txt'))
+        assert_true(toolcache.restore(self.sort_cmd('out2.txt')))
+        with open(os.path.join(self.outdir, 'out2.txt'), 'r') as ifh:
+            assert_equal(ifh.read(), "a\nb\nc\n")
+
+    def test_restore_copies(self):
+        """restored output can be rewritten without altering the cache."""
+        toolcache = cache.PDPToolCache(self.cachedir)
+        os.system(self.sort_cmd('out1.txt'))
+        toolcache.store(self.sort_cmd('out1.txt'))
+        assert_true(toolcache.restore(self.sort_cmd('out2.txt')))
+        with open(os.path.join(self.outdir, 'out2.txt'), 'w') as ofh:
+            ofh.write("rewritten\n")
+        assert_true(toolcache.restore(self.sort_cmd('out3.txt')))
+        with open(os.path.join(self.outdir, 'out3.txt'), 'r') as ifh:
+            assert_equal(ifh.read(), "a\nb\nc\n")
+
+    def test_restore_corrupt(self):
+        """cached output that doesn't match its digest is not restored."""
+        toolcache = cache.PDPToolCache(self.cachedir)
+        os.system(self.sort_cmd('out1.txt'))
+        toolcache.store(self.sort_cmd('out1.txt'))
+        entrydir = os.path.dirname(glob.glob(os.path.join(
+            self.cachedir, '*', '*', 'manifest.json'))[0])
+        with open(os.path.join(entrydir, 'output_0'), 'w') as ofh:
+            ofh.write("x\ny\nz\n")
+        assert_false(cache.PDPToolCache(self.cachedir).restore(
+            self.sort_cmd('out2.txt')))
+
+    def test_runparallel_cache(self):
+        """run_parallel_jobs skips jobs with cached output."""
+        args = Namespace(scheduler="multiprocessing", workers=2,
+                         verbose=False, cachedir=self.cachedir)
+        clines = [self.sort_cmd('out1.txt')]
+        tools.run_parallel_jobs(clines, args, self.logger)
+        os.remove(os.path.join(self.outdir, 'out1.txt'))
+        seen = []
+        assert_equal(tools.restore_cached_jobs(
+            clines, cache.PDPToolCache(self.cachedir), self.logger,
+            callback=lambda r: seen.append(r.args)), [])
+        assert_equal(seen, clines)
+        assert_true(os.path.isfile(os.path.join(self.outdir, 'out1.txt')))
+
+
+class TestScreenCache(unittest.TestCase):
+
+    """Class defining tests of the primer screen cache."""
+
+    def setUp(self):
+        """Set parameters for tests."""
+        self.outdir = os.path.join('tests', 'test_output', 'screencache')
+        self.cachefile = os.path.join(self.outdir, 'screen.sqlite')
+        self.dbfile = os.path.join('tests', 'test_input', 'native',
+                                   'genome_b.fasta')
+        if os.path.isdir(self.outdir):
+            shutil.rmtree(self.outdir)
+        os.makedirs(self.outdir)
+
+    def test_fingerprint_settings(self):
+        """screen fingerprint depends on screen settings."""
+        assert_equal(
+            cache.PDPScreenCache.fingerprint(self.dbfile, perc_identity=90),
+            cache.PDPScreenCache.fingerprint(self.dbfile, perc_identity=90))
+        assert_not_equal(
+            cache.PDPScreenCache.fingerprint(self.dbfile, perc_identity=90),
+            cache.PDPScreenCache.fingerprint(self.dbfile, perc_identity=80))
+
+    def test_store_lookup(self):
+        """screen cache returns stored alignments for the same screen."""
+        screencache = cache.PDPScreenCache(self.cachefile)
+        screencache.store({'ACGT': 4, 'GGCC': 0}, 'screen1')
+        screencache.close()
+        screencache = cache.PDPScreenCache(self.cachefile)
+        assert_equal(screencache.lookup(['ACGT', 'GGCC', 'TTTT'], 'screen1'),
+                     {'ACGT': 4, 'GGCC': 0})
+        assert_equal(screencache.lookup(['ACGT'], 'screen2'), {})
+
+    def test_lru_eviction(self):
+        """screen cache removes least recently used entries."""
+        screencache = cache.PDPScreenCache(self.cachefile, maxsize=2)
+        screencache.store({'AAAA': 1, 'CCCC': 2}, 'screen1')
+        screencache.lookup(['AAAA'], 'screen1')
+        screencache.store({'GGGG': 3}, 'screen1')
+        assert_equal(len(screencache), 2)
+        assert_equal(
+            screencache.lookup(['AAAA', 'CCCC', 'GGGG'], 'screen1'),
+            {'AAAA': 1, 'GGGG': 3})
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""test_contigs.py
+
+Test the ContigIndex class for locating contigs in stitched sequences
+
+This test suite is intended to be run from the repository root using:
+
+nosetests -v
+
+(c) The James Hutton Institute 2018
+Author: Leighton Pritchard
+
+Contact:
+leighton.pritchard@hutton.ac.uk
+
+Leighton Pritchard,
+Information and Computing Sciences,
+James Hutton Institute,
+Errol Road,
+Invergowrie,
+Dundee,
+DD6 9LH,
+Scotland,
+UK
+
+The MIT License
+
+Copyright (c) 2018 The James Hutton Institute
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+
+import os
+import shutil
+import unittest
+
+from diagnostic_primers.config import PDPCollection
+from diagnostic_primers.contigs import ContigIndex
+
+from nose.tools import assert_equal, raises
+
+
+class TestContigIndex(unittest.TestCase):
+
+    """Class defining tests of the ContigIndex object."""
+
+    def setUp(self):
+        """Set parameters for tests."""
+        self.outdir = os.path.join('tests', 'test_output', 'contigs')
+        os.makedirs(self.outdir, exist_ok=True)
+        self.offsets = [('contig_1', 0, 30), ('contig_2', 72, 88),
+                        ('contig_3', 130, 144), ('contig_4', 186, 196)]
+        self.index = ContigIndex(self.offsets)
+
+    def test_locate(self):
+        """ContigIndex maps stitched coordinates to contigs."""
+        assert_equal(self.index.locate(0), ('contig_1', 0))
+        assert_equal(self.index.locate(29), ('contig_1', 29))
+        assert_equal(self.index.locate(72), ('contig_2', 0))
+        assert_equal(self.index.locate(195), ('contig_4', 9))
+        for position in (-1, 30, 71, 196):  # spacers and outside
+            assert_equal(self.index.locate(position), None)
+
+    def test_spans_junction(self):
+        """ContigIndex identifies regions spanning contig junctions."""
+        assert not self.index.spans_junction(0, 30)
+        assert not self.index.spans_junction(75, 85)
+        assert self.index.spans_junction(20, 40)  # runs into spacer
+        assert self.index.spans_junction(25, 80)  # spans two contigs
+        assert self.index.spans_junction(40, 80)  # starts in spacer
+
+    def test_unsorted(self):
+        """ContigIndex sorts contigs by location."""
+        assert_equal(list(ContigIndex(reversed(self.offsets))), self.offsets)
+
+    @raises(ValueError)
+    def test_overlap(self):
+        """ContigIndex errors with overlapping contigs."""
+        ContigIndex([('contig_1', 0, 30), ('contig_2', 20, 40)])
+
+    def test_write_read(self):
+        """ContigIndex writes to and reads from file."""
+        fname = os.path.join(self.outdir, 'index.offsets')
+        self.index.write(fname)
+        assert_equal(ContigIndex.from_file(fname), self.index)
+
+    def test_config_json(self):
+        """Contig offset index path is kept in JSON config files."""
+        seqfile = os.path.join(self.outdir, 'multi.fasta')
+        shutil.copyfile(os.path.join('tests', 'test_input', 'native',
+                                     'multi.fasta'), seqfile)
+        coll = PDPCollection()
+        coll.add_data('multi', 'group1', seqfile, None, None, None)
+        coll.data[0].fix_sequences()
+        fname = os.path.join(self.outdir, 'stitched.json')
+        coll.write_json(fname)
+        newcoll = PDPCollection()
+        newcoll.from_json(fname)
+        assert_equal(newcoll.data[0].offsets,
+                     os.path.join(self.outdir, 'multi_concat_noambig.offsets'))
+        assert_equal(newcoll.data[0].contig_index, ContigIndex(self.offsets))
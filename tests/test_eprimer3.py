@@ -53,10 +53,12 @@ import subprocess
 import sys
 import unittest
 
+from Bio import SeqIO
 from Bio.Emboss import Primer3
-from nose.tools import assert_equal
+from nose.tools import assert_equal, assert_true, raises
 
 from diagnostic_primers import (eprimer3, config)
+from diagnostic_primers.contigs import ContigIndex
 
 
 def ordered(obj):
@@ -232,3 +234,202 @@ class TestParsing(unittest.TestCase):
         with open(outfname, 'r') as wfh:
             with open(self.fastaprimerfile, 'r') as tfh:
                 assert_equal(wfh.read(), tfh.read())
+
+
+class TestPrimerTable(unittest.TestCase):
+
+    """Class defining tests of the compact PrimerTable representation."""
+
+    def setUp(self):
+        """Set parameters for tests."""
+        self.datadir = os.path.join('tests', 'test_input', 'eprimer3')
+        self.outdir = os.path.join('tests', 'test_output', 'eprimer3')
+        os.makedirs(self.outdir, exist_ok=True)
+        self.jsonprimerfile = os.path.join(self.datadir,
+                                           "GCF_000011605.1_named.json")
+        self.primers = eprimer3.load_primers(self.jsonprimerfile, fmt="json")
+
+    def test_from_json(self):
+        """PrimerTable loads the same data as load_primers()."""
+        table = eprimer3.PrimerTable.from_json(self.jsonprimerfile)
+        assert_equal(len(table), len(self.primers))
+        for record, primer in zip(table, self.primers):
+            assert_equal(record.to_dict(), primer.__dict__)
+            assert_equal(record.forward_seq, primer.forward_seq)
+            assert_equal(record.reverse_start, primer.reverse_start)
+        assert_equal(ordered(table.to_primers()), ordered(self.primers))
+
+    def test_from_primers(self):
+        """PrimerTable converts from Primer3.Primers objects."""
+        table = eprimer3.PrimerTable.from_primers(self.primers)
+        with open(self.jsonprimerfile, 'r') as ifh:
+            assert_equal(table.to_dicts(), json.load(ifh))
+
+    def test_write_primers(self):
+        """PrimerTable writes the same files as Primer3.Primers."""
+        table = eprimer3.PrimerTable.from_json(self.jsonprimerfile)
+        for fmt in ('json', 'ep3', 'tsv', 'fasta'):
+            outfiles = [os.path.join(self.outdir, "table_%s.%s" %
+                                     (name, fmt)) for name in ('a', 'b')]
+            eprimer3.write_primers(table, outfiles[0], fmt)
+            eprimer3.write_primers(self.primers, outfiles[1], fmt)
+            with open(outfiles[0]) as ofh1, open(outfiles[1]) as ofh2:
+                assert_equal(ofh1.read().replace(outfiles[0], ''),
+                             ofh2.read().replace(outfiles[1], ''))
+
+    def test_select(self):
+        """PrimerTable rows are selected by mask and primer name."""
+        table = eprimer3.PrimerTable.from_json(self.jsonprimerfile)
+        subset = table.select([idx % 2 == 0 for idx in range(len(table))])
+        assert_equal(subset.names, table.names[::2])
+        name = subset.names[-1]
+        assert_equal(table[table.row(name)].name, name)
+        assert_equal(table[-1].name, table.names[-1])
+
+    def test_large_coordinates(self):
+        """PrimerTable holds positions beyond 2^31 without overflow."""
+        start = 3 * 2 ** 31
+        table = eprimer3.PrimerTable.from_dicts([{'name': 'big',
+                                                  'forward_start': start,
+                                                  'reverse_start': start + 99,
+                                                  'size': 100}])
+        assert_equal((table[0].forward_start, table[0].reverse_start),
+                     (start, start + 99))
+
+    @raises(AttributeError)
+    def test_record_attribute(self):
+        """PrimerRecord raises AttributeError for unknown fields."""
+        table = eprimer3.PrimerTable.from_json(self.jsonprimerfile)
+        table[0].not_a_field
+
+    def test_memory(self):
+        """PrimerTable is smaller than the equivalent Primers objects."""
+        table = eprimer3.PrimerTable.from_json(self.jsonprimerfile)
+        objsize = sum(sys.getsizeof(primer) + sys.getsizeof(primer.__dict__) +
+                      sum(sys.getsizeof(_) for _ in primer.__dict__.values())
+                      for primer in self.primers)
+        assert_true(table.nbytes * 3 < objsize)
+
+    def test_npz_roundtrip(self):
+        """PrimerTable round-trips through the binary npz format."""
+        outfname = os.path.join(self.outdir, "GCF_000011605.1_named.npz")
+        eprimer3.write_primers(self.primers, outfname, 'npz')
+        primers = eprimer3.load_primers(outfname, fmt='npz')
+        with open(self.jsonprimerfile, 'r') as ifh:
+            assert_equal([vars(_) for _ in primers], json.load(ifh))
+        assert_equal(eprimer3.load_primer_table(outfname).names,
+                     eprimer3.load_primer_table(self.jsonprimerfile).names)
+
+    def test_npz_lazy(self):
+        """PrimerTable reads npz columns only when used."""
+        outfname = os.path.join(self.outdir, "GCF_000011605.1_named.npz")
+        eprimer3.write_primers(self.primers, outfname, 'npz')
+        table = eprimer3.PrimerTable.from_npz(outfname)
+        names = [primer.name for primer in table]
+        assert_equal(sorted(table._columns.keys()), ['name'])
+        starts = [primer.forward_start for primer in table]
+        assert_equal(sorted(table._columns.keys()), ['forward_start', 'name'])
+        assert_equal((names, starts),
+                     ([_.name for _ in self.primers],
+                      [_.forward_start for _ in self.primers]))
+
+
+    @unittest.skipUnless(os.path.isdir('/proc/self/fd'),
+                         "requires /proc to count open files")
+    def test_npz_closed(self):
+        """PrimerTables read from npz files don't hold the file open."""
+        outfname = os.path.join(self.outdir, "GCF_000011605.1_named.npz")
+        eprimer3.write_primers(self.primers, outfname, 'npz')
+        fdcount = len(os.listdir('/proc/self/fd'))
+        tables = [eprimer3.PrimerTable.from_npz(outfname) for _ in range(50)]
+        records = [table[0] for table in tables if table[0].name]
+        assert_equal(len(records), 50)
+        assert_equal(len(os.listdir('/proc/self/fd')), fdcount)
+
+
+class TestJunctionFilter(unittest.TestCase):
+
+    """Class defining tests of filtering primers spanning contig junctions."""
+
+    def setUp(self):
+        """Set parameters for tests."""
+        self.jsonprimerfile = os.path.join('tests', 'test_input', 'eprimer3',
+                                           "GCF_000011605.1_named.json")
+        # Products of primers 00001 and 00002 run past the end of a contig;
+        # the product of primer 00003 starts on the first base of a contig
+        self.contigs = ContigIndex([('contig_1', 0, 59064),
+                                    ('contig_2', 118225, 1264800),
+                                    ('contig_3', 1264842, 5000000)])
+        self.removed = ['GCF_000011605.1_primer_00001',
+                        'GCF_000011605.1_primer_00002']
+
+    def test_filter_table(self):
+        """filter_junction_primers() removes primers spanning junctions."""
+        table = eprimer3.load_primer_table(self.jsonprimerfile)
+        kept = eprimer3.filter_junction_primers(table, self.contigs)
+        assert_equal(kept.names,
+                     [_ for _ in table.names if _ not in self.removed])
+
+    def test_filter_primers(self):
+        """filter_junction_primers() accepts Primer3.Primers objects."""
+        primers = eprimer3.load_primers(self.jsonprimerfile, fmt="json")
+        kept = eprimer3.filter_junction_primers(primers, self.contigs)
+        assert_equal(kept.names, [_.name for _ in primers if
+                                  _.name not in self.removed])
+
+
+class TestWindows(unittest.TestCase):
+
+    """Class defining tests of primer design to sequence windows."""
+
+    def setUp(self):
+        """Set parameters for tests."""
+        self.datadir = os.path.join('tests', 'test_input', 'native')
+        self.outdir = os.path.join('tests', 'test_output', 'eprimer3')
+        os.makedirs(self.outdir, exist_ok=True)
+        self.seqfile = os.path.join(self.datadir, 'genome_a.fasta')
+        self.primers = eprimer3.load_primers(
+            os.path.join(self.datadir, 'genome_a_named.json'), fmt='json')
+        self.stem = os.path.join(self.outdir, 'genome_a')
+
+    def test_write_windows(self):
+        """write_windows() covers the sequence with overlapping windows."""
+        windows = eprimer3.write_windows(self.seqfile, self.stem, 1200, 600)
+        assert_equal([_[1] for _ in windows], [0, 600, 1200, 1800])
+        seq = SeqIO.read(self.seqfile, 'fasta').seq
+        for fname, offset in windows:
+            assert_equal(SeqIO.read(fname, 'fasta').seq,
+                         seq[offset:offset + 1200])
+
+    @raises(ValueError)
+    def test_window_overlap(self):
+        """write_windows() errors if overlap is not smaller than window."""
+        eprimer3.write_windows(self.seqfile, self.stem, 200, 200)
+
+    def test_merge_window_primers(self):
+        """merge_window_primers() translates and deduplicates primers."""
+        # Write the primers lying within each window as ePrimer3 would
+        windows = []
+        for fname, offset in eprimer3.write_windows(self.seqfile, self.stem,
+                                                    1200, 600):
+            inwindow = []
+            for primer in eprimer3.load_primers(
+                    os.path.join(self.datadir, 'genome_a_named.json'),
+                    fmt='json'):
+                if (primer.forward_start > offset and
+                        primer.reverse_start + primer.reverse_length - 1 <=
+                        offset + 1200):
+                    primer.forward_start -= offset
+                    primer.reverse_start -= offset
+                    inwindow.append(primer)
+            ep3file = os.path.splitext(fname)[0] + '.eprimer3'
+            eprimer3.write_primers(inwindow, ep3file, fmt='ep3')
+            windows.append((ep3file, offset))
+        merged = eprimer3.merge_window_primers(windows,
+                                               self.stem + '.eprimer3')
+        assert_equal([(_.forward_start, _.forward_seq, _.reverse_start,
+                       _.reverse_seq) for _ in merged],
+                     [(_.forward_start, _.forward_seq, _.reverse_start,
+                       _.reverse_seq) for _ in self.primers])
+        assert_equal([_.name for _ in merged],
+                     ['genome_a_primer_%05d' % idx for idx in range(1, 4)])
@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""test_extract.py
+
+Test amplicon extraction from source genomes and primersearch output.
+
+This test suite is intended to be run from the repository root using:
+
+nosetests -v
+
+(c) The James Hutton Institute 2018
+Author: Leighton Pritchard
+
+Contact:
+leighton.pritchard@hutton.ac.uk
+
+Leighton Pritchard,
+Information and Computing Sciences,
+James Hutton Institute,
+Errol Road,
+Invergowrie,
+Dundee,
+DD6 9LH,
+Scotland,
+UK
+
+The MIT License
+
+Copyright (c) 2018 The James Hutton Institute
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+
+import os
+import time
+import unittest
+
+from Bio import SeqIO
+from Bio.Emboss.Primer3 import Primers
+from nose.tools import assert_equal, raises
+
+from diagnostic_primers import (config, eprimer3, extract)
+
+
+class TestExtract(unittest.TestCase):
+
+    """Class defining tests of amplicon extraction."""
+
+    def setUp(self):
+        """Set parameters for tests."""
+        self.config = os.path.join('tests', 'test_input', 'config',
+                                   'testnative_ps.json')
+        self.outdir = os.path.join('tests', 'test_output', 'extract_native')
+        self.targetdir = os.path.join('tests', 'test_targets',
+                                      'extract_native')
+        os.makedirs(self.outdir, exist_ok=True)
+        self.coll = config.PDPCollection()
+        self.coll.from_json(self.config)
+        self.primers = []
+        for genome in self.coll.data:
+            self.primers.extend(eprimer3.load_primers(genome.primers,
+                                                      fmt='json'))
+
+    def test_extract_amplicons(self):
+        """amplicons extracted from target and source genomes."""
+        amplicons = extract.extract_amplicons('test', self.primers,
+                                              self.coll)
+        outfname = os.path.join(self.outdir, 'amplicons.fasta')
+        SeqIO.write([_.seq for _ in sorted(amplicons, key=lambda a: a.name)],
+                    outfname, 'fasta')
+        with open(outfname) as ofh:
+            with open(os.path.join(self.targetdir, 'amplicons.fasta')) as tfh:
+                assert_equal(ofh.read(), tfh.read())
+
+    def test_index_primersearch(self):
+        """primersearch output is indexed by primer name."""
+        index = extract.index_primersearch(self.coll, ['genome_a'])
+        assert_equal(sorted(index.keys()),
+                     ['genome_a_primer_00001', 'genome_a_primer_00002'])
+        assert_equal([_[0] for _ in index['genome_a_primer_00002']],
+                     ['genome_b'])
+
+    def test_genome_store(self):
+        """genome store returns same subsequences as SeqIO."""
+        store = extract.PDPGenomeStore(self.coll)
+        for genome in self.coll.data:
+            record = SeqIO.read(genome.seqfile, 'fasta')
+            assert_equal(store.length(genome.name), len(record))
+            for start, end in ((0, 10), (55, 185), (2950, 3000)):
+                assert_equal(str(store.fetch(genome.name, start, end).seq),
+                             str(record.seq[start:end]))
+        store.close()
+
+    def test_genome_store_irregular(self):
+        """genome store falls back to SeqIO for irregular FASTA."""
+        record = SeqIO.read(self.coll.data[0].seqfile, 'fasta')
+        seqfile = os.path.join(self.outdir, 'irregular.fasta')
+        with open(seqfile, 'w') as ofh:
+            ofh.write(">irregular\n%s\n%s\n" % (record.seq[:25],
+                                                record.seq[25:]))
+        coll = config.PDPCollection()
+        coll.add_data('irregular', 'test', seqfile, None, None, None)
+        store = extract.PDPGenomeStore(coll)
+        assert_equal(str(store.fetch('irregular', 20, 40).seq),
+                     str(record.seq[20:40]))
+        store.close()
+
+
+class TestAmpliconCollection(unittest.TestCase):
+
+    """Class defining tests of the PDPAmpliconCollection object."""
+
+    def setUp(self):
+        """Set parameters for tests."""
+        self.primers = [Primers() for _ in range(1000)]
+        for idx, primer in enumerate(self.primers):
+            primer.name = "genome_primer_%05d" % idx
+        self.targets = ["genome_%02d" % _ for _ in range(100)]
+
+    def test_new_amplicon(self):
+        """amplicons are indexed by primer and target on creation."""
+        amplicons = extract.PDPAmpliconCollection('test')
+        amplicons.new_amplicon('amp_1', self.primers[0], None, None, None,
+                               self.targets[0])
+        amplicons.new_amplicon('amp_2', self.primers[0], None, None, None,
+                               self.targets[1])
+        amplicons.new_amplicon('amp_3', self.primers[1], None, None, None,
+                               self.targets[1])
+        assert_equal(sorted([_.name for _ in amplicons.get_primer_amplicons(
+            self.primers[0].name)]), ['amp_1', 'amp_2'])
+        assert_equal(sorted([_.name for _ in amplicons.get_target_amplicons(
+            self.targets[1])]), ['amp_2', 'amp_3'])
+        assert_equal(amplicons.get_primer_amplicons('missing'), [])
+
+    @raises(extract.PDPAmpliconError)
+    def test_add_many_duplicate(self):
+        """bulk insertion rejects duplicate amplicon names."""
+        amplicons = extract.PDPAmpliconCollection('test')
+        amplicons.new_amplicon('amp_1', self.primers[0], None, None, None)
+        amplicons.add_many([('amp_2', self.primers[0], None, None, None),
+                            ('amp_1', self.primers[1], None, None, None)])
+
+    def test_add_many_benchmark(self):
+        """100,000 amplicons are ingested in bulk in seconds."""
+        data = (("amp_%06d" % idx, self.primers[idx % 1000], None, None,
+                 None, self.targets[idx % 100]) for idx in range(100000))
+        amplicons = extract.PDPAmpliconCollection('test')
+        time0 = time.time()
+        amplicons.add_many(data)
+        elapsed = time.time() - time0
+        assert_equal(len(amplicons), 100000)
+        assert_equal(len(amplicons.primer_amplicons), 1000)
+        assert_equal(len(amplicons.get_target_amplicons(self.targets[0])),
+                     1000)
+        assert elapsed < 10, "Ingesting 100k amplicons took %.2fs" % elapsed
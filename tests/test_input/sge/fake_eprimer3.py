@@ -0,0 +1,28 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""fake_eprimer3.py
+
+Stand-in for EMBOSS ePrimer3, used to test SGE pipeline runs without
+EMBOSS.
+
+Usage: fake_eprimer3.py [ePrimer3 options] -sequence=<SEQFILE>
+       -outfile=<OUTFILE>
+
+The primers in tests/test_input/native/<SEQSTEM>_named.json are written to
+OUTFILE in ePrimer3 format; all other options are ignored.
+"""
+
+import os
+import sys
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..',
+                    '..')
+sys.path.insert(0, ROOT)
+
+from diagnostic_primers import eprimer3  # noqa: E402
+
+opts = dict(_.lstrip('-').split('=', 1) for _ in sys.argv[1:] if '=' in _)
+stem = os.path.splitext(os.path.split(opts['sequence'])[-1])[0]
+primers = eprimer3.load_primer_table(os.path.join(
+    ROOT, 'tests', 'test_input', 'native', '%s_named.json' % stem))
+eprimer3.write_primers(primers, opts['outfile'], fmt='ep3')
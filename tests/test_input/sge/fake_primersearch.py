@@ -0,0 +1,34 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""fake_primersearch.py
+
+Stand-in for EMBOSS primersearch, used to test SGE pipeline runs without
+EMBOSS.
+
+Usage: fake_primersearch.py -infile=<PRIMERFILE> -seqall=<SEQFILE>
+       -outfile=<OUTFILE> -mismatchpercent=<PERCENT> [options]
+
+The primers in PRIMERFILE are searched against SEQFILE with the built-in
+primer search engine, and the results written to OUTFILE in primersearch
+format.
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', '..', '..'))
+
+from Bio import SeqIO  # noqa: E402
+
+from diagnostic_primers import eprimer3, primersearch  # noqa: E402
+
+opts = dict(_.lstrip('-').split('=', 1) for _ in sys.argv[1:] if '=' in _)
+with open(opts['infile'], 'r') as ifh:
+    rows = [_.split() for _ in ifh if _.strip()]
+primers = eprimer3.PrimerTable.from_dicts(
+    {'name': _[0], 'forward_seq': _[1], 'reverse_seq': _[2]} for _ in rows)
+indexes = [primersearch.PrimerSearchIndex(_) for _ in
+           SeqIO.parse(opts['seqall'], 'fasta')]
+primersearch.write_output(primersearch.search_target(
+    primers, indexes, int(float(opts['mismatchpercent']))), opts['outfile'])
@@ -0,0 +1,40 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""fake_qstat.py
+
+Stand-in for SGE's qstat, used to test job status polling without a
+scheduler.
+
+Usage: fake_qstat.py <STATEFILE> -xml
+
+STATEFILE is a JSON file describing queued jobs as a dictionary keyed by
+job name, with values [state, polls]: the job is reported in the SGE state
+given for that many calls, after which it is no longer listed (i.e. it
+has finished). Every call is counted in the "calls" entry of the file.
+"""
+
+import json
+import sys
+
+statefile = sys.argv[1]
+with open(statefile) as ifh:
+    data = json.load(ifh)
+data['calls'] = data.get('calls', 0) + 1
+
+joblists = []
+for number, (name, (state, polls)) in enumerate(sorted(data['jobs'].items()),
+                                                1):
+    if polls > 0:
+        data['jobs'][name] = [state, polls - 1]
+        joblists.append("    <job_list state=\"%s\">\n"
+                        "      <JB_job_number>%d</JB_job_number>\n"
+                        "      <JB_name>%s</JB_name>\n"
+                        "      <state>%s</state>\n"
+                        "    </job_list>" %
+                        ('running' if state == 'r' else 'pending',
+                         number, name, state))
+
+with open(statefile, 'w') as ofh:
+    json.dump(data, ofh)
+print("<?xml version='1.0'?>\n<job_info>\n  <queue_info>\n%s\n  </queue_info>"
+      "\n  <job_info>\n  </job_info>\n</job_info>" % '\n'.join(joblists))
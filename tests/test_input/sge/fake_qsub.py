@@ -0,0 +1,29 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""fake_qsub.py
+
+Stand-in for SGE's qsub, used to test job submission without a scheduler.
+
+Usage: fake_qsub.py <LOGFILE> [qsub options] <SCRIPT>
+
+The job script is run immediately, once per task (as given by -t 1:N),
+with SGE_TASK_ID set as SGE would set it. The qsub command-line is
+appended to LOGFILE.
+"""
+
+import os
+import subprocess
+import sys
+
+logfile, args = sys.argv[1], sys.argv[2:]
+with open(logfile, 'a') as ofh:
+    ofh.write(' '.join(args) + '\n')
+
+tasks = ['undefined']
+if '-t' in args:
+    ntasks = int(args[args.index('-t') + 1].split(':')[-1])
+    tasks = [str(_) for _ in range(1, ntasks + 1)]
+for task in tasks:
+    env = dict(os.environ, SGE_TASK_ID=task)
+    subprocess.run(['bash', args[-1]], env=env,
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""test_multiprocessing.py
+
+Test running command-line jobs with the multiprocessing scheduler
+
+This test suite is intended to be run from the repository root using:
+
+nosetests -v
+
+(c) The James Hutton Institute 2018
+Author: Leighton Pritchard
+
+Contact:
+leighton.pritchard@hutton.ac.uk
+
+Leighton Pritchard,
+Information and Computing Sciences,
+James Hutton Institute,
+Errol Road,
+Invergowrie,
+Dundee,
+DD6 9LH,
+Scotland,
+UK
+
+The MIT License
+
+Copyright (c) 2018 The James Hutton Institute
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+
+import logging
+import time
+import unittest
+
+from argparse import Namespace
+
+from nose.tools import assert_equal, assert_true, raises
+
+from diagnostic_primers import multiprocessing
+from diagnostic_primers.scripts import tools
+
+
+class TestMultiprocessing(unittest.TestCase):
+
+    """Class defining tests of the multiprocessing job runner."""
+
+    def setUp(self):
+        """Set parameters for tests."""
+        # Jobs finish in the reverse of the order in which they are passed
+        self.clines = ["sleep %.1f; echo %d" % (0.2 * (3 - idx), idx)
+                       for idx in range(4)]
+
+        # Null logger for nosetests
+        self.logger = logging.getLogger('TestMultiprocessing logger')
+        self.logger.addHandler(logging.NullHandler())
+
+    def test_run(self):
+        """run() returns results in the order commands were passed."""
+        results = multiprocessing.run(self.clines, workers=4)
+        assert_equal([r.args for r in results], self.clines)
+        assert_equal([r.stdout for r in results],
+                     [b"0\n", b"1\n", b"2\n", b"3\n"])
+
+    def test_run_iter(self):
+        """run_iter() yields results as jobs finish."""
+        results = list(multiprocessing.run_iter(self.clines, workers=4))
+        assert_equal([r.stdout for r in results],
+                     [b"3\n", b"2\n", b"1\n", b"0\n"])
+
+    def test_run_callback(self):
+        """run() calls callback with each result as it finishes."""
+        seen = []
+        multiprocessing.run(self.clines, workers=4,
+                            callback=lambda r: seen.append(r.stdout))
+        assert_equal(seen, [b"3\n", b"2\n", b"1\n", b"0\n"])
+
+    def test_run_timeout(self):
+        """jobs exceeding the timeout are killed."""
+        start = time.time()
+        results = multiprocessing.run(["sleep 10", "echo done"], workers=2,
+                                      timeout=0.5)
+        assert_true(time.time() - start < 5)
+        assert_equal([r.returncode for r in results],
+                     [multiprocessing.KILLED, 0])
+
+    def test_run_failfast(self):
+        """failfast cancels queued and running jobs after a failure."""
+        clines = ["sleep 10", "exit 3"] + ["echo %d" % idx for
+                                           idx in range(10)]
+        start = time.time()
+        results = list(multiprocessing.run_iter(clines, workers=2,
+                                                failfast=True))
+        assert_true(time.time() - start < 5)
+        assert_equal(results[-1].returncode, 3)
+        assert_true(len(results) < len(clines))
+
+    def test_runparallel_callback(self):
+        """run_parallel_jobs passes each successful result to callback."""
+        seen = []
+        args = Namespace(scheduler="multiprocessing", workers=2,
+                         verbose=False)
+        tools.run_parallel_jobs(self.clines, args, self.logger,
+                                callback=lambda r: seen.append(r.args))
+        assert_equal(sorted(seen), sorted(self.clines))
+
+    @raises(SystemExit)
+    def test_runparallel_failfast(self):
+        """run_parallel_jobs exits on first failure with failfast."""
+        args = Namespace(scheduler="multiprocessing", workers=2,
+                         verbose=False, timeout=None, failfast=True)
+        tools.run_parallel_jobs(["sleep 10", "exit 1"], args, self.logger)
@@ -48,11 +48,17 @@ THE SOFTWARE.
 """
 
 import os
+import re
+import shutil
 import unittest
 
-from diagnostic_primers.config import PDPData
+from diagnostic_primers.config import (AMBIGUITIES, PDPData,
+                                       profile_sequences,
+                                       write_fixed_sequences)
 
 from Bio import SeqIO
+from Bio.Seq import Seq
+from Bio.SeqRecord import SeqRecord
 from nose.tools import assert_equal, raises
 
 
@@ -180,3 +186,156 @@ class TestPDPData(unittest.TestCase):
         """PDPData errors because name is not/cannot be a string."""
         PDPData(self.badname, self.groups_str, self.seqfile,
                 self.features, self.primers, self.primersearch)
+
+
+class TestSequenceProfile(unittest.TestCase):
+
+    """Class defining tests of single-pass sequence file profiling."""
+
+    def setUp(self):
+        """Set parameters for tests."""
+        self.datadir = os.path.join('tests', 'test_input', 'native')
+        self.outdir = os.path.join('tests', 'test_output', 'pdpdata')
+        os.makedirs(self.outdir, exist_ok=True)
+        self.multifile = os.path.join(self.datadir, 'multi.fasta')
+        self.singlefile = os.path.join(self.datadir, 'genome_a.fasta')
+
+    def test_profile(self):
+        """profile_sequences() summarises multi-sequence FASTA."""
+        profile = profile_sequences(self.multifile)
+        assert_equal(profile.names,
+                     [s.id for s in SeqIO.parse(self.multifile, 'fasta')])
+        assert_equal(profile.lengths,
+                     [len(s) for s in SeqIO.parse(self.multifile, 'fasta')])
+        assert_equal(profile.ambiguities, [2, 0, 0, 2])
+        # N runs are reported across line breaks, and in lower case
+        assert_equal(profile.nruns, [((4, 9), (17, 22)), ((0, 4), ),
+                                     ((0, 14), ), ()])
+        assert_equal(profile.gc, [10, 4, 0, 4])
+        assert_equal(profile.total_length, 70)
+        assert profile.has_ambiguities
+
+    def test_digest_ignores_wrapping(self):
+        """profile_sequences() digest does not depend on line length."""
+        outfname = os.path.join(self.outdir, 'multi_unwrapped.fasta')
+        with open(outfname, 'w') as ofh:
+            for record in SeqIO.parse(self.multifile, 'fasta'):
+                ofh.write('>%s\n%s\n' % (record.id, record.seq))
+        assert_equal(profile_sequences(outfname).digest,
+                     profile_sequences(self.multifile).digest)
+
+    def test_pdpdata_properties(self):
+        """PDPData properties are served from the sequence profile."""
+        gdata = PDPData('multi', 'group1', self.multifile, None, None, None)
+        assert_equal(gdata.seqnames, gdata.profile.names)
+        assert gdata.needs_stitch
+        assert gdata.has_ambiguities
+        gdata = PDPData('genome_a', 'group1', self.singlefile,
+                        None, None, None)
+        assert not gdata.needs_stitch
+        assert not gdata.has_ambiguities
+
+    def test_profile_invalidated(self):
+        """PDPData profile is recalculated when the sequence file changes."""
+        seqfile = os.path.join(self.outdir, 'profile_invalidated.fasta')
+        shutil.copyfile(self.singlefile, seqfile)
+        gdata = PDPData('genome_a', 'group1', seqfile, None, None, None)
+        profile = gdata.profile
+        assert gdata.profile is profile  # cached
+        with open(seqfile, 'a') as ofh:
+            ofh.write('>extra\nACGTRY\n')
+        assert gdata.profile is not profile
+        assert_equal(gdata.seqnames, ['genome_a', 'extra'])
+        assert gdata.has_ambiguities
+
+
+class TestFixSequences(unittest.TestCase):
+
+    """Class defining tests of stitching and ambiguity replacement."""
+
+    def setUp(self):
+        """Set parameters for tests."""
+        self.outdir = os.path.join('tests', 'test_output', 'pdpdata')
+        self.targetdir = os.path.join('tests', 'test_targets', 'pdpdata')
+        os.makedirs(self.outdir, exist_ok=True)
+        self.seqfile = os.path.join(self.outdir, 'multi.fasta')
+        shutil.copyfile(os.path.join('tests', 'test_input', 'native',
+                                     'multi.fasta'), self.seqfile)
+        self.offsets = [('contig_1', 0, 30), ('contig_2', 72, 88),
+                        ('contig_3', 130, 144), ('contig_4', 186, 196)]
+
+    def assert_target(self, fname):
+        """Assert output file matches target file of same name."""
+        with open(os.path.join(self.outdir, fname), 'r') as ifh:
+            with open(os.path.join(self.targetdir, fname), 'r') as ofh:
+                assert_equal(ifh.read(), ofh.read())
+
+    def test_stitch(self):
+        """PDPData stitches sequences, and records their offsets."""
+        gdata = PDPData('multi', 'group1', self.seqfile, None, None, None)
+        gdata.stitch()
+        self.assert_target('multi_concat.fas')
+        assert_equal(list(gdata.contig_index), self.offsets)
+        assert not gdata.needs_stitch
+
+    def test_replace_ambiguities(self):
+        """PDPData replaces ambiguities in each sequence."""
+        gdata = PDPData('multi', 'group1', self.seqfile, None, None, None)
+        gdata.replace_ambiguities()
+        self.assert_target('multi_noambig.fas')
+        assert_equal(gdata.offsets, None)
+        assert_equal(gdata.contig_index, None)
+        assert not gdata.has_ambiguities
+
+    def test_fix_sequences(self):
+        """PDPData stitches and replaces ambiguities in a single pass."""
+        gdata = PDPData('multi', 'group1', self.seqfile, None, None, None)
+        gdata.fix_sequences()
+        self.assert_target('multi_concat_noambig.fas')
+        assert_equal(list(gdata.contig_index), self.offsets)
+        # Same output as stitching, then replacing ambiguities
+        gdata = PDPData('multi', 'group1', self.seqfile, None, None, None)
+        gdata.stitch()
+        gdata.replace_ambiguities()
+        self.assert_target('multi_concat_noambig.fas')
+        assert_equal(list(gdata.contig_index), self.offsets)
+
+    def test_chunked(self):
+        """write_fixed_sequences() output does not depend on chunk size."""
+        gdata = PDPData('multi', 'group1', self.seqfile, None, None, None)
+        outfname = os.path.join(self.outdir, 'multi_concat_noambig.fas')
+        for chunksize in (1, 7, 64):
+            offsets = write_fixed_sequences(
+                self.seqfile, outfname, 'multi', gdata.spacer,
+                AMBIGUITIES, chunksize=chunksize)
+            self.assert_target('multi_concat_noambig.fas')
+            assert_equal(offsets, self.offsets)
+
+    def test_empty_record(self):
+        """write_fixed_sequences() keeps records with no sequence."""
+        seqfile = os.path.join(self.outdir, 'empty.fasta')
+        with open(seqfile, 'w') as ofh:
+            ofh.write('>seq1 some desc 1\n>seq2\nACGTRYAC\nGT\n'
+                      '>seq3 desc\n>seq4\nTTNTGKAA\n>seq5\n')
+        # Reference output written with Bio.SeqIO
+        records = list(SeqIO.parse(seqfile, 'fasta'))
+        noambig = [SeqRecord(Seq(re.sub(AMBIGUITIES, 'N', str(rec.seq))),
+                             id=rec.id + '_noambig',
+                             description=rec.description)
+                   for rec in records]
+        catseq = Seq('NNNNN'.join([str(rec.seq) for rec in records]))
+        stitched = [SeqRecord(catseq, id='empty_concatenated',
+                              description='empty, concatenated with spacers')]
+        for fname, name, ambiguities, target in (
+                ('empty_noambig.fas', None, AMBIGUITIES, noambig),
+                ('empty_concat.fas', 'empty', None, stitched)):
+            targetfname = os.path.join(self.outdir, 'target_' + fname)
+            SeqIO.write(target, targetfname, 'fasta')
+            with open(targetfname, 'r') as ifh:
+                expected = ifh.read()
+            outfname = os.path.join(self.outdir, fname)
+            for chunksize in (1, 2, 3, 5, 8, 13, 64):
+                write_fixed_sequences(seqfile, outfname, name, 'NNNNN',
+                                      ambiguities, chunksize=chunksize)
+                with open(outfname, 'r') as ifh:
+                    assert_equal(ifh.read(), expected)
@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""test_pipeline.py
+
+Test running dependency graphs of tasks with resumable state
+
+This test suite is intended to be run from the repository root using:
+
+nosetests -v
+
+(c) The James Hutton Institute 2018
+Author: Leighton Pritchard
+
+Contact:
+leighton.pritchard@hutton.ac.uk
+
+Leighton Pritchard,
+Information and Computing Sciences,
+James Hutton Institute,
+Errol Road,
+Invergowrie,
+Dundee,
+DD6 9LH,
+Scotland,
+UK
+
+The MIT License
+
+Copyright (c) 2018 The James Hutton Institute
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+
+import logging
+import os
+import shutil
+import unittest
+
+from nose.tools import assert_equal, assert_true, raises
+
+from diagnostic_primers import pipeline
+
+
+class TestPipeline(unittest.TestCase):
+
+    """Class defining tests of the pipeline task runner."""
+
+    def setUp(self):
+        """Set parameters for tests."""
+        self.outdir = os.path.join('tests', 'test_output', 'pipeline')
+        self.statefile = os.path.join(self.outdir, 'state.json')
+        if os.path.isdir(self.outdir):
+            shutil.rmtree(self.outdir)
+        os.makedirs(self.outdir)
+        self.finished = []    # names of tasks whose actions ran
+        self.results = {}     # results passed to task updates
+
+        # Null logger for nosetests
+        self.logger = logging.getLogger('TestPipeline logger')
+        self.logger.addHandler(logging.NullHandler())
+
+    def build_tasks(self, delays=None, fail=None):
+        """Returns two chains of two tasks, one for each of inputs a and b
+
+        Each first task writes a file after a delay, and each second task
+        copies it. The command for the fail task exits with an error.
+        """
+        delays = delays or {'a': 0.6, 'b': 0.1}
+        tasks = []
+        for name in ('a', 'b'):
+            outfile = os.path.join(self.outdir, name)
+            clines = {name + '1': "sleep %.1f; echo %s > %s" %
+                      (delays[name], name, outfile),
+                      name + '2': "cp %s %s2" % (outfile, outfile)}
+            if fail in clines:
+                clines[fail] = 'false'
+            tasks.append(pipeline.PDPTask(
+                name + '1', lambda c=clines[name + '1']: c, self.action,
+                self.update(name + '1')))
+            tasks.append(pipeline.PDPTask(
+                name + '2', lambda c=clines[name + '2']: c, self.action,
+                self.update(name + '2'), depends=[name + '1']))
+        tasks.append(pipeline.PDPTask('summary', None, self.action,
+                                      self.update('summary'),
+                                      depends=['a2', 'b2']))
+        return tasks
+
+    def action(self, cline):
+        """Record that a task's action ran, and return its results"""
+        self.finished.append(cline)
+        return {'cline': cline}
+
+    def update(self, name):
+        """Returns update function recording a task's results"""
+        return lambda results: self.results.__setitem__(name, results)
+
+    def run_tasks(self, tasks):
+        """Run tasks, returning names of failed tasks"""
+        return pipeline.run_tasks(tasks, self.statefile, workers=2,
+                                  logger=self.logger)
+
+    def test_overlap(self):
+        """run_tasks() starts tasks as soon as their dependencies finish."""
+        tasks = self.build_tasks()
+        assert_equal(self.run_tasks(tasks), [])
+        clines = {task.name: task.command and task.command() for
+                  task in tasks}
+        # b's chain completes while a1 is still running
+        assert_equal(self.finished, [clines[_] for _ in
+                                     ('b1', 'b2', 'a1', 'a2', 'summary')])
+        assert_true(os.path.isfile(os.path.join(self.outdir, 'a2')))
+
+    def test_resume(self):
+        """run_tasks() reuses results of tasks completed in earlier runs."""
+        self.run_tasks(self.build_tasks())
+        results = dict(self.results)
+        self.finished, self.results = [], {}
+        assert_equal(self.run_tasks(self.build_tasks()), [])
+        assert_equal(self.finished, [])
+        assert_equal(self.results, results)
+
+    def test_rerun_dependents(self):
+        """run_tasks() reruns tasks whose commands or inputs changed."""
+        self.run_tasks(self.build_tasks())
+        self.finished = []
+        self.run_tasks(self.build_tasks(delays={'a': 0.2, 'b': 0.1}))
+        assert_equal([_ and _.split()[0] for _ in self.finished],
+                     ['sleep', 'cp', None])
+
+    def test_failure(self):
+        """run_tasks() does not run tasks that depend on a failed task."""
+        assert_equal(self.run_tasks(self.build_tasks(fail='a1')), ['a1'])
+        assert_equal(sorted(self.results), ['b1', 'b2'])
+        # The failed task, and its dependents, run again when resumed
+        self.finished = []
+        assert_equal(self.run_tasks(self.build_tasks()), [])
+        assert_equal(len(self.finished), 3)
+
+    @raises(pipeline.PDPPipelineError)
+    def test_undefined_dependency(self):
+        """run_tasks() requires tasks to follow their dependencies."""
+        self.run_tasks(self.build_tasks()[::-1])
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""test_primer3py.py
+
+Test in-process primer design with the primer3-py library
+
+This test suite is intended to be run from the repository root using:
+
+nosetests -v
+
+(c) The James Hutton Institute 2018
+Author: Leighton Pritchard
+
+Contact:
+leighton.pritchard@hutton.ac.uk
+
+Leighton Pritchard,
+Information and Computing Sciences,
+James Hutton Institute,
+Errol Road,
+Invergowrie,
+Dundee,
+DD6 9LH,
+Scotland,
+UK
+
+The MIT License
+
+Copyright (c) 2018 The James Hutton Institute
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+
+import os
+import unittest
+
+from Bio import SeqIO
+from Bio.Seq import Seq
+from nose.tools import assert_equal, assert_true, raises
+
+from diagnostic_primers import (config, primer3py)
+
+
+@unittest.skipIf(primer3py.primer3 is None, "primer3-py is not installed")
+class TestPrimer3py(unittest.TestCase):
+
+    """Class defining tests of primer design with primer3-py."""
+
+    def setUp(self):
+        """Set parameters for tests."""
+        self.datadir = os.path.join('tests', 'test_input', 'native')
+        self.outdir = os.path.join('tests', 'test_output', 'primer3py')
+        self.seqfile = os.path.join(self.datadir, 'genome_a.fasta')
+        self.seq = str(SeqIO.read(self.seqfile, 'fasta').seq)
+        self.argdict = {'ep_numreturn': 5, 'ep_psizemin': 50,
+                        'ep_psizemax': 150, 'ep_hybridprobe': False,
+                        'eprimer3_dir': self.outdir}
+        self.coll = config.PDPCollection()
+        self.coll.from_json(os.path.join('tests', 'test_input', 'config',
+                                         'testnative.json'))
+
+    def assert_primers_match(self, primers, seq):
+        """Assert primer positions and sequences match the template."""
+        for primer in primers:
+            fwd = seq[primer.forward_start - 1:
+                      primer.forward_start - 1 + primer.forward_length]
+            rev = seq[primer.reverse_start - 1:
+                      primer.reverse_start - 1 + primer.reverse_length]
+            assert_equal(fwd, primer.forward_seq)
+            assert_equal(str(Seq(rev).reverse_complement()),
+                         primer.reverse_seq)
+            assert_equal(primer.reverse_start + primer.reverse_length -
+                         primer.forward_start, primer.size)
+
+    def test_global_args(self):
+        """build_global_args() converts ePrimer3 options for primer3."""
+        args = primer3py.build_global_args(self.argdict)
+        assert_equal(args['PRIMER_NUM_RETURN'], 5)
+        assert_equal(args['PRIMER_PICK_INTERNAL_OLIGO'], 0)
+        assert_equal(args['PRIMER_PRODUCT_SIZE_RANGE'], [[50, 150]])
+
+    @raises(primer3py.PDPPrimer3Error)
+    def test_global_args_unknown(self):
+        """build_global_args() errors with unsupported ePrimer3 option."""
+        primer3py.build_global_args({'ep_notanoption': 1})
+
+    def test_design_primers(self):
+        """design_primers() reports primers in ePrimer3 coordinates."""
+        primers = primer3py.design_primers(
+            self.seq, primer3py.build_global_args(self.argdict))
+        assert_equal(len(primers), 5)
+        self.assert_primers_match(primers, self.seq)
+
+    def test_design_collection(self):
+        """design_collection() designs named primers to each sequence."""
+        designed = primer3py.design_collection(self.coll, self.outdir,
+                                               self.argdict, workers=2)
+        assert_equal(sorted(designed), ['genome_a', 'genome_b', 'genome_c'])
+        outfile, primers = designed['genome_a']
+        assert_equal(outfile, os.path.join(self.outdir, 'genome_a.eprimer3'))
+        assert_equal([_.name for _ in primers],
+                     ['genome_a_primer_%05d' % idx for idx in range(1, 6)])
+        self.assert_primers_match(primers, self.seq)
+
+    def test_design_windows(self):
+        """design_collection() merges primers designed to windows."""
+        designed = primer3py.design_collection(
+            self.coll, self.outdir, self.argdict, workers=2, window=1000)
+        _, primers = designed['genome_a']
+        self.assert_primers_match(primers, self.seq)
+        keys = [(_.forward_start, _.reverse_start) for _ in primers]
+        assert_equal(len(keys), len(set(keys)))
+        assert_true(len(primers) > 5)  # numreturn applies to each window
+
+    @raises(primer3py.PDPPrimer3Error)
+    def test_unstitched(self):
+        """design_collection() errors with multi-sequence input."""
+        coll = config.PDPCollection()
+        coll.add_data('multi', 'group1',
+                      os.path.join(self.datadir, 'multi.fasta'))
+        primer3py.design_collection(coll, self.outdir, self.argdict)
@@ -47,14 +47,20 @@ OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
 THE SOFTWARE.
 """
 
+import json
 import os
+import random
 import subprocess
 import sys
+import tempfile
+import time
 import unittest
 
+from Bio import SeqIO
 from nose.tools import assert_equal
 
 from diagnostic_primers import (primersearch, config)
+from diagnostic_primers.eprimer3 import load_primers
 
 
 class TestCommands(unittest.TestCase):
@@ -102,3 +108,241 @@ class TestCommands(unittest.TestCase):
         pdpc.from_json(self.inconf)
         primersearch.build_commands(pdpc, self.ps_exe, self.outdir,
                                     self.mismatchpercent)
+
+
+class TestDedup(unittest.TestCase):
+
+    """Class defining tests of deduplicated primer searches."""
+
+    def setUp(self):
+        """Set parameters for tests."""
+        # genome_d shares genome_a's primers
+        self.inconf = os.path.join('tests', 'test_input', 'config',
+                                   'testdedup.json')
+        self.outdir = os.path.join('tests', 'test_output', 'primersearch',
+                                   'dedup')
+        self.refdir = os.path.join('tests', 'test_output', 'primersearch',
+                                   'nodedup')
+        self.mismatchpercent = 10
+
+    def test_dedup_searches(self):
+        """shared primer sets are searched once per target."""
+        pdpc = config.PDPCollection()
+        pdpc.from_json(self.inconf)
+        searches = primersearch.dedup_searches(pdpc, self.outdir)
+        # Five unique primer sets, as genome_a's three are also genome_d's.
+        # Each target is searched with the sets from the other inputs:
+        # genome_a's sets are still needed for genome_d and vice versa
+        assert_equal([len(_[0]) for _ in searches], [5, 4, 4, 5])
+        assert_equal([os.path.basename(_[3]) for _ in searches],
+                     ['pdp_unique_ps_genome_%s.primersearch' % _ for _ in
+                      'abcd'])
+        # EMBOSS route runs one command per target
+        clines = primersearch.build_commands(pdpc, 'primersearch',
+                                             self.outdir,
+                                             self.mismatchpercent, True)
+        assert_equal(len(clines), 4)
+
+    def test_fan_out_results(self):
+        """deduplicated search output matches separate searches."""
+        outfiles = {}
+        for outdir, dedup in ((self.refdir, False), (self.outdir, True)):
+            pdpc = config.PDPCollection()
+            pdpc.from_json(self.inconf)
+            outfiles[dedup] = primersearch.search_collection(
+                pdpc, outdir, self.mismatchpercent, dedup=dedup)
+        assert_equal(sorted(os.path.basename(_) for _ in outfiles[True]),
+                     sorted(os.path.basename(_) for _ in outfiles[False]))
+        for fname in outfiles[False]:
+            with open(fname) as ofh:
+                with open(os.path.join(self.outdir,
+                                       os.path.basename(fname))) as dfh:
+                    assert_equal(dfh.read(), ofh.read())
+        # Each query's JSON file refers to its own output files
+        with open(pdpc.data[3].primersearch) as ifh:
+            psdict = json.load(ifh)
+        assert_equal(psdict['genome_a'],
+                     os.path.join(self.outdir,
+                                  'genome_d_ps_genome_a.primersearch'))
+
+    def test_fan_out_missing_blocks(self):
+        """missing output blocks are fanned out as empty records."""
+        outdir = os.path.join(self.outdir, 'fanout')
+        os.makedirs(outdir, exist_ok=True)
+        # The first block has no leading newline
+        psfile = os.path.join(outdir, 'pdp_unique_ps_genome_b.primersearch')
+        with open(psfile, 'w') as ofh:
+            ofh.write("Primer name pdp_unique_1\nAmplimer 1\n\tdata\n")
+        with open(os.path.join(outdir, 'pdp_unique_primersearch.json'),
+                  'w') as ofh:
+            json.dump({'members': {'genome_a': [['a_1', 'pdp_unique_1'],
+                                                ['a_2', 'pdp_unique_2']]},
+                       'searches': {'genome_b': psfile}}, ofh)
+        outfiles = primersearch.fan_out_results(outdir)
+        with open(outfiles[0]) as ifh:
+            assert_equal(ifh.read(), "\nPrimer name a_1\nAmplimer 1\n" +
+                         "\tdata\n\nPrimer name a_2\n")
+
+
+class TestNativeSearch(unittest.TestCase):
+
+    """Class defining tests of the built-in primer search engine."""
+
+    def setUp(self):
+        """Set parameters for tests."""
+        self.datadir = os.path.join('tests', 'test_input', 'native')
+        self.outdir = os.path.join('tests', 'test_output', 'primersearch')
+        os.makedirs(self.outdir, exist_ok=True)
+        self.primers = load_primers(os.path.join(self.datadir,
+                                                 'genome_a_named.json'),
+                                    'json')
+        self.target = SeqIO.read(os.path.join(self.datadir,
+                                              'genome_b.fasta'), 'fasta')
+        self.index = primersearch.PrimerSearchIndex(self.target)
+        self.mismatchpercent = 10
+
+    def test_allowed_mismatches(self):
+        """allowed mismatches truncate as with EMBOSS."""
+        assert_equal(primersearch.allowed_mismatches('A' * 20, 10), 2)
+        assert_equal(primersearch.allowed_mismatches('A' * 19, 10), 1)
+        assert_equal(primersearch.allowed_mismatches('A' * 22, 0), 0)
+
+    def test_seed_hits(self):
+        """index returns exact seed matches."""
+        seq = str(self.target.seq)
+        for start in (0, 1000, len(seq) - 5):
+            seed = seq[start:start + 5]
+            hits = self.index.seed_hits(seed)
+            assert start in hits
+            for hit in hits:
+                assert_equal(seq[hit:hit + 5], seed)
+
+    def test_find_mismatches(self):
+        """index finds oligos with permitted mismatches only."""
+        oligo = str(self.target.seq)[500:520]
+        mutant = oligo[:4] + primersearch.reverse_complement(oligo[4]) + \
+            oligo[5:]
+        assert_equal(self.index.find(oligo), [(500, 0)])
+        assert_equal(self.index.find(mutant, 1), [(500, 1)])
+        assert_equal(self.index.find(mutant, 0), [])
+
+    def test_search_target(self):
+        """primer sets are found in both orientations."""
+        records = primersearch.search_target(self.primers, [self.index],
+                                             self.mismatchpercent)
+        assert_equal([len(_.amplimers) for _ in records], [1, 1, 0])
+        # First primer set amplifies in the forward orientation
+        amplimer = records[0].amplimers[0]
+        assert_equal((amplimer.start, amplimer.revstart, len(amplimer)),
+                     (1001, 1901, 100))
+        assert_equal(amplimer.forward_seq, self.primers[0].forward_seq)
+        # Second primer set amplifies in the reverse orientation
+        amplimer = records[1].amplimers[0]
+        assert_equal((amplimer.start, amplimer.revstart, len(amplimer)),
+                     (2001, 881, 120))
+        assert_equal(amplimer.forward_seq, self.primers[1].reverse_seq)
+        assert_equal(amplimer.reverse_mismatches, 1)
+
+    def test_write_output(self):
+        """native search results are written in primersearch format."""
+        records = primersearch.search_target(self.primers, [self.index],
+                                             self.mismatchpercent)
+        outfname = os.path.join(self.outdir, 'native.primersearch')
+        primersearch.write_output(records, outfname)
+        parsed = primersearch.parse_output(outfname)
+        assert_equal([(_.name, len(_.amplimers)) for _ in parsed],
+                     [('genome_a_primer_00001', 1),
+                      ('genome_a_primer_00002', 1)])
+        assert_equal(parsed[1].amplimers[0].revstart, 881)
+
+
+class TestParseResults(unittest.TestCase):
+
+    """Class defining tests of the fast PrimerSearch output parser."""
+
+    def setUp(self):
+        """Set parameters for tests."""
+        self.datadir = os.path.join('tests', 'test_input', 'native',
+                                    'primersearch')
+        self.outdir = os.path.join('tests', 'test_output', 'primersearch')
+        os.makedirs(self.outdir, exist_ok=True)
+
+    @staticmethod
+    def amplimer_data(record):
+        """Returns comparable tuples for each amplimer of a record."""
+        return [(_.name, _.sequence, _.start, _.revstart, len(_),
+                 _.forward_seq, _.reverse_seq) for _ in record.amplimers]
+
+    def compare_parsers(self, fname):
+        """Returns (parse_output, parse_results) times for fname."""
+        start = time.time()
+        records = primersearch.parse_output(fname)
+        output_time = time.time() - start
+        start = time.time()
+        result = primersearch.parse_results(fname)
+        results_time = time.time() - start
+        # parse_output() returns a record per amplimer, and omits primers
+        # with no amplimers
+        records = {_.name: _ for _ in records}
+        assert_equal(sorted(records), sorted(result.amplified()))
+        for name, record in records.items():
+            assert_equal(self.amplimer_data(record),
+                         self.amplimer_data(result[name]))
+        return output_time, results_time
+
+    def test_parse_results(self):
+        """fast parser reads the same data as parse_output()."""
+        for fname in sorted(os.listdir(self.datadir)):
+            if fname.endswith('.primersearch'):
+                self.compare_parsers(os.path.join(self.datadir, fname))
+
+    def test_parse_results_index(self):
+        """fast parser result is indexed by primer name."""
+        result = primersearch.parse_results(
+            os.path.join(self.datadir, 'genome_a_ps_genome_b.primersearch'))
+        assert_equal(result.names, ['genome_a_primer_00001',
+                                    'genome_a_primer_00002',
+                                    'genome_a_primer_00003'])
+        assert_equal(list(result.lengths('genome_a_primer_00002')), [120])
+        assert_equal(len(result['genome_a_primer_00003'].amplimers), 0)
+        amplimer = result['genome_a_primer_00002'].amplimers[0]
+        assert_equal(type(amplimer.length), int)
+        assert_equal(result.amplified(110, 300), ['genome_a_primer_00002'])
+
+    @staticmethod
+    def write_random_output(outfname, nprimers, seed=42):
+        """Write PrimerSearch output with up to 40 amplimers per primer."""
+        rng = random.Random(seed)
+        with open(outfname, 'w') as ofh:
+            for pidx in range(nprimers):
+                ofh.write("\nPrimer name primer_%05d\n" % pidx)
+                for aidx in range(rng.randint(0, 40)):
+                    ofh.write(
+                        "Amplimer %d\n\tSequence: target_%d  \n"
+                        "\ttarget description\n"
+                        "\tACGTACGTACGTACGTACGT hits forward strand at %d "
+                        "with 0 mismatches\n"
+                        "\tTTGCATTGCATTGCATTGCA hits reverse strand at [%d] "
+                        "with 1 mismatches\n"
+                        "\tAmplimer length: %d bp\n" %
+                        (aidx + 1, rng.randint(0, 9),
+                         rng.randint(1, 10**6), rng.randint(1, 10**6),
+                         rng.randint(40, 2000)))
+
+    def test_parse_results_random(self):
+        """fast parser reads the same data as parse_output() for many hits."""
+        outfname = os.path.join(self.outdir, 'random.primersearch')
+        self.write_random_output(outfname, 50)
+        self.compare_parsers(outfname)
+
+    @unittest.skipUnless(os.environ.get('PDP_BENCHMARK'),
+                         "set PDP_BENCHMARK to run benchmarks")
+    def test_parse_results_benchmark(self):
+        """fast parser and parse_output() timings on large output."""
+        # 5000 primers with up to 40 amplimers each (~30MB)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            outfname = os.path.join(tmpdir, 'benchmark.primersearch')
+            self.write_random_output(outfname, 5000)
+            output_time, results_time = self.compare_parsers(outfname)
+        print("parse_output(): %.2fs, parse_results(): %.2fs" %
+              (output_time, results_time))
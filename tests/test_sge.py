@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""test_sge.py
+
+Test SGE job submission and status polling, using stand-in qsub/qstat
+scripts
+
+This test suite is intended to be run from the repository root using:
+
+nosetests -v
+
+(c) The James Hutton Institute 2018
+Author: Leighton Pritchard
+
+Contact:
+leighton.pritchard@hutton.ac.uk
+
+Leighton Pritchard,
+Information and Computing Sciences,
+James Hutton Institute,
+Errol Road,
+Invergowrie,
+Dundee,
+DD6 9LH,
+Scotland,
+UK
+
+The MIT License
+
+Copyright (c) 2018 The James Hutton Institute
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+
+import json
+import logging
+import os
+import shutil
+import sys
+import unittest
+
+from nose.tools import assert_equal
+
+from diagnostic_primers import sge, sge_jobs
+
+
+class TestSGE(unittest.TestCase):
+
+    """Class defining tests of SGE job submission and polling."""
+
+    def setUp(self):
+        """Set parameters for tests."""
+        self.datadir = os.path.join('tests', 'test_input', 'sge')
+        self.outdir = os.path.join('tests', 'test_output', 'sge')
+        if os.path.isdir(self.outdir):
+            shutil.rmtree(self.outdir)
+        sge.build_directories(self.outdir)
+        self.statefile = os.path.join(self.outdir, 'qstat.json')
+        self.qsublog = os.path.join(self.outdir, 'qsub.log')
+        self.qsub = ' '.join([sys.executable,
+                              os.path.join(self.datadir, 'fake_qsub.py'),
+                              self.qsublog])
+        self.qstat = ' '.join([sys.executable,
+                               os.path.join(self.datadir, 'fake_qstat.py'),
+                               self.statefile])
+
+        # Null logger for nosetests
+        self.logger = logging.getLogger('TestSGE logger')
+        self.logger.addHandler(logging.NullHandler())
+
+    def write_state(self, jobs):
+        """Write state file for the fake qstat."""
+        with open(self.statefile, 'w') as ofh:
+            json.dump({'jobs': jobs}, ofh)
+
+    def read_calls(self):
+        """Return number of calls made to the fake qstat."""
+        with open(self.statefile) as ifh:
+            return json.load(ifh)['calls']
+
+    def write_exit(self, jobname, task, code):
+        """Write exit status file for a job task."""
+        with open(sge.exit_status_path(self.outdir, jobname, task),
+                  'w') as ofh:
+            ofh.write("%d\n" % code)
+
+    def test_parse_qstat_xml(self):
+        """qstat XML output is parsed to job states."""
+        with open(os.path.join(self.datadir, 'qstat.xml'), 'rb') as ifh:
+            states = sge.parse_qstat_xml(ifh.read())
+        assert_equal(dict(states), {'pdp_1': {'r', 'qw'},
+                                    'pdp_2': {'hqw'},
+                                    'pdp_3': {'Eqw'}})
+
+    def test_wait_for_jobs(self):
+        """jobs are tracked with a single qstat call per poll."""
+        jobs = [sge_jobs.Job("pdp_%d" % idx, "true") for idx in range(50)]
+        self.write_state({job.name: ['r', idx % 3] for idx, job in
+                          enumerate(jobs)})
+        for job in jobs:
+            self.write_exit(job.name, 1, 0)
+        failures = sge.wait_for_jobs(self.outdir, jobs, self.logger,
+                                     self.qstat, interval=0.001)
+        assert_equal(failures, [])
+        assert_equal(self.read_calls(), 3)
+
+    def test_wait_for_jobs_failures(self):
+        """failed tasks are reported with exit codes."""
+        group = sge_jobs.JobGroup("pdp_group", "$cmds",
+                                  arguments={'cmds': ['true'] * 3})
+        jobs = [sge_jobs.Job("pdp_ok", "true"),
+                sge_jobs.Job("pdp_err", "true"), group]
+        self.write_state({'pdp_ok': ['r', 1], 'pdp_err': ['Eqw', 5],
+                          'pdp_group': ['r', 2]})
+        self.write_exit('pdp_ok', 1, 0)
+        for task, code in ((1, 0), (2, 127), (3, 0)):
+            self.write_exit('pdp_group', task, code)
+        failures = sge.wait_for_jobs(self.outdir, jobs, self.logger,
+                                     self.qstat, interval=0.001)
+        assert_equal([(_.job, _.task, _.exitcode) for _ in failures],
+                     [('pdp_err', None, None), ('pdp_group', 2, 127)])
+
+    def test_wait_for_jobs_missing_status(self):
+        """tasks with no exit status are reported after a grace period."""
+        jobs = [sge_jobs.Job("pdp_lost", "true")]
+        self.write_state({})
+        failures = sge.wait_for_jobs(self.outdir, jobs, self.logger,
+                                     self.qstat, interval=0.001)
+        assert_equal([(_.job, _.task, _.exitcode) for _ in failures],
+                     [('pdp_lost', 1, None)])
+        assert_equal(self.read_calls(), sge.SGE_EXIT_GRACE + 1)
+
+    def test_run_dependency_graph(self):
+        """jobs submitted with fake qsub report failing tasks."""
+        self.write_state({})
+        jobs = [sge_jobs.Job("pdp_%06d" % idx, cmd) for idx, cmd in
+                enumerate(["true", "false", "true"])]
+        failures = sge.run_dependency_graph(jobs, self.logger,
+                                            qsub=self.qsub, qstat=self.qstat,
+                                            root_dir=self.outdir)
+        # Jobs are grouped by executable into array jobs
+        with open(self.qsublog) as ifh:
+            assert_equal(sorted(_.split()[2] for _ in ifh),
+                         ['pdp_1', 'pdp_2'])
+        assert_equal([(_.task, _.exitcode) for _ in failures], [(1, 1)])
+
+    def test_compile_jobgroups(self):
+        """jobs are packed into arrays by dependency layer and executable."""
+        stage1 = [sge_jobs.Job("pdp_a%d" % idx, "touch %d" % idx) for
+                  idx in range(5)]
+        stage2 = []
+        for idx, job in reversed(list(enumerate(stage1))):
+            stage2.append(sge_jobs.Job("pdp_b%d" % idx, "cat %d" % idx))
+            stage2[-1].add_dependency(job)
+        stage3 = sge_jobs.Job("pdp_c", "cat 0 1 2 3 4")
+        for job in stage2:
+            stage3.add_dependency(job)
+        groups = sge.compile_jobgroups(stage1 + stage2 + [stage3], 'pdp')
+        assert_equal([(_.name, _.tasks) for _ in groups],
+                     [('pdp_1', 5), ('pdp_2', 5), ('pdp_3', 1)])
+        # Tasks depending on a single task of an earlier array are aligned
+        # with it, and held task by task
+        assert_equal([_.name for _ in groups[1].array_dependencies],
+                     ['pdp_1'])
+        assert_equal(groups[1].dependencies, [])
+        assert_equal(groups[1].arguments['cmds'],
+                     ['"cat %d"' % idx for idx in range(5)])
+        # Other dependencies hold the whole array
+        assert_equal([_.name for _ in groups[2].dependencies], ['pdp_2'])
+        assert_equal(groups[2].array_dependencies, [])
+
+    def test_run_dependency_graph_layers(self):
+        """dependent jobs are submitted as arrays after their dependencies."""
+        self.write_state({})
+        outfiles = [os.path.join(self.outdir, "out_%d.txt" % idx) for
+                    idx in range(20)]
+        jobs = []
+        for idx, outfile in enumerate(outfiles):
+            first = sge_jobs.Job("pdp_a%02d" % idx, "touch %s" % outfile)
+            second = sge_jobs.Job("pdp_b%02d" % idx, "test -f %s" % outfile)
+            second.add_dependency(first)
+            jobs.append(second)
+        failures = sge.run_dependency_graph(jobs, self.logger,
+                                            qsub=self.qsub, qstat=self.qstat,
+                                            root_dir=self.outdir)
+        assert_equal(failures, [])
+        with open(self.qsublog) as ifh:
+            calls = [_.split() for _ in ifh]
+        assert_equal([_[2] for _ in calls], ['pdp_1', 'pdp_2'])
+        assert_equal(calls[1][calls[1].index('-hold_jid_ad') + 1], 'pdp_1')
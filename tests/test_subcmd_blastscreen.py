@@ -64,12 +64,14 @@ THE SOFTWARE.
 import json
 import logging
 import os
+import shutil
 import unittest
 
 from argparse import Namespace
 
 from nose.tools import assert_equal, raises
 
+from diagnostic_primers import eprimer3
 from diagnostic_primers.scripts import subcommands
 
 from tools import (assert_dirfiles_equal, ordered)
@@ -106,6 +108,10 @@ class TestBlastscreenSubcommand(unittest.TestCase):
                 bs_force=True,
                 bs_dir=self.outdir,
                 maxaln=self.maxaln,
+                bs_batch=None,
+                bs_engine='blastn',
+                bs_indexdir=None,
+                bs_seedlen=None,
                 scheduler=self.scheduler,
                 workers=self.workers,
                 verbose=False),
@@ -118,6 +124,10 @@ class TestBlastscreenSubcommand(unittest.TestCase):
                 bs_force=False,
                 bs_dir=self.outdir,
                 maxaln=self.maxaln,
+                bs_batch=None,
+                bs_engine='blastn',
+                bs_indexdir=None,
+                bs_seedlen=None,
                 scheduler=self.scheduler,
                 workers=self.workers,
                 verbose=False),
@@ -130,6 +140,10 @@ class TestBlastscreenSubcommand(unittest.TestCase):
                 bs_force=False,
                 bs_dir=self.outdir,
                 maxaln=self.maxaln,
+                bs_batch=None,
+                bs_engine='blastn',
+                bs_indexdir=None,
+                bs_seedlen=None,
                 scheduler=self.scheduler,
                 workers=self.workers,
                 verbose=False),
@@ -151,6 +165,88 @@ class TestBlastscreenSubcommand(unittest.TestCase):
         self.logger.info("Comparing output sequences/JSON to target")
         assert_dirfiles_equal(self.outdir, self.targetdir)
 
+    def test_blastscreen_batch(self):
+        """blastscreen command screens primers in batched jobs."""
+        args = Namespace(**vars(self.argsdict['run']))
+        args.bs_batch = 3
+        subcommands.subcmd_blastscreen(args, self.logger)
+
+        # Screened primers are the same as for one job per genome
+        with open(os.path.join(self.outconfdir, 'screened.json')) as ofh:
+            with open(os.path.join(self.targetconfdir,
+                                   'screened.json')) as tfh:
+                assert_equal(ordered(json.load(ofh)), ordered(json.load(tfh)))
+        # Output is demultiplexed to the same per-genome files
+        for fname in os.listdir(self.targetdir):
+            assert os.path.isfile(os.path.join(self.outdir, fname))
+
+    def test_blastscreen_native(self):
+        """blastscreen command screens primers with the built-in engine."""
+        # Screen copies of the native test primers against genome_b, so
+        # screened primer files are written to the output directory
+        nativedir = os.path.join('tests', 'test_input', 'native')
+        outdir = os.path.join('tests', 'test_output', 'blastscreen_native')
+        os.makedirs(outdir, exist_ok=True)
+        with open(os.path.join(self.confdir, 'testnative.json')) as ifh:
+            conf = json.load(ifh)
+        for entry in conf:
+            entry['primers'] = shutil.copy(entry['primers'], outdir)
+        infilename = os.path.join(outdir, 'testnative.json')
+        with open(infilename, 'w') as ofh:
+            json.dump(conf, ofh)
+        args = Namespace(**vars(self.argsdict['run']))
+        args.infilename = infilename
+        args.outfilename = os.path.join(outdir, 'screened.json')
+        args.bs_db = os.path.join(nativedir, 'genome_b.fasta')
+        args.bs_dir = os.path.join(outdir, 'blastn')
+        args.bs_engine = 'native'
+        args.bs_indexdir = os.path.join(outdir, 'index')
+        subcommands.subcmd_blastscreen(args, self.logger)
+
+        # genome_a's first two primer sets, and genome_b's own primer set,
+        # match genome_b over their whole length
+        with open(args.outfilename) as ifh:
+            screened = [eprimer3.load_primer_table(_['primers']).names for
+                        _ in json.load(ifh)]
+        assert_equal(screened, [['genome_a_primer_00003'], [],
+                                ['genome_c_primer_00001']])
+
+    def test_blastscreen_native_cache(self):
+        """blastscreen command reuses primer oligo screens from the cache."""
+        nativedir = os.path.join('tests', 'test_input', 'native')
+        outdir = os.path.join('tests', 'test_output', 'blastscreen_cache')
+        if os.path.isdir(outdir):
+            shutil.rmtree(outdir)
+        os.makedirs(outdir)
+        with open(os.path.join(self.confdir, 'testnative.json')) as ifh:
+            conf = json.load(ifh)
+        for entry in conf:
+            entry['primers'] = shutil.copy(entry['primers'], outdir)
+        infilename = os.path.join(outdir, 'testnative.json')
+        with open(infilename, 'w') as ofh:
+            json.dump(conf, ofh)
+        args = Namespace(**vars(self.argsdict['run']))
+        args.infilename = infilename
+        args.outfilename = os.path.join(outdir, 'screened.json')
+        args.bs_db = os.path.join(nativedir, 'genome_b.fasta')
+        args.bs_engine = 'native'
+        args.bs_indexdir = os.path.join(outdir, 'index')
+        args.bs_cachesize = 1000
+        args.cachedir = os.path.join(outdir, 'cache')
+
+        # The second run finds every oligo in the cache, and searches none
+        for run in ('first', 'second'):
+            args.bs_dir = os.path.join(outdir, run)
+            subcommands.subcmd_blastscreen(args, self.logger)
+            with open(args.outfilename) as ifh:
+                screened = [eprimer3.load_primer_table(_['primers']).names
+                            for _ in json.load(ifh)]
+            assert_equal(screened, [['genome_a_primer_00003'], [],
+                                    ['genome_c_primer_00001']])
+        assert os.path.isfile(os.path.join(outdir, 'first', 'oligos.blasttab'))
+        assert not os.path.isfile(os.path.join(outdir, 'second',
+                                               'oligos.blasttab'))
+
     @raises(SystemExit)
     def test_blastscreen_noforce(self):
         """blastscreen command does not overwrite existing folder."""
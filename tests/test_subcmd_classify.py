@@ -70,6 +70,7 @@ from argparse import Namespace
 
 from nose.tools import assert_equal, raises
 
+from diagnostic_primers import classify, config
 from diagnostic_primers.scripts import subcommands
 
 from tools import (assert_dirfiles_equal, ordered)
@@ -95,7 +96,13 @@ class TestClassifySubcommand(unittest.TestCase):
                 infilename=os.path.join(self.confdir, 'testclassify.json'),
                 outdir=self.outdir,
                 cl_force=True,
-                verbose=False)
+                verbose=False),
+            'native':
+            Namespace(
+                infilename=os.path.join(self.confdir, 'testnative_ps.json'),
+                outdir=os.path.join('tests', 'test_output', 'classify_native'),
+                cl_force=True,
+                verbose=False),
         }
 
     def test_classify_run(self):
@@ -105,3 +112,26 @@ class TestClassifySubcommand(unittest.TestCase):
         # Check output:
         self.logger.info("Comparing output primer sequences to targets")
         assert_dirfiles_equal(self.outdir, self.targetdir)
+
+    def test_classify_native(self):
+        """Classify command runs on built-in primersearch output."""
+        subcommands.subcmd_classify(self.argsdict['native'], self.logger)
+
+        # Check output:
+        self.logger.info("Comparing output primer sequences to targets")
+        assert_dirfiles_equal(os.path.join('tests', 'test_output',
+                                           'classify_native'),
+                              os.path.join('tests', 'test_targets',
+                                           'classify_native'))
+
+    @raises(classify.PDPClassifyError)
+    def test_classify_unknown_target(self):
+        """Classify reports PrimerSearch targets not in the collection."""
+        native = config.PDPCollection()
+        native.from_json(self.argsdict['native'].infilename)
+        coll = config.PDPCollection()
+        for genome in native.data[:2]:
+            coll.add_data(genome.name, genome.groups, genome.seqfile,
+                          genome.features, genome.primers,
+                          genome.primersearch)
+        classify.classify_primers(coll)
@@ -75,6 +75,17 @@ from diagnostic_primers.scripts import subcommands
 from tools import (assert_dirfiles_equal, ordered)
 
 
+class RecordingHandler(logging.Handler):
+    """Logging handler that keeps formatted messages."""
+
+    def __init__(self):
+        super(RecordingHandler, self).__init__()
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+
+
 class TestConfigSubcommand(unittest.TestCase):
     """Class defining tests of the pdp.py config subcommand."""
 
@@ -108,6 +119,16 @@ class TestConfigSubcommand(unittest.TestCase):
                 fix_sequences=False,
                 to_json=False,
                 to_tab=False),
+            'validate_parallel':
+            Namespace(
+                infilename=os.path.join(self.datadir, 'testvalidate.json'),
+                verbose=True,
+                validate=True,
+                fix_sequences=False,
+                to_json=False,
+                to_tab=False,
+                scheduler='multiprocessing',
+                workers=2),
             'validate_tsv_good':
             Namespace(
                 infilename=os.path.join(self.datadir, 'testconf.tab'),
@@ -163,6 +184,29 @@ class TestConfigSubcommand(unittest.TestCase):
         subcommands.subcmd_config(self.argsdict['validate_json_good'],
                                   self.logger)
 
+    def test_validate_parallel(self):
+        """config subcmd validates sequences in parallel, in config order."""
+        handler = RecordingHandler()
+        self.logger.addHandler(handler)
+        self.logger.setLevel(logging.INFO)
+        try:
+            subcommands.subcmd_config(self.argsdict['validate_parallel'],
+                                      self.logger)
+        finally:
+            self.logger.removeHandler(handler)
+        # Messages for each sequence are reported in collection order
+        seqfiles = [msg.split(': ')[-1] for msg in handler.messages
+                    if msg.startswith('Sequence file:')]
+        assert_equal(seqfiles,
+                     [os.path.join('tests', 'test_input', 'native', fname)
+                      for fname in ('genome_a.fasta', 'genome_b.fasta',
+                                    'genome_c.fasta', 'multi.fasta')])
+        # Only the multi-sequence file has problems, reported together
+        assert '1 of 4 input sequence(s) have problems' in handler.messages
+        assert_equal(handler.messages[-1].split('\n    ')[1:],
+                     ['multi requires stitch (%s)' % seqfiles[-1],
+                      'multi has non-N ambiguities (%s)' % seqfiles[-1]])
+
     def test_validate_tab_good(self):
         """config subcmd validates known good TSV config file."""
         subcommands.subcmd_config(self.argsdict['validate_tsv_good'],
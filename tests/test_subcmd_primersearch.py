@@ -87,13 +87,18 @@ class TestPrimersearchSubcommand(unittest.TestCase):
                                       'primersearch_cmd')
         self.targetconfdir = os.path.join('tests', 'test_targets', 'config')
         self.confname = 'test_primersearch_cmd.json'
+        self.nativeoutdir = os.path.join('tests', 'test_output',
+                                         'primersearch_native')
+        self.nativetargetdir = os.path.join('tests', 'test_targets',
+                                            'primersearch_native')
+        self.nativeconfname = 'testnative.json'
         self.ps_exe = 'primersearch'
         self.mismatchpercent = 0.1  # This must be in range [0,1]
         self.scheduler = 'multiprocessing'
         self.workers = None
 
         # Make sure output directories exist
-        for outdir in (self.outconfdir, self.outdir):
+        for outdir in (self.outconfdir, self.outdir, self.nativeoutdir):
             os.makedirs(outdir, exist_ok=True)
 
         # null logger
@@ -110,6 +115,23 @@ class TestPrimersearchSubcommand(unittest.TestCase):
                 ps_dir=self.outdir,
                 ps_force=True,
                 mismatchpercent=self.mismatchpercent,
+                ps_engine='emboss',
+                ps_dedup=False,
+                scheduler=self.scheduler,
+                workers=self.workers,
+                verbose=False),
+            'native':
+            Namespace(
+                infilename=os.path.join(self.confdir, self.nativeconfname),
+                outfilename=os.path.join(self.outconfdir,
+                                         'primersearch_' +
+                                         self.nativeconfname),
+                ps_exe=self.ps_exe,
+                ps_dir=self.nativeoutdir,
+                ps_force=True,
+                mismatchpercent=self.mismatchpercent,
+                ps_engine='native',
+                ps_dedup=False,
                 scheduler=self.scheduler,
                 workers=self.workers,
                 verbose=False)
@@ -131,3 +153,36 @@ class TestPrimersearchSubcommand(unittest.TestCase):
         # Check filtered sequences.
         self.logger.info("Comparing output JSON files to targets")
         assert_dirfiles_equal(self.outdir, self.targetdir, filter=('.json', ))
+
+    def test_primersearch_native(self):
+        """primersearch command runs normally with built-in engine."""
+        args = self.argsdict['native']
+        subcommands.subcmd_primersearch(args, self.logger)
+
+        # Check file contents: config
+        with open(args.outfilename) as ofh:
+            with open(os.path.join(self.targetconfdir,
+                                   'primersearch_' +
+                                   self.nativeconfname)) as tfh:
+                assert_equal(ordered(json.load(ofh)), ordered(json.load(tfh)))
+
+        # Check primersearch output and JSON files
+        assert_dirfiles_equal(self.nativeoutdir, self.nativetargetdir)
+
+    def test_primersearch_native_dedup(self):
+        """primersearch with deduplicated searches writes the same output."""
+        args = Namespace(**vars(self.argsdict['native']))
+        args.ps_dedup = True
+        args.ps_dir = os.path.join('tests', 'test_output',
+                                   'primersearch_dedup')
+        args.outfilename = os.path.join(self.outconfdir,
+                                        'primersearch_dedup.json')
+        subcommands.subcmd_primersearch(args, self.logger)
+
+        # Each query's output matches the undeduplicated search
+        psfiles = [_ for _ in os.listdir(self.nativetargetdir) if
+                   _.endswith('.primersearch')]
+        for fname in psfiles:
+            with open(os.path.join(args.ps_dir, fname)) as ofh:
+                with open(os.path.join(self.nativetargetdir, fname)) as tfh:
+                    assert_equal(ofh.read(), tfh.read())
@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""test_subcmd_run.py
+
+Test run subcommand for pdp.py script
+
+This test suite is intended to be run from the repository root using:
+
+nosetests -v
+
+Individual test classes can be run using, e.g.:
+
+$ nosetests -v tests/test_subcommands.py:TestConfigSubcommand
+
+Each command CMD available at the command-line as pdp.py <CMD> is
+tested in its own class (subclassing unittest.TestCase), where the
+setUp() method defines input/output files, a null logger (picked up
+by nosetests), and a dictionary of command lines, keyed by test name
+with values that represent the command-line options.
+
+For each test, command-line options are defined in a Namespace,
+and passed as the sole argument to the appropriate subcommand
+function from subcommands.py.
+
+(c) The James Hutton Institute 2017
+Author: Leighton Pritchard
+
+Contact:
+leighton.pritchard@hutton.ac.uk
+
+Leighton Pritchard,
+Information and Computing Sciences,
+James Hutton Institute,
+Errol Road,
+Invergowrie,
+Dundee,
+DD6 9LH,
+Scotland,
+UK
+
+The MIT License
+
+Copyright (c) 2017 The James Hutton Institute
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+
+import json
+import logging
+import os
+import shutil
+import sys
+import unittest
+
+from nose.tools import assert_equal, assert_true
+
+from diagnostic_primers import pipeline
+from diagnostic_primers.scripts import parsers, subcommands
+from diagnostic_primers.scripts.subcommands.subcmd_run import build_tasks
+from diagnostic_primers.scripts.tools import load_config_json
+
+
+class TestRunSubcommand(unittest.TestCase):
+    """Class defining tests of the pdp.py run subcommand."""
+
+    def setUp(self):
+        """Set parameters for tests."""
+        self.confdir = os.path.join('tests', 'test_input', 'config')
+        self.outdir = os.path.join('tests', 'test_output', 'run')
+        if os.path.isdir(self.outdir):
+            shutil.rmtree(self.outdir)
+
+        # null logger
+        self.logger = logging.getLogger('TestRunSubcommand logger')
+        self.logger.addHandler(logging.NullHandler())
+
+        # Command-line Namespace
+        self.args = parsers.parse_cmdline([
+            'run', os.path.join(self.confdir, 'testnative.json'),
+            self.outdir, '--skip', 'prodigal', '--skip', 'extract'])
+
+    def test_run_pipeline(self):
+        """run command designs, searches and classifies primers."""
+        subcommands.subcmd_run(self.args, self.logger)
+        with open(os.path.join(self.outdir, 'pipeline.json')) as ifh:
+            config = json.load(ifh)
+        for entry in config:
+            assert_true(os.path.isfile(entry['primers']))
+            assert_true(os.path.isfile(entry['primersearch']))
+        assert_true(os.path.isfile(os.path.join(self.outdir, 'classify',
+                                                'summary.tab')))
+
+    def test_run_resume(self):
+        """run command does not rerun tasks completed in earlier runs."""
+        subcommands.subcmd_run(self.args, self.logger)
+        statefile = os.path.join(self.outdir, 'pipeline_state.json')
+        with open(statefile) as ifh:
+            state = json.load(ifh)
+        mtime = os.path.getmtime(statefile)
+        subcommands.subcmd_run(self.args, self.logger)
+        assert_equal(os.path.getmtime(statefile), mtime)
+        with open(statefile) as ifh:
+            assert_equal(json.load(ifh), state)
+
+    def test_run_sge_arrays(self):
+        """run tasks are submitted to SGE as one array job per stage."""
+        sgedata = os.path.join('tests', 'test_input', 'sge')
+        sgedir = os.path.join(self.outdir, 'sge')
+        os.makedirs(sgedir)
+        qsublog = os.path.join(sgedir, 'qsub.log')
+        qstatfile = os.path.join(sgedir, 'qstat.json')
+        with open(qstatfile, 'w') as ofh:
+            json.dump({'jobs': {}}, ofh)
+        self.args.eprimer3_exe = os.path.join(sgedata, 'fake_eprimer3.py')
+        self.args.ps_exe = os.path.join(sgedata, 'fake_primersearch.py')
+        coll = load_config_json(self.args, self.logger)
+        tasks = build_tasks(coll, self.args, self.logger)
+        failed = pipeline.run_tasks(
+            tasks, os.path.join(self.outdir, 'pipeline_state.json'), 'SGE',
+            logger=self.logger, sgedir=sgedir,
+            qsub=' '.join([sys.executable,
+                           os.path.join(sgedata, 'fake_qsub.py'), qsublog]),
+            qstat=' '.join([sys.executable,
+                            os.path.join(sgedata, 'fake_qstat.py'),
+                            qstatfile]))
+        assert_equal(failed, [])
+        # One array for the three ePrimer3 tasks, and one for the six
+        # primersearch tasks
+        with open(qsublog) as ifh:
+            calls = [_.split() for _ in ifh]
+        assert_equal([_[_.index('-t') + 1] for _ in calls], ['1:3', '1:6'])
+        # Primer sets are classified as by the individual subcommands
+        summaries = []
+        for summary in (os.path.join(self.outdir, 'classify'),
+                        os.path.join('tests', 'test_targets',
+                                     'classify_native')):
+            with open(os.path.join(summary, 'summary.tab')) as ifh:
+                summaries.append([_.split('\t')[:2] for _ in ifh])
+        assert_equal(summaries[0], summaries[1])
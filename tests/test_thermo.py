@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""test_thermo.py
+
+Test vectorised calculation of primer thermodynamic properties
+
+This test suite is intended to be run from the repository root using:
+
+nosetests -v
+
+(c) The James Hutton Institute 2018
+Author: Leighton Pritchard
+
+Contact:
+leighton.pritchard@hutton.ac.uk
+
+Leighton Pritchard,
+Information and Computing Sciences,
+James Hutton Institute,
+Errol Road,
+Invergowrie,
+Dundee,
+DD6 9LH,
+Scotland,
+UK
+
+The MIT License
+
+Copyright (c) 2018 The James Hutton Institute
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+
+
+import os
+import unittest
+
+import numpy as np
+
+from diagnostic_primers import thermo
+from diagnostic_primers.eprimer3 import PrimerTable
+
+from nose.tools import assert_equal, assert_true
+
+try:
+    import primer3
+except ImportError:
+    primer3 = None
+
+
+class TestThermo(unittest.TestCase):
+
+    """Class defining tests of primer thermodynamic calculations."""
+
+    def setUp(self):
+        """Set parameters for tests."""
+        self.primerfile = os.path.join('tests', 'test_input', 'eprimer3',
+                                       'GCF_000011605.1_named.json')
+        self.seqs = ['AGCTTGGTACCGAGCTCGGATCC', 'TTTTTTTTTTAAAAAA',
+                     'GCGCGCGCGC', 'ACGTNNACGTACGGCA', 'CCATGGCATGG']
+
+    def test_gc_content(self):
+        """thermo calculates primer GC content."""
+        assert_equal(list(thermo.gc_content(['GGCC', 'ATAT', 'ACGT', ''])),
+                     [100., 0., 50., 0.])
+
+    @unittest.skipIf(primer3 is None, "primer3-py is not installed")
+    def test_melting_temp(self):
+        """thermo melting temperatures agree with primer3."""
+        for conditions in ({}, {'mv_conc': 50, 'dv_conc': 0,
+                                'dntp_conc': 0, 'dna_conc': 50}):
+            tms = thermo.melting_temp(self.seqs, **conditions)
+            for seq, tm in zip(self.seqs, tms):
+                if 'N' not in seq:
+                    self.assertAlmostEqual(
+                        tm, primer3.calc_tm(seq, **conditions), places=6)
+
+    def test_hairpin_dg(self):
+        """thermo scores the most stable hairpin stem."""
+        dgs = thermo.hairpin_dg(['GGGGAAAACCCC', 'GGGGAACCCC', 'AAAAAAAA'])
+        # GGGG:CCCC stem has three GG stacks; with a two-base loop, only
+        # two stacks enclose a loop of at least three bases
+        self.assertAlmostEqual(dgs[0], 3 * thermo.STACK_DG[10 + 2])
+        self.assertAlmostEqual(dgs[1], 2 * thermo.STACK_DG[10 + 2])
+        assert_equal(dgs[2], 0)
+
+    def test_dimer_dg(self):
+        """thermo scores the most stable dimer stem."""
+        # GAATTC is self-complementary: five stacks
+        self.assertAlmostEqual(thermo.dimer_dg(['AAGAATTCAA'])[0],
+                               sum(thermo.STACK_DG[5 * 'ACGT'.index(a) +
+                                                   'ACGT'.index(b)]
+                                   for a, b in zip('GAATT', 'AATTC')))
+        # Pairing with the reverse complement forms the full duplex
+        assert_true(thermo.dimer_dg(['ACGGTCA'], ['TGACCGT'])[0] <
+                    thermo.dimer_dg(['ACGGTCA'], ['TGACCTT'])[0] < 0)
+
+    def test_end_stability(self):
+        """thermo scores 3' end stability."""
+        dgs = thermo.end_stability(['AAAAAGCGCG', 'GCGCGAAAAA'])
+        assert_equal(dgs.shape, (2, ))
+        assert_true(dgs[0] < dgs[1])
+
+    def test_rescore(self):
+        """thermo rescores Tm and GC for a primer table."""
+        primers = PrimerTable.from_json(self.primerfile)
+        rescored = thermo.rescore(primers)
+        assert_equal(len(rescored), len(primers))
+        assert_equal(rescored.column('name'), primers.column('name'))
+        assert_equal(rescored.column('forward_gc'),
+                     [round(_, 2) for _ in thermo.gc_content(
+                         primers.array('forward_seq'))])
+        tms = thermo.melting_temp(primers.array('reverse_seq'))
+        assert_equal(rescored.column('reverse_tm'),
+                     [round(_, 2) for _ in tms])
+
+    def test_filter(self):
+        """thermo filters primer tables on thermodynamic properties."""
+        primers = PrimerTable.from_json(self.primerfile)
+        scores = thermo.score_table(primers)
+        assert_equal(len(thermo.filter_primers(primers)), len(primers))
+        mintm = np.median(scores['forward_tm'])
+        filtered = thermo.filter_primers(primers, mintm=mintm)
+        assert_equal(len(filtered),
+                     int(((scores['forward_tm'] >= mintm) &
+                          (scores['reverse_tm'] >= mintm)).sum()))
+        filtered = thermo.filter_primers(primers, min_dimer_dg=-5)
+        assert_true(all(_ >= -5 for _ in
+                        thermo.score_table(filtered)['pair_dimer_dg']))